@@ -13,7 +13,7 @@ from ..lib.utils import parse_bool
 log = getLogger(__name__)
 
 # this can be modified during development.  it will be reset from setup.py on release.
-CH2_VERSION = '0.41.1'
+CH2_VERSION = '0.42.0'
 # new database on minor releases.  not sure this will always be a good idea.  we will see.
 DB_VERSION = '-'.join(CH2_VERSION.split('.')[:2])
 
@@ -67,8 +67,10 @@ ARG = 'arg'
 BACKUP = 'backup'
 BATCH = 'batch'
 BORDER = 'border'
+CACHE = 'cache'
 CHANGE = 'change'
 CHECK = 'check'
+CHROME = 'chrome'
 CMD = 'cmd'
 COMPACT = 'compact'
 COMPONENT = 'component'
@@ -153,6 +155,8 @@ NOTEBOOKS = 'notebooks'
 NOTEBOOK_DIR = 'notebook-dir'
 O, OUTPUT = 'o', 'output'
 OWNER = 'owner'
+PARTITION = 'partition'
+PARTITIONS = 'partitions'
 PATH = 'path'
 PATTERN = 'pattern'
 PERMANENT = 'permanent'
@@ -171,6 +175,7 @@ READ_ONLY = 'read-only'
 REBUILD = 'rebuild'
 RECORDS = 'records'
 REMOVE = 'remove'
+REPORT = 'report'
 RETIRE = 'retire'
 ROOT = 'root'
 RUN = 'run'
@@ -204,6 +209,7 @@ TABLE = 'table'
 TABLES = 'tables'
 TOKENS = 'tokens'
 TOPIC = 'topic'
+TRACE = 'trace'
 UNDO = 'undo'
 UNSAFE = 'unsafe'
 UNSET = 'unset'
@@ -323,6 +329,12 @@ def make_parser(with_noop=False):
                          help='run only matching pipeline classes')
     process.add_argument(mm(WORKER), metavar='ID', type=int,
                          help='internal use only (identifies sub-process workers)')
+    process.add_argument(mm(TRACE), action='store_true',
+                         help='record timing, queries and rows for each stage (replaces any previous trace)')
+    process.add_argument(mm(REPORT), action='store_true',
+                         help='show the trace from the last run with --trace (does not process)')
+    process.add_argument(mm(CHROME), metavar='FILE',
+                         help='with --report, also save the trace as Chrome trace JSON')
     process.add_argument(ARG, nargs='*', metavar='WORKER_ARG',
                          help=f'internal use only (tasks for {mm(WORKER)})')
 
@@ -440,10 +452,14 @@ def make_parser(with_noop=False):
     db_add_item.add_parser(USER, help='add a user (once per cluster)')
     db_add_item.add_parser(DATABASE, help='add a database (for each version in a cluster)')
     db_add_profile = db_add_item.add_parser(PROFILE, help='add a profile (for each user and version)')
+    db_add_profile.add_argument(mm(PARTITION), action='store_true',
+                                help='partition statistics by year (for very large databases)')
     db_add_profile_profiles = db_add_profile.add_subparsers(title='profile', dest=PROFILE, required=True)
     from ..config.profile import get_profiles
     for name in get_profiles():
         db_add_profile_profiles.add_parser(name)
+    db_add_item.add_parser(PARTITIONS, help='add yearly statistics partitions up to ten years from now '
+                                            '(if partitioned)')
     db_backup = db_cmds.add_parser(BACKUP, help='backup current configuration')
     db_backup_item = db_backup.add_subparsers(title='item to backup', dest=ITEM, required=True)
     db_backup_item.add_parser(SCHEMA, help='backup a schema')
@@ -1,11 +1,12 @@
 from logging import getLogger
 
 from .args import SUB_COMMAND, LIST, PROFILE, ITEM, USERS, SCHEMAS, DATABASES, PROFILES, ADD, DATABASE, SCHEMA, REMOVE, \
-    BACKUP
+    BACKUP, PARTITION, PARTITIONS
 from ..common.db import get_cnxn, add_schema, with_log, remove_schema, remove_database, remove_user, add_database, \
     add_user, list_databases, list_schemas, list_users, backup_schema
 from ..common.md import Markdown
 from ..common.names import USER, assert_name
+from ..config.database import partition_statistic_journal, add_statistic_journal_partitions
 from ..config.profile import get_profile, get_profiles
 from ..sql.support import Base
 
@@ -22,8 +23,9 @@ def db(config):
     > ch2 db list databases
 
     > ch2 db add user
-    > ch2 db add profile PROFILE
+    > ch2 db add profile [--partition] PROFILE
     > ch2 db add database
+    > ch2 db add partitions
 
     > ch2 db remove user
     > ch2 db remove schema
@@ -44,6 +46,10 @@ There is no 'db add schema' because the schema is added implicitly when the prof
 there is no 'db remove profile' because the profile is removed implicitly when the schema is removed
 (a schema contains a profile).
 
+With --partition, statistic_journal is partitioned by time (a partition per year), so that queries
+over a limited time range only read the relevant partitions, and old years are cheap to vacuum.
+Partitions are created up to ten years ahead; 'db add partitions' extends them to ten years from now.
+
 ### Note On Backups
 
 When a schema is deleted it is copied to `original_name:previous`.  This is done so that user entries
@@ -58,7 +64,8 @@ functionality implied or supported.  Backup the database separately if it is imp
             PROFILES: list_profiles},
      ADD: {USER: add_user,
            DATABASE: add_database,
-           PROFILE: add_profile},
+           PROFILE: add_profile,
+           PARTITIONS: add_partitions},
      BACKUP: {SCHEMA: backup_schema},
      REMOVE: {USER: remove_user,
               DATABASE: remove_database,
@@ -75,10 +82,18 @@ def list_profiles(config):
             print(f' ## {name} - lacks docstring\n')
 
 
+def add_partitions(config):
+    with with_log('Adding statistics partitions'), config.db.session_context() as s:
+        add_statistic_journal_partitions(s)
+
+
 def add_profile(config):
     add_schema(config)
     with with_log('Creating tables'):
         Base.metadata.create_all(config.db.engine)
+    if config.args[PARTITION]:
+        with with_log('Partitioning statistics'), config.db.session_context() as s:
+            partition_statistic_journal(s)
     profile = config.args[PROFILE]
     fn, spec = get_profile(profile)
     with with_log(f'Loading profile {profile}'):
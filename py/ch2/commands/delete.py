@@ -2,6 +2,7 @@ from logging import getLogger
 
 from .args import DATE
 from ..sql import ActivityJournal, FileScan
+from ..sql.batch import delete_statistics
 
 log = getLogger(__name__)
 
@@ -19,5 +20,6 @@ Delete an activity from the database.
         log.warning('Deleting file scan')
         s.query(FileScan).filter(FileScan.file_hash_id == activity.file_hash_id).delete()
         log.warning('Deleting activity')
+        delete_statistics(s, [activity.id])
         s.delete(activity)
         log.info('Done')
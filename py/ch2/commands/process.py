@@ -1,8 +1,9 @@
 
 from logging import getLogger
 
-from .args import LIKE, WORKER, ARG, parse_pairs, KARG, FORCE, CPROFILE
+from .args import LIKE, WORKER, ARG, parse_pairs, KARG, FORCE, CPROFILE, REPORT, CHROME, TRACE
 from ..common.args import mm
+from ..lib.trace import report, write_chrome
 from ..pipeline.process import run_pipeline
 from ..sql.tables.pipeline import PipelineType
 
@@ -24,12 +25,25 @@ Delete statistics and then calculate new values.
     > ch2 --dev calculate --like '%Activity%' --force 2020-01-01 -Kn_cpu=1
 
 Calculate activity statistics from 2020 onwards in a single process for debugging.
+
+    > ch2 process --trace
+    > ch2 process --report --chrome trace.json
+
+Record where time goes (tracing is off by default) and then show it (per pipeline, stage and batch)
+and save a trace that can be loaded in chrome://tracing.  Each run with --trace replaces the previous
+trace.
     '''
     args = config.args
+    if args[REPORT]:
+        report(config)
+        if args[CHROME]: write_chrome(config, args[CHROME])
+        return
+    if args[CHROME]:
+        raise Exception(f'{mm(CHROME)} should be used with {mm(REPORT)}')
     if bool(args[WORKER]) != bool(args[ARG]):
         raise Exception(f'{mm(WORKER)} and arguments should be used together')
     if args[LIKE] and args[WORKER]:
         raise Exception(f'{mm(LIKE)} cannot be used with {mm(WORKER)}')
     run_pipeline(config, PipelineType.PROCESS, *args[ARG],
-                 like=args[LIKE], worker=args[WORKER], cprofile=args[CPROFILE],
+                 like=args[LIKE], worker=args[WORKER], cprofile=args[CPROFILE], trace=args[TRACE],
                  **parse_pairs(args[KARG]))
@@ -1,7 +1,9 @@
+import datetime as dt
 from json import dumps
 from logging import getLogger
 
-from sqlalchemy import desc
+from sqlalchemy import desc, MetaData, PrimaryKeyConstraint, UniqueConstraint
+from sqlalchemy.schema import CreateTable, CreateIndex
 
 from ..names import simple_name
 from ..common.names import TIME_ZERO
@@ -276,3 +278,132 @@ def add_activity_topic_field(s, activity_topic, title, sort, type, activity_grou
     return add(s, ActivityTopicField(activity_topic=activity_topic, sort=sort, model=model,
                                      statistic_name=statistic_name))
 
+
+def partition_statistic_journal(s, first_year=1990, last_year=None):
+    '''
+    Replace the (empty) statistic_journal table with one that is partitioned on time, with a partition
+    for each year (and a default partition for anything outside that range, including constants at
+    time zero).  This is optional and should be called on a new schema, before any data are loaded.
+
+    By default the yearly partitions end ten years from now.  Later values go to the default partition
+    (which works, but is not pruned) until add_statistic_journal_partitions (ch2 db add partitions) is
+    called.
+
+    The new table is generated from the ORM definition, but Postgres requires the partition key in the
+    primary key and unique constraints, so the primary key becomes (id, time) and time is added to the
+    unique constraints.  The mapper still identifies entries by id alone (which is unique because it
+    comes from a sequence).
+
+    A partitioned table cannot be the target of a foreign key, so the foreign keys to statistic_journal.id
+    are dropped and their cascades replaced by triggers.  This loses some integrity - nothing stops a
+    typed value or measure referring to a missing entry, and ids are no longer checked to be unique.
+    '''
+    from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES, StatisticJournal, StatisticMeasure
+    from ..sql.triggers import child_cascade_sql
+    if last_year is None: last_year = dt.date.today().year + 10
+    if s.query(StatisticJournal).count():
+        raise Exception('Cannot partition statistic_journal once it contains data')
+    log.info(f'Partitioning statistic_journal for {first_year} - {last_year}')
+    table = StatisticJournal.__table__
+    expected = set(cls.__tablename__ for cls in STATISTIC_JOURNAL_CLASSES.values()) | \
+               {StatisticMeasure.__tablename__}
+    for child, constraint in s.execute('''
+select t.relname, c.conname
+  from pg_constraint as c
+  join pg_class as t on t.oid = c.conrelid
+ where c.contype = 'f'
+   and c.confrelid = cast(:parent as regclass)''', {'parent': table.name}).fetchall():
+        if child not in expected:
+            raise Exception(f'Cannot partition statistic_journal with an unexpected foreign key from {child}')
+        log.warning(f'Dropping foreign key {constraint} from {child} to {table.name}')
+        s.execute(f'alter table "{child}" drop constraint "{constraint}"')
+    # no cascade - anything else that depends on the table is an error
+    s.execute(f'drop table "{table.name}"')
+    for ddl in partitioned_ddl(table, table.c.time):
+        s.execute(ddl)
+    s.execute(f'create table "{table.name}_default" partition of "{table.name}" default')
+    for year in range(first_year, last_year + 1):
+        s.execute(year_partition_sql(table.name, year))
+    for cls in STATISTIC_JOURNAL_CLASSES.values():
+        s.execute(child_cascade_sql(table.name, cls.__tablename__,
+                                    cls.__mapper_args__['polymorphic_identity']))
+    # previously a foreign key with cascade
+    s.execute('''
+create or replace function statistic_measure_cascade() returns trigger as $$
+  begin
+    delete from statistic_measure using old_rows where statistic_measure.statistic_journal_id = old_rows.id;
+    return null;
+  end
+$$ language plpgsql;
+ create trigger statistic_measure_cascade_trg
+  after delete on statistic_journal
+    referencing old table as old_rows
+    for each statement
+execute procedure statistic_measure_cascade();
+''')
+    s.commit()
+
+
+def add_statistic_journal_partitions(s, last_year=None):
+    '''
+    Add the missing yearly partitions after the last existing partition of a partitioned statistic_journal,
+    up to last_year (by default ten years from now).  Values for those years that are already in the
+    default partition are moved to the new partitions.
+    '''
+    from ..sql.tables.statistic import StatisticJournal
+    if last_year is None: last_year = dt.date.today().year + 10
+    table = StatisticJournal.__tablename__
+    default = f'{table}_default'
+    partitions = [name for (name,) in s.execute('''
+select c.relname
+  from pg_inherits as i
+  join pg_class as c on c.oid = i.inhrelid
+ where i.inhparent = cast(:parent as regclass)''', {'parent': table}).fetchall()]
+    years = [int(name[len(table) + 1:]) for name in partitions if name != default]
+    if not years:
+        raise Exception(f'{table} is not partitioned')
+    if max(years) >= last_year:
+        log.info(f'Partitions for {table} already extend to {max(years)}')
+        return
+    log.info(f'Adding partitions to {table} for {max(years) + 1} - {last_year}')
+    # a new partition cannot overlap values in the default partition, so detach it while they are moved
+    s.execute(f'alter table "{table}" detach partition "{default}"')
+    for year in range(max(years) + 1, last_year + 1):
+        s.execute(year_partition_sql(table, year))
+        range_ = f"time >= '{year}-01-01 00:00:00+00' and time < '{year + 1}-01-01 00:00:00+00'"
+        s.execute(f'insert into "{table}" select * from "{default}" where {range_}')
+        s.execute(f'delete from "{default}" where {range_}')
+    s.execute(f'alter table "{table}" attach partition "{default}" default')
+    s.commit()
+
+
+def year_partition_sql(table, year):
+    return f'''
+create table "{table}_{year}" partition of "{table}"
+  for values from ('{year}-01-01 00:00:00+00') to ('{year + 1}-01-01 00:00:00+00');
+'''
+
+
+def partitioned_ddl(table, key):
+    '''
+    DDL (table and indices) for a copy of the given table that is partitioned by range on the key column,
+    which is added to the primary key and unique constraints.
+    '''
+    metadata = MetaData()
+    for foreign_key in table.foreign_keys:
+        foreign_key.column.table.tometadata(metadata)
+    copy = table.tometadata(metadata)
+    copy.dialect_kwargs['postgresql_partition_by'] = f'range ({key.name})'
+    copy.c[key.name].primary_key = True
+    # still serial, although no longer the only column in the primary key
+    for column in table.primary_key.columns:
+        copy.c[column.name].autoincrement = True
+    copy.append_constraint(PrimaryKeyConstraint(*[column.name for column in table.primary_key.columns],
+                                                key.name))
+    for unique in [constraint for constraint in copy.constraints if isinstance(constraint, UniqueConstraint)]:
+        if key.name not in unique.columns.keys():
+            copy.constraints.discard(unique)
+            copy.append_constraint(UniqueConstraint(*unique.columns.keys(), key.name))
+    yield CreateTable(copy)
+    for index in copy.indexes:
+        yield CreateIndex(index)
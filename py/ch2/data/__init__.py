@@ -2,7 +2,7 @@
 from .climb import climb_sources
 from .constraint import constrained_sources
 from .frame import session, nearby_activities, bookmarks, present, linear_resample_time, \
-    groups_by_time, transform, drop_empty, read_query
+    groups_by_time, transform, drop_empty, read_query, iter_query, empty_query
 from .heart_rate import *
 from .lib import inplace_decay
 from .plot import col_to_boxstats, box_plot, line_plotter, dot_plotter, bar_plotter, add_climbs, multi_plot, \
@@ -15,16 +15,45 @@ from ..sql.database import connect, ActivityTimespan, ActivityBookmark, Composit
 
 log = getLogger(__name__)
 
+DEFAULT_CHUNKSIZE = 100000
 
 
-def read_query(query, index=None):
+def read_query(query, index=None, chunksize=None):
     '''
     Convert s.query(OrmClass) to a dataframe
     https://stackoverflow.com/questions/29525808/sqlalchemy-orm-conversion-to-pandas-dataframe
+
+    If chunksize is given the rows are streamed (see iter_query), so that the whole result is never
+    held by the database driver.  But the chunks are still combined into a single frame - callers that
+    need bounded memory should consume iter_query directly.
     '''
+    if chunksize:
+        chunks = list(iter_query(query, index=index, chunksize=chunksize))
+        if not chunks:
+            # an empty result may give no chunks at all
+            return empty_query(query, index=index)
+        return pd.concat(chunks) if len(chunks) > 1 else chunks[0]
     return pd.read_sql(query.statement, query.session.bind, index_col=index)
 
 
+def empty_query(query, index=None):
+    '''
+    An empty dataframe with the columns that the query would return.
+    '''
+    df = pd.DataFrame(columns=[column.name for column in query.statement.c])
+    return df.set_index(index) if index else df
+
+
+def iter_query(query, index=None, chunksize=DEFAULT_CHUNKSIZE):
+    '''
+    Convert s.query(OrmClass) to a sequence of dataframes, each of at most chunksize rows, read through
+    a server-side (named) cursor so that memory use is bounded.
+    '''
+    with query.session.bind.connect() as connection:
+        connection = connection.execution_options(stream_results=True)
+        yield from pd.read_sql(query.statement, connection, index_col=index, chunksize=chunksize)
+
+
 def session(*args):
     '''
     Create a database session (used in Jupyter templates)
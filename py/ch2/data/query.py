@@ -1,4 +1,5 @@
 import datetime as dt
+from collections import defaultdict
 from logging import getLogger
 
 import numpy as np
@@ -7,25 +8,29 @@ import pytz
 from sqlalchemy import asc, desc, distinct
 from sqlalchemy.orm import aliased
 
-from ..common.date import YMD
+from ..common.date import YMD, to_time
 from ..common.log import log_current_exception
-from ..common.names import TIME_ZERO
-from ..data import read_query
+from ..common.names import TIME_ZERO, UNDEF
+from ..data import read_query, iter_query
+from ..data.frame import DEFAULT_CHUNKSIZE
 from ..data import session, present
 from ..lib import time_to_local_time
 from ..lib.utils import timing
 from ..names import Names as N, like, MED_WINDOW, SPACE, simple_name
-from ..sql import StatisticName, ActivityGroup, StatisticJournal, ActivityTimespan, ActivityJournal, Source
-from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES
+from ..sql import StatisticName, ActivityGroup, StatisticJournal, ActivityTimespan, ActivityJournal, Source, \
+    StatisticSeries
+from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES, StatisticJournalInteger
 from ..sql.types import short_cls
 
 log = getLogger(__name__)
 
+VALUE, STATISTIC_NAME_ID, SOURCE_ID = 'value', 'statistic_name_id', 'source_id'
+
 
 class Statistics:
 
     def __init__(self, s, start=None, finish=None, sources=None, with_timespan=False, with_sources=False,
-                 activity_journal=None, activity_group=None, bookmarks=None, warn_over=1):
+                 activity_journal=None, activity_group=None, bookmarks=None, warn_over=1, chunksize=None):
         '''
         Specify any general constraints when constructing the object, then request particular statistics
         using by_name and by_group.
@@ -34,6 +39,11 @@ class Statistics:
 
         The final dataframe can be retrieved directly via df or, via with_, additional processing can
         be made to rename columns, add statistics, etc.
+
+        Values stored as arrays in statistic_series are included transparently.
+
+        For large reads (eg the whole history), chunksize streams rows from the database rather than
+        buffering the entire result in the driver.
         '''
         self.__s = s
         self.__start = start
@@ -47,7 +57,10 @@ class Statistics:
         self.__with_sources = with_sources
         self.__activity_group = activity_group
         self.__warn_over = warn_over
+        self.__chunksize = chunksize
         self.__statistic_names = {}
+        self.__series = {}  # (owner, activity group id) -> statistic_series rows
+        self.__decoded = {}  # statistic_series id -> arrays
         self.__df = None
         if bookmarks: raise Exception('TODO')
 
@@ -84,16 +97,46 @@ class Statistics:
         return columns
 
     def by_name(self, owner, *names, like=False):
+        '''
+        All the names are read together, with a single query for each journal type, and then pivoted
+        (rather than joined) into columns.
+        '''
+        found = {}
         for name in names:
             for statistic_name, type_class in self.__name_and_type(name, owner, like):
-                label = statistic_name.name
-                log.info(f'Retrieving {label}')
-                q = self.__s.query(*self.__columns(type_class, label)). \
-                    filter(type_class.statistic_name_id == statistic_name.id)
-                q = self.__constrain_journal(q).order_by(N.INDEX)
-                with timing(f'Slow query for {label}?\n{q}', self.__warn_over):
-                    df = read_query(q, index=N.INDEX)
-                self.__merge(df)
+                found[statistic_name.id] = (statistic_name, type_class)
+        by_type = defaultdict(list)
+        for statistic_name, type_class in found.values():
+            by_type[type_class].append(statistic_name)
+        rows = defaultdict(list)
+        for type_class, statistic_names in by_type.items():
+            log.info(f'Retrieving {", ".join(statistic_name.name for statistic_name in statistic_names)}')
+            q = self.__s.query(type_class.time.label(N.INDEX), type_class.value.label(VALUE),
+                               type_class.statistic_name_id.label(STATISTIC_NAME_ID),
+                               type_class.source_id.label(SOURCE_ID)). \
+                filter(type_class.statistic_name_id.in_([statistic_name.id for statistic_name in statistic_names]))
+            q = self.__constrain_journal(q).order_by(N.INDEX)
+            with timing(f'Slow query for {type_class.__name__}?\n{q}', self.__warn_over):
+                # when chunked, each chunk is split by name as it arrives (so is not held twice)
+                for df in iter_query(q, chunksize=self.__chunksize) if self.__chunksize else [read_query(q)]:
+                    for id, group in df.groupby(STATISTIC_NAME_ID, sort=False):
+                        rows[id].append(group)
+        dfs = []
+        for id, (statistic_name, type_class) in found.items():
+            label = statistic_name.name
+            groups = rows.pop(id, None)
+            if groups:
+                group = pd.concat(groups) if len(groups) > 1 else groups[0]
+            else:
+                # typed, so that the index is still a DatetimeIndex when there are no values
+                group = pd.DataFrame({N.INDEX: pd.DatetimeIndex([], tz='UTC'), VALUE: [], SOURCE_ID: []})
+            df = pd.DataFrame({label: group[VALUE].to_numpy()}, index=pd.Index(group[N.INDEX], name=N.INDEX))
+            if self.__with_sources:
+                df[N._src(label)] = group[SOURCE_ID].to_numpy()
+            dfs.append(self.__with_series(df, statistic_name, type_class, label))
+        if dfs:
+            with timing(f'Slow pivot of {", ".join(found[id][0].name for id in found)}?', self.__warn_over):
+                self.__merge(pivot(dfs))
         return self
 
     def by_group(self, owner, *names, like=False):
@@ -104,9 +147,15 @@ class Statistics:
                     filter(StatisticJournal.statistic_name_id == statistic_name.id)
                 q_group_ids = self.__constrain_journal(q_group_ids)
                 with timing(f'Slow query for group ids\n{q_group_ids}?', self.__warn_over):
-                    activity_group_ids = q_group_ids.all()
-                for row in activity_group_ids:
-                    activity_group_id = row[0]
+                    activity_group_ids = set(row[0] for row in q_group_ids.all())
+                    series_group_ids = set()
+                    if StatisticSeries.in_use(self.__s):
+                        q_series_group_ids = self.__s.query(distinct(Source.activity_group_id)). \
+                            join(StatisticSeries, StatisticSeries.source_id == Source.id). \
+                            filter(StatisticSeries.owner == statistic_name.owner)
+                        q_series_group_ids = self.__constrain_series(q_series_group_ids)
+                        series_group_ids = set(row[0] for row in q_series_group_ids.all())
+                for activity_group_id in sorted(activity_group_ids | series_group_ids, key=lambda id: id or 0):
                     if activity_group_id:
                         activity_group = self.__s.query(ActivityGroup). \
                             filter(ActivityGroup.id == activity_group_id).one()
@@ -120,8 +169,11 @@ class Statistics:
                         filter(Source.activity_group_id == activity_group_id)
                     q = self.__constrain_journal(q).order_by(N.INDEX)
                     with timing(f'Slow query for {label}?\n{q}', self.__warn_over):
-                        df = read_query(q, index=N.INDEX)
-                    self.__merge(df)
+                        df = read_query(q, index=N.INDEX, chunksize=self.__chunksize)
+                    df = self.__with_series(df, statistic_name, type_class, label,
+                                            activity_group_id=activity_group_id)
+                    if len(df) or activity_group_id in activity_group_ids:
+                        self.__merge(df)
         return self
 
     def __constrain_journal(self, q):
@@ -136,6 +188,51 @@ class Statistics:
                 filter(source.activity_group_id == self.__activity_group.id)
         return q
 
+    def __constrain_series(self, q):
+        if self.__start: q = q.filter(StatisticSeries.finish >= self.__start)
+        if self.__finish: q = q.filter(StatisticSeries.start < self.__finish)
+        if self.__sources:
+            q = q.filter(StatisticSeries.source_id.in_([source.id for source in self.__sources]))
+        elif self.__activity_group:
+            source = aliased(Source)
+            q = q.join(source, source.id == StatisticSeries.source_id). \
+                filter(source.activity_group_id == self.__activity_group.id)
+        return q
+
+    def __with_series(self, df, statistic_name, type_class, label, activity_group_id=UNDEF):
+        '''
+        Add any values for the statistic stored in statistic_series to those read from statistic_journal.
+        '''
+        if not StatisticSeries.in_use(self.__s):
+            return df
+        key = (statistic_name.owner, activity_group_id)
+        if key not in self.__series:
+            q = self.__s.query(StatisticSeries).filter(StatisticSeries.owner == statistic_name.owner)
+            if activity_group_id is not UNDEF:
+                q = q.join(Source, StatisticSeries.source_id == Source.id). \
+                    filter(Source.activity_group_id == activity_group_id)
+            self.__series[key] = self.__constrain_series(q).all()
+        dfs = [df] if len(df) else []
+        for series in self.__series[key]:
+            if series.id not in self.__decoded:
+                with timing(f'Slow decode of {series}?', self.__warn_over):
+                    self.__decoded[series.id] = series.decode()
+            if statistic_name.id in self.__decoded[series.id]:
+                times, values, _ = self.__decoded[series.id][statistic_name.id]
+                if type_class is StatisticJournalInteger:
+                    values = np.round(values).astype(np.int64)
+                series_df = pd.DataFrame({label: values}, index=pd.to_datetime(times, unit='us', utc=True))
+                series_df.index.name = N.INDEX
+                if self.__with_sources:
+                    series_df[N._src(label)] = series.source_id
+                if self.__start: series_df = series_df.loc[series_df.index >= to_time(self.__start)]
+                if self.__finish: series_df = series_df.loc[series_df.index < to_time(self.__finish)]
+                dfs.append(series_df)
+        if len(dfs) > 1 or (dfs and dfs[0] is not df):
+            return pd.concat(dfs).sort_index(kind='stable')
+        else:
+            return df
+
     def __merge(self, df):
         if self.__df is None:
             self.__df = df
@@ -145,10 +242,19 @@ class Statistics:
 
     def __add_timespan(self):
         self.__df[N.TIMESPAN_ID] = np.nan
-        for id, start, finish in self.__s.query(ActivityTimespan.id,
-                                                ActivityTimespan.start, ActivityTimespan.finish). \
-                filter(ActivityTimespan.activity_journal_id.in_([source.id for source in self.__sources])):
-            self.__df.loc[start:finish, [N.TIMESPAN_ID]] = id
+        timespans = self.__s.query(ActivityTimespan.id, ActivityTimespan.start, ActivityTimespan.finish). \
+            filter(ActivityTimespan.activity_journal_id.in_([source.id for source in self.__sources])). \
+            order_by(ActivityTimespan.start).all()
+        if timespans and len(self.__df):
+            ids, starts, finishes = zip(*timespans)
+            starts = pd.to_datetime(starts, utc=True).values
+            finishes = pd.to_datetime(finishes, utc=True).values
+            # the last timespan starting at or before each time, if the time is also before it finishes
+            times = pd.to_datetime(self.__df.index, utc=True).values
+            i = np.searchsorted(starts, times, side='right') - 1
+            inside = i >= 0
+            inside[inside] = times[inside] <= finishes[i[inside]]
+            self.__df.loc[inside, N.TIMESPAN_ID] = np.array(ids, dtype=float)[i[inside]]
 
     @property
     def df(self):
@@ -328,6 +434,34 @@ class Data:
         return self
 
 
+def pivot(dfs):
+    '''
+    Combine time-indexed frames into a single frame, by scattering values into columns over the union
+    of their (sorted) indices.  This is equivalent to successive outer joins, but much faster.  It
+    assumes times are unique within each frame (if not, it falls back to joins).
+    '''
+    if len(dfs) == 1:
+        return dfs[0]
+    if not all(df.index.is_unique for df in dfs):
+        df = dfs[0]
+        for other in dfs[1:]:
+            df = df.join(other, how='outer')
+        return df
+    present = [df for df in dfs if len(df)]
+    times = np.unique(np.concatenate([df.index.values for df in present])) if present else np.array([], dtype='M8[ns]')
+    columns = {}
+    for df in dfs:
+        positions = np.searchsorted(times, df.index.values)
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if len(values) == len(times):
+                columns[column] = values  # complete, so keep original type
+            else:
+                columns[column] = np.full(len(times), np.nan, dtype=float if values.dtype.kind in 'biuf' else object)
+                columns[column][positions] = values
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(times, name=N.INDEX).tz_localize('UTC'))
+
+
 def set_times_from_index(df):
     df.loc[:, N.TIME] = pd.to_datetime(df.index)
     df.loc[:, N.LOCAL_TIME] = df[N.TIME].apply(lambda x: time_to_local_time(x.to_pydatetime(), YMD))
@@ -348,15 +482,15 @@ def std_health_statistics(s, freq='1h'):
                                              end=finish.replace(tzinfo=pytz.UTC), freq=freq))
     set_times_from_index(stats)
 
-    stats = Statistics(s). \
+    stats = Statistics(s, chunksize=DEFAULT_CHUNKSIZE). \
         by_name(ResponseCalculator, N.DEFAULT_ANY, like=True).with_. \
         drop_prefix(N.DEFAULT + SPACE).into(stats, tolerance='30m')
 
-    stats = Statistics(s). \
+    stats = Statistics(s, chunksize=DEFAULT_CHUNKSIZE). \
         by_name(ActivityCalculator, N._delta(N.DEFAULT_ANY), like=True).with_. \
         rename_with_units(N.REST_HR).into(stats, tolerance='30m')
 
-    stats = Statistics(s).\
+    stats = Statistics(s, chunksize=DEFAULT_CHUNKSIZE).\
         by_group(ActivityCalculator, N.ACTIVE_TIME, N.ACTIVE_DISTANCE).with_. \
         coalesce_groups(N.ACTIVE_TIME, N.ACTIVE_DISTANCE). \
         rename_with_units(N.ACTIVE_TIME, N.ACTIVE_DISTANCE). \
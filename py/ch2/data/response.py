@@ -48,6 +48,19 @@ def calc_response(data, params):
     return response[RESPONSE]
 
 
+def continue_response(data, period, initial):
+    '''
+    Continue the response from a known (unscaled) value at the first time in data.  Since the model is a
+    linear decay this gives the same values as calculating from the start of the data.
+    '''
+    response = data.rename(columns={IMPULSE_3600: RESPONSE})  # copy
+    decay, alpha = decay_params(period)
+    # correct by alpha so that the value matches (see decay_inplace)
+    response.at[response.index[0], RESPONSE] = initial * alpha
+    inplace_decay(response, RESPONSE, period)
+    return response[RESPONSE]
+
+
 def restrict_response(response, performances):
     # we're only interested in the FF model at the times that correspond to performance measurements
     return [response.reindex(index=performance.index, method='nearest')
@@ -0,0 +1,104 @@
+from glob import glob
+from logging import getLogger
+from os import utime, stat, unlink, replace
+from os.path import join
+from pickle import dumps, loads
+
+import numpy as np
+
+from .format.records import DictRecord
+from .profile.profile import profile_version
+from ..common.io import data_hash
+
+log = getLogger(__name__)
+
+# increment if the decoded data (or the way they are stored) change
+CACHE_VERSION = 1
+DEFAULT_CACHE_MB = 1000
+OTHERS = '__others__'
+
+
+class FitCache:
+    '''
+    Decoded FIT data on disk, keyed by the hash of the original file (FileHash.hash), the profile, and
+    the requested names.  Each entry is an .npz file holding one array per column, plus the (few) other
+    records pickled into a byte array.
+
+    Reading an entry touches the file, so mtime gives LRU order, and the least recently used entries are
+    deleted when the total size exceeds max_mb.  The directory is scanned on the first write and then only
+    when a running total (of that scan plus later writes by this instance) exceeds max_mb, so the limit is
+    approximate when several processes share the cache.
+
+    Because the other records are unpickled when read, the cache directory must be trusted: anyone who can
+    write there can run code as the user.  It is in the user's own data directory (see CACHE in
+    ch2.commands.args) and is not intended to be shared.
+    '''
+
+    def __init__(self, dir, max_mb=DEFAULT_CACHE_MB, profile_path=None):
+        self.__dir = dir
+        self.__max_bytes = max_mb * 1024 ** 2
+        self.__profile_version = profile_version(profile_path=profile_path)
+        self.__total = None  # estimated size of the cache (None until the directory is scanned)
+
+    def __path(self, hash, field_names, other_names):
+        key = data_hash(repr((CACHE_VERSION, self.__profile_version, tuple(field_names), tuple(other_names))))
+        return join(self.__dir, f'{hash}-{key[:8]}.npz')
+
+    def read(self, hash, field_names, other_names):
+        path = self.__path(hash, field_names, other_names)
+        try:
+            with np.load(path) as npz:
+                columns = {name: npz[name] for name in npz.files if name != OTHERS}
+                others = [DictRecord(name, number, None, timestamp, data)
+                          for name, number, timestamp, data in loads(npz[OTHERS].tobytes())]
+            utime(path)
+            log.debug(f'Read {path}')
+            return columns, others
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f'Discarding cache entry {path} ({e})')
+            self.__unlink(path)
+            return None
+
+    def write(self, hash, field_names, other_names, columns, others):
+        path = self.__path(hash, field_names, other_names)
+        others = [(record.name, record.number, record.timestamp, record.data) for record in others]
+        size = 0
+        try:
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as output:
+                np.savez(output, **columns, **{OTHERS: np.frombuffer(dumps(others), dtype=np.uint8)})
+            replace(tmp, path)  # atomic, so parallel readers never see a partial file
+            size = stat(path).st_size
+            log.debug(f'Wrote {path}')
+        except Exception as e:
+            log.warning(f'Could not write cache entry {path} ({e})')
+        self.__evict(size)
+
+    def __evict(self, size):
+        if self.__total is not None:
+            self.__total += size
+            if self.__total <= self.__max_bytes: return
+        entries = []
+        for path in glob(join(self.__dir, '*.npz')):
+            try:
+                entries.append((stat(path), path))
+            except FileNotFoundError:
+                pass  # evicted by another worker
+        total, kept = 0, 0
+        for st, path in sorted(entries, key=lambda entry: entry[0].st_mtime, reverse=True):
+            total += st.st_size
+            if total > self.__max_bytes:
+                log.debug(f'Evicting {path}')
+                self.__unlink(path)
+            else:
+                kept = total
+        self.__total = kept
+
+    @staticmethod
+    def __unlink(path):
+        try:
+            unlink(path)
+        except FileNotFoundError:
+            pass
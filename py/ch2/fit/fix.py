@@ -4,7 +4,7 @@ from logging import getLogger
 
 import pytz
 
-from .format.tokens import FileHeader, token_factory, Checksum, State
+from .format.tokens import FileHeader, token_factory, Checksum, State, Crc
 from .profile.profile import read_profile
 from ..commands.args import ADD_HEADER, HEADER_SIZE, PROFILE_VERSION, PROTOCOL_VERSION, MIN_SYNC_CNT, \
     MAX_RECORD_LEN, MAX_DROP_CNT, MAX_BACK_CNT, MAX_FWD_LEN, MAX_DELTA_T
@@ -143,8 +143,10 @@ def header_and_checksums(data, initial_state, fix_header=False, fix_checksum=Fal
     if fix_checksum:
         data = process_checksum(data, initial_state.copy())
     if fix_header and fix_checksum:
+        header = bytes(data[:data[0]])
         data = process_header(data)  # if length changed with checksum
-        data = process_checksum(data, initial_state.copy())  # if length changed
+        if data[:data[0]] != header:
+            data = process_checksum(data, initial_state.copy())  # if length changed
     return data
 
 
@@ -173,10 +175,14 @@ def process_header(data, header_size=None, protocol_version=None, profile_versio
 def process_checksum(data, state):
     offset = 0
     try:
-        # don't use memoryview here as it gets spread into state and token
-        offset = len(FileHeader(data))
-        while len(data) - offset > 2:
-            token = token_factory(data[offset:], state)
+        # tokens (and so state) keep views of the data, which would stop a bytearray being extended below,
+        # so walk a view of a snapshot (a single copy, rather than a copy of the remaining data per token)
+        view = memoryview(bytes(data))
+        offset = len(FileHeader(view))
+        crc = Crc(view[:offset])
+        while len(view) - offset > 2:
+            token = token_factory(view[offset:], state)
+            crc.update(view[offset:offset+len(token)])
             offset += len(token)
         if len(data) - offset < 2:
             n = offset + 2 - len(data)
@@ -184,7 +190,7 @@ def process_checksum(data, state):
             data += bytearray([0] * n)
         with memoryview(data) as view:
             checksum = Checksum(view[offset:])
-            checksum.repair(view, log)
+            checksum.repair(view, log, crc=crc)
         return data
     except Exception as e:
         log.error(e)
@@ -251,23 +257,27 @@ def validate_data(data, state, warn=False, force=True):
 
     first_t = True
     try:
-        file_header = FileHeader(data)
-        file_header.validate(data, log)
-        offset = len(file_header)
-        while len(data) - offset > 2:
-            token = token_factory(data[offset:], state)
-            if first_t and state.timestamp:
-                log.info('First timestamp: %s' % state.timestamp)
-                first_t = False
-            record = token.parse_token(warn=warn)
-            if force:
-                record.force()
-            offset += len(token)
-        log.info('Last timestamp:  %s' % state.timestamp)
-        if state.timestamp > dt.datetime.now(tz=pytz.UTC):
-            log.warning('Timestamp in future')
-        checksum = Checksum(data[offset:])
-        checksum.validate(data, log)
+        # memoryview avoids copying the remaining data for each token (data are not resized here)
+        with memoryview(data) as view:
+            file_header = FileHeader(view)
+            file_header.validate(view, log)
+            offset = len(file_header)
+            crc = Crc(view[:offset])
+            while len(view) - offset > 2:
+                token = token_factory(view[offset:], state)
+                crc.update(token.data)
+                if first_t and state.timestamp:
+                    log.info('First timestamp: %s' % state.timestamp)
+                    first_t = False
+                record = token.parse_token(warn=warn)
+                if force:
+                    record.force()
+                offset += len(token)
+            log.info('Last timestamp:  %s' % state.timestamp)
+            if state.timestamp > dt.datetime.now(tz=pytz.UTC):
+                log.warning('Timestamp in future')
+            checksum = Checksum(view[offset:])
+            checksum.validate(view, log, crc=crc)
         log.info('OK')
     except Exception as e:
         log.error(e)
@@ -298,6 +308,8 @@ def offset_tokens(state, data, offset=0, warn=False, force=True):
     '''
     this yields the offsets *after* the tokens (unlike tokens() in the read module).
     '''
+    # slicing a memoryview does not copy the remaining data for each token
+    data = memoryview(data)
     try:
         if not offset:
             file_header = FileHeader(data[offset:])
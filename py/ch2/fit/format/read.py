@@ -1,7 +1,11 @@
 from logging import getLogger
+from math import nan
 
-from .records import restrict_names
-from .tokens import State, FileHeader, token_factory, Checksum
+import numpy as np
+
+from .records import restrict_names, merge_duplicates, fix_degrees, no_bad_values
+from .tokens import State, FileHeader, token_factory, Checksum, Defined
+from ..profile.fields import CompositeField, DynamicField
 from ..profile.profile import read_profile
 from ...lib.data import tohex
 
@@ -9,23 +13,31 @@ log = getLogger(__name__)
 
 
 def parse_data(data, types, messages, no_validate=False, max_delta_t=None):
+    '''
+    data can be anything that supports the buffer protocol (bytes, bytearray, mmap).
+
+    a single memoryview is walked with explicit offsets so that each token references a slice of the
+    original buffer (slicing a memoryview does not copy, while slicing bytes copies the rest of the file
+    for every token, which is quadratic in file size).  note that this means that, for mutable data,
+    tokens alias the caller's buffer (and a bytearray cannot be resized while they exist).
+    '''
 
     state = State(types, messages, max_delta_t=max_delta_t)
 
     def generator():
-        offset = 0
+        view, offset = memoryview(data), 0
         try:
-            file_header = FileHeader(data[offset:])
+            file_header = FileHeader(view[offset:])
             yield offset, file_header
             offset = len(file_header)
-            file_header.validate(data, log, quiet=no_validate)
-            while len(data) - offset > 2:
-                token = token_factory(data[offset:], state)
+            file_header.validate(view, log, quiet=no_validate)
+            while len(view) - offset > 2:
+                token = token_factory(view[offset:], state)
                 yield offset, token
                 offset += len(token)
-            checksum = Checksum(data[offset:])
+            checksum = Checksum(view[offset:])
             yield offset, checksum
-            checksum.validate(data, log, quiet=no_validate)
+            checksum.validate(view, log, quiet=no_validate)
         except Exception as e:
             log.warning('"%s" at offset %d' % (e, offset))
             dump(data, offset)
@@ -95,3 +107,89 @@ def filtered_records(data,
                 yield i, offset, record
 
     return types, messages, generator()
+
+
+TIMESTAMP = 'timestamp'
+
+
+def columnar_records(data, field_names, record_name='record', other_names=tuple(),
+                     warn=False, no_validate=False, max_delta_t=None, profile_path=None):
+    '''
+    read the given fields of all record_name messages straight into numpy arrays, avoiding a python
+    object per message (most of a typical activity file).  where a definition's compiled decoder covers
+    the requested fields the values are taken directly from the unpacked struct; otherwise the message
+    is parsed as usual.
+
+    returns types, messages, a dict from field name to float array (nan where missing or bad, semicircles
+    converted to degrees) that also contains TIMESTAMP (seconds since the epoch), and a list of DictRecords
+    for any other_names messages (as read_fit_file with merge_duplicates, fix_degrees, no_bad_values).
+    rows and records are sorted by timestamp.  requested fields that are not numeric are logged and
+    left as nan.
+    '''
+
+    types, messages = read_profile(warn=warn, profile_path=profile_path)
+    state, tokens = parse_data(data, types, messages, no_validate=no_validate, max_delta_t=max_delta_t)
+    lists = {name: [] for name in field_names if name != TIMESTAMP}
+    timestamps, others, plans, non_numeric = [], [], {}, set()
+
+    def store(name, values, units):
+        column = lists[name]
+        # first good value wins, as merge_duplicates and no_bad_values when read as a dict
+        if column[-1] != column[-1]:
+            if isinstance(values[0], (int, float)):
+                column[-1] = values[0] * 180 / 2**31 if units == 'semicircles' else values[0]
+            else:
+                non_numeric.add(name)
+
+    for offset, token in tokens:
+        if token.is_user and isinstance(token, Defined) and token.definition.message.name == record_name:
+            definition = token.definition
+            if definition not in plans:
+                plans[definition] = _columnar_plan(definition, lists)
+            plan = plans[definition]
+            if plan is not None and state.accumulators and any(field.name in state.accumulators for field in plan):
+                plan = None
+            for column in lists.values():
+                column.append(nan)
+            if plan is None:
+                record = token.parse_token(warn=warn)
+                for name, (values, units) in record.data:
+                    if name in lists and values is not None:
+                        store(name, values, units)
+            elif plan:
+                unpacked = definition.decoder.struct.unpack_from(token.data, 1)
+                for field in plan:
+                    name, (values, units) = field.decode(token.data, unpacked, True, True)
+                    if values is not None:
+                        store(name, values, units)
+            timestamps.append(token.timestamp.timestamp() if token.timestamp else 0.0)
+        else:
+            record = token.parse_token(warn=warn)
+            if token.is_user and record.name in other_names:
+                others.append(record.as_dict(merge_duplicates, fix_degrees, no_bad_values))
+            elif state.accumulators:
+                record.force()
+
+    for name in sorted(non_numeric):
+        log.warning(f'Ignoring non-numeric values for {name} in {record_name}')
+    order = np.argsort(np.array(timestamps, dtype=float), kind='stable')
+    columns = {name: np.array(column, dtype=float)[order] for name, column in lists.items()}
+    columns[TIMESTAMP] = np.array(timestamps, dtype=float)[order]
+    others = sorted(others, key=lambda r: r.timestamp.timestamp() if r.timestamp else 0.0)
+    return types, messages, columns, others
+
+
+def _columnar_plan(definition, names):
+    '''
+    the compiled fields in the definition that provide the requested names, or None if messages must be
+    parsed in full (because a requested value, or an accumulator, depends on a field that is not compiled).
+    '''
+    if not definition.decoder: return None
+    plan = []
+    for field, compiled in zip(definition.fields, definition.decoder.fields):
+        if compiled:
+            if compiled.name in names: plan.append(compiled)
+        elif field.field and (field.name in names or field.field._accumulate or
+                              isinstance(field.field, (CompositeField, DynamicField))):
+            return None
+    return plan
@@ -187,3 +187,7 @@ class DictRecord(Record):
     def data_with(self, **kargs):
         return it.chain(self.data.items(), kargs.items())
 
+    def __reduce__(self):
+        # attr and value are rebuilt by __new__ (and Values cannot be pickled directly)
+        return self.__class__, tuple(self)
+
@@ -1,13 +1,15 @@
 
 from abc import abstractmethod
+from array import array
 from collections import defaultdict, Counter
 from logging import getLogger
 from re import sub
-from struct import unpack, pack
+from struct import unpack, pack, Struct
+from sys import byteorder
 
 from .records import LazyRecord, merge_duplicates
-from ..profile.fields import TypedField, TIMESTAMP_GLOBAL_TYPE, DynamicField, CompositeField
-from ..profile.types import timestamp_to_time, time_to_timestamp
+from ..profile.fields import TypedField, TIMESTAMP_GLOBAL_TYPE, DynamicField, CompositeField, RowField
+from ..profile.types import timestamp_to_time, time_to_timestamp, AutoInteger, AliasInteger, AutoFloat, Mapping
 from ...names import U
 from ...lib.data import WarnDict, tohex
 
@@ -199,13 +201,14 @@ class FileHeader(ValidateToken):
                 self.has_checksum = True
 
     def parse_token(self, raw_data=False, **options):
-        data = {'header_size': self.data[0:1] if raw_data else self.header_size,
-                'protocol_version': self.data[1:2] if raw_data else self.protocol_version,
-                'profile_version': self.data[2:4] if raw_data else self.profile_version,
-                'data_size': (self.data[4:8] if raw_data else self.data_size, 'bytes'),
-                'data_type': self.data[8:12] if raw_data else self.data_type}
+        # bytes() because data may be a memoryview over the entire file
+        data = {'header_size': bytes(self.data[0:1]) if raw_data else self.header_size,
+                'protocol_version': bytes(self.data[1:2]) if raw_data else self.protocol_version,
+                'profile_version': bytes(self.data[2:4]) if raw_data else self.profile_version,
+                'data_size': (bytes(self.data[4:8]) if raw_data else self.data_size, 'bytes'),
+                'data_type': bytes(self.data[8:12]) if raw_data else self.data_type}
         if self.has_checksum:
-            data['checksum'] = self.data[12:14] if raw_data else self.checksum
+            data['checksum'] = bytes(self.data[12:14]) if raw_data else self.checksum
         return self._fake_record('file_header', **data)
 
 
@@ -346,6 +349,106 @@ class Field:
         self.finish = 0
 
 
+class CompiledField:
+    '''
+    The information needed to extract a single (simple) field from the values unpacked by a Decoder.
+    This duplicates the logic in StructSupport._unpack (and Mapping.parse_type) for the common cases.
+    '''
+
+    __slots__ = ('name', 'units', 'lo', 'hi', 'start', 'finish', 'n_bytes', 'bad', 'all_bad', 'scale', 'offset',
+                 'scaled', 'mapping')
+
+    def __init__(self, field, leaf, mapping, lo, endian):
+        self.name = field.field.name
+        self.units = field.field._units
+        self.lo, self.hi = lo, lo + field.count
+        self.start, self.finish = field.start, field.start + field.count * leaf.n_bytes
+        # bad values are compared as bytes (as in StructSupport) because bad floats are nans, which don't compare
+        self.n_bytes = leaf.n_bytes
+        self.bad = leaf.bad_bytes(endian)
+        self.all_bad = self.bad * field.count
+        self.scale, self.offset = field.field._scale, field.field._offset
+        self.scaled = not (self.scale == 1 and self.offset == 0) and leaf.name != 'enum'  # enums are not scaled
+        self.mapping = mapping
+
+    def decode(self, data, values, check_bad, map_values):
+        values = values[self.lo:self.hi]
+        if check_bad and data[self.start:self.finish] == self.all_bad:
+            return self.name, (None, self.units)
+        if self.scaled:
+            if len(values) == 1:
+                values = (values[0] / self.scale - self.offset,)
+            else:  # match weird CSV behaviour (isolated bad values are not scaled)
+                n, start = self.n_bytes, self.start
+                values = tuple(value if data[start + i * n:start + (i + 1) * n] == self.bad
+                               else value / self.scale - self.offset
+                               for i, value in enumerate(values))
+        if map_values and self.mapping and values:
+            values = tuple(self.mapping.safe_internal_to_profile(value) for value in values)
+        return self.name, (values, self.units)
+
+
+class Decoder:
+    '''
+    A single precompiled struct that unpacks all the simple fields in a Definition with one call.
+
+    Fields that need more context (accumulated, dynamic, composite, dates, strings, unknown, etc)
+    are padding in the struct and are returned as None, so that the caller can fall back to the
+    usual per-field parsing.
+    '''
+
+    SIMPLE_FIELDS = (RowField, TypedField)
+    SIMPLE_TYPES = (AutoInteger, AliasInteger, AutoFloat)
+
+    def __init__(self, definition):
+        format, fields, lo = '<>'[definition.endian], [None] * len(definition.fields), 0
+        for i, field in sorted(enumerate(definition.fields), key=lambda i_field: i_field[1].start):
+            leaf, mapping = self.__leaf_and_mapping(field)
+            if leaf:
+                format += '%d%s' % (field.count, leaf.struct_format())
+                extra = field.size - field.count * leaf.n_bytes
+                if extra: format += '%dx' % extra
+                fields[i] = CompiledField(field, leaf, mapping, lo, definition.endian)
+                lo += field.count
+            elif field.size:
+                format += '%dx' % field.size
+        self.struct = Struct(format)
+        self.fields = tuple(fields)
+
+    @classmethod
+    def compile(cls, definition):
+        '''
+        A decoder for the definition, or None if nothing can be compiled (or the struct does not match the
+        data), in which case all fields are parsed individually.
+        '''
+        decoder = cls(definition)
+        if decoder.struct.size != definition.size - 1:  # header
+            log.warning('Inconsistent decoder for %s (%d/%d) - fields will be parsed individually' %
+                        (definition.identity, decoder.struct.size, definition.size - 1))
+            return None
+        return decoder if any(decoder.fields) else None
+
+    def __leaf_and_mapping(self, field):
+        if type(field.field) not in self.SIMPLE_FIELDS or field.field._accumulate: return None, None
+        type_, mapping = field.field.type, None
+        if type(type_) is Mapping:
+            type_, mapping = type_.base_type, type_
+        if type(type_) not in self.SIMPLE_TYPES: return None, None  # excludes Date etc
+        # count is calculated from the base type in the definition, so it must agree with the profile
+        if type_.n_bytes != field.base_type.n_bytes or not field.count: return None, None
+        return type_, mapping
+
+    def decode(self, data, accumulators=None, check_bad=True, map_values=True, **options):
+        '''
+        Returns a list of (name, (values, units)) aligned with the definition's fields, with None for
+        fields that must be parsed individually.
+        '''
+        values = self.struct.unpack_from(data, 1)
+        return [None if field is None or (accumulators and field.name in accumulators)
+                else field.decode(data, values, check_bad, map_values)
+                for field in self.fields]
+
+
 class Definition(Token):
 
     '''
@@ -366,6 +469,7 @@ class Definition(Token):
         self.message = state.messages.number_to_message(self.global_message_no)
         self.identity = Identity(self.message.name, state.definition_counter)
         self.fields = self.__process_fields(self._make_fields(data, state), state)
+        self.decoder = Decoder.compile(self)
         self.accumulators = state.accumulators
         super().__init__(tag, False, data[0:overhead+3*len(self.fields)])
         state.definitions[self.local_message_type] = self
@@ -456,18 +560,20 @@ class Definition(Token):
             yield '%s%s - %s%s' % (padding, value, sub('_', ' ', name), extra)
 
     def parse_token(self, raw_data=False, **options):
-        data = {'local_message_type': ((self.data[0:1],
+        # bytes() because data may be a memoryview over the entire file
+        data = {'local_message_type': ((bytes(self.data[0:1]),
                                         str(self.local_message_type)), '') if raw_data else self.local_message_type,
-                'reserved': self.data[1:2],
-                'architecture': self.data[2:3],
-                'message_number': ((self.data[3:5], self.message.name), '') if raw_data else self.global_message_no,
-                'no_of_fields': self.data[5:6] if raw_data else self.data[5]}
+                'reserved': bytes(self.data[1:2]),
+                'architecture': bytes(self.data[2:3]),
+                'message_number': ((bytes(self.data[3:5]), self.message.name), '')
+                if raw_data else self.global_message_no,
+                'no_of_fields': bytes(self.data[5:6]) if raw_data else self.data[5]}
         if not raw_data:
             data['message_name'] = self.message.name
         for i, field in enumerate(self.fields):
             mult = '' if field.count == 1 else 'x%d' % field.count
             desc = '%s (%s%s)' % (field.name, field.base_type.name, mult)
-            raw = self.data[6 + i*3:9 + i*3]
+            raw = bytes(self.data[6 + i*3:9 + i*3])
             data['field_%d' % i] = ((raw, desc), '  ') if raw_data else desc
         return self._fake_record('definition', **data)
 
@@ -502,42 +608,78 @@ class DeveloperDefinition(Definition):
             yield '  %s - dev fld %d/%d' % (tohex(field_data), fdn, ddi)
 
 
+def _crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+CRC_TABLE = _crc_table()
+# two bytes replace the entire 16 bit state, so this advances the crc by a (little-endian) word at a time
+CRC_WORD_TABLE = array('H', ((CRC_TABLE[word & 0xff] >> 8) ^ CRC_TABLE[((word >> 8) ^ CRC_TABLE[word & 0xff]) & 0xff]
+                             for word in range(0x10000)))
+
+
+class Crc:
+    '''
+    An incremental CRC-16 (as used in FIT files).  Data can be added piece by piece as they are read,
+    and a copy taken to restart from an intermediate point.
+    '''
+
+    __slots__ = ('checksum',)
+
+    def __init__(self, data=b'', checksum=0):
+        self.checksum = checksum
+        self.update(data)
+
+    def update(self, data):
+        checksum = self.checksum
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)  # eg list from FileHeader.repair
+        with memoryview(data) as view:
+            n = len(view) & ~1 if byteorder == 'little' else 0
+            if n:
+                with view[:n].cast('H') as words:
+                    for word in words:
+                        checksum = CRC_WORD_TABLE[checksum ^ word]
+            for byte in view[n:]:
+                checksum = (checksum >> 8) ^ CRC_TABLE[(checksum ^ byte) & 0xff]
+        self.checksum = checksum
+        return self
+
+    def copy(self):
+        return Crc(checksum=self.checksum)
+
+
 class Checksum(ValidateToken):
 
     @staticmethod
     def crc(data):
-
-        CRC = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
-               0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
-
-        checksum = 0
-        for byte in data:
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[byte & 0xf]
-            tmp = CRC[checksum & 0xf]
-            checksum = (checksum >> 4) & 0xfff
-            checksum = checksum ^ tmp ^ CRC[(byte >> 4) & 0xf]
-        return checksum
+        return Crc(data).checksum
 
     def __init__(self, data):
         super().__init__('CRC', False, data)
         self.checksum = unpack('<H', self.data)[0]
 
-    def validate(self, all_data, log, quiet=False):
-        checksum = self.crc(all_data[:-2])
+    def validate(self, all_data, log, quiet=False, crc=None):
+        # crc (if given) is a Crc already updated with all_data[:-2]
+        checksum = crc.checksum if crc else self.crc(all_data[:-2])
         if checksum != self.checksum:
             self._error('Bad checksum (%04x/%04x)' % (checksum, self.checksum), log, quiet)
 
-    def repair(self, data, log):
-        checksum = self.crc(data[:-2])
+    def repair(self, data, log, crc=None):
+        checksum = crc.checksum if crc else self.crc(data[:-2])
         if checksum != self.checksum:
             log.warning('Fixing final checksum: %04x -> %04x' % (self.checksum, checksum))
             self.checksum = checksum
             self.data[:2] = pack('<H', checksum)
 
     def parse_token(self, raw_data=False, **options):
-        return self._fake_record('checksum', checksum=self.data[0:2] if raw_data else self.checksum)
+        return self._fake_record('checksum', checksum=bytes(self.data[0:2]) if raw_data else self.checksum)
 
 
 def token_factory(data, state):
@@ -1,3 +1,4 @@
+from itertools import repeat
 
 from .fields import Row, MessageField, TypedField
 from .support import Named
@@ -50,7 +51,15 @@ class Message(Named):
             if name in defn.references and value[0] is not None:
                 references[name] = value
             yield name, value
-        for field in defn.fields:
+        # most fields are unpacked together by the definition's compiled decoder
+        decoded = defn.decoder.decode(data, **options) if defn.decoder else repeat(None)
+        for field, name_value in zip(defn.fields, decoded):
+            if name_value:
+                name, value = name_value
+                if name in defn.references and value[0] is not None:
+                    references[name] = value
+                yield name, value
+                continue
             bytes = data[field.start:field.finish]
             if field.field:
                 for name, value in self._parse_field(
@@ -10,10 +10,12 @@ from .messages import Messages
 from .support import NullableLog
 from .types import Types
 from ...commands.args import PACKAGE_FIT_PROFILE
+from ...common.io import data_hash, file_hash
 
 log = getLogger(__name__)
 PROFILE_NAME = 'global-profile.pkl'
 PROFILE = []
+PROFILE_VERSION = []
 
 
 def read_external_profile(path, warn=False):
@@ -51,6 +53,19 @@ def read_profile(warn=False, profile_path=None):
     return types, messages
 
 
+def profile_version(profile_path=None):
+    '''
+    a hash of the profile (changes in the profile may change decoded data, so this can be used to invalidate
+    anything derived from parsing fit files).
+    '''
+    if profile_path:
+        return file_hash(profile_path)
+    if not PROFILE_VERSION:
+        with resource_stream(__name__, PROFILE_NAME) as input:
+            PROFILE_VERSION.append(data_hash(input.read()))
+    return PROFILE_VERSION[0]
+
+
 def read_fit(fit_path):
     log.debug('Reading fit file from %s' % fit_path)
     with open(fit_path, 'rb') as input:
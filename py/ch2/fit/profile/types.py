@@ -227,6 +227,13 @@ class AutoInteger(StructSupport):
     def pack_type(self, values, count, endian):
         return self._pack(values, self.__formats, count, endian)
 
+    def struct_format(self):
+        # the format character for a single value (no endian or count) - used by compiled decoders
+        return self.__formats[LITTLE][-1]
+
+    def bad_bytes(self, endian):
+        return bytes(self.__bad[endian])
+
 
 class AliasInteger(AutoInteger):
     '''
@@ -341,6 +348,13 @@ class AutoFloat(StructSupport):
     def parse_type(self, data, count, endian, timestamp, check_bad=True, **options):
         return self._unpack(data, self.__formats, self.__bad, count, endian, check_bad=check_bad, **options)
 
+    def struct_format(self):
+        # the format character for a single value (no endian or count) - used by compiled decoders
+        return self.__formats[LITTLE][-1]
+
+    def bad_bytes(self, endian):
+        return bytes(self.__bad[endian])
+
 
 class Mapping(AbstractType):
 
@@ -1,9 +1,10 @@
 
 import re
+from collections import defaultdict
 from logging import getLogger
 from os import stat
 
-from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
 
 from ..common.date import to_time
 from ..common.io import file_hash
@@ -17,32 +18,42 @@ def modified_file_scans(s, paths, owner):
 
     modified = []
 
+    # a single query for all known files (rather than several per path)
+    by_path, by_hash = {}, defaultdict(list)
+    for file_scan in s.query(FileScan).options(joinedload(FileScan.file_hash)).filter(FileScan.owner == owner).all():
+        by_path[file_scan.path] = file_scan
+        by_hash[file_scan.file_hash.hash].append(file_scan)
+
     for path in paths:
 
         # log.debug(f'Scanning {path}')
-        last_modified = to_time(stat(path).st_mtime)
-        hash = file_hash(path)
-        file_scan_from_hash = s.query(FileScan).\
-            join(FileHash).\
-            filter(FileHash.hash == hash,
-                   FileScan.owner == owner).one_or_none()
-        file_scan_from_path = s.query(FileScan). \
-            filter(FileScan.path == path,
-                   FileScan.owner == owner).one_or_none()
+        path_stat = stat(path)
+        last_modified = to_time(path_stat.st_mtime)
+        file_scan_from_path = by_path.get(path, None)
 
         # get last scan and make sure it's up-to-date
         if file_scan_from_path:
-            if hash != file_scan_from_path.file_hash.hash:
-                log.warning(f'File at {path} appears to have changed since last read on '
-                            f'{file_scan_from_path.last_scan}')
-                file_scan_from_path.file_hash = FileHash.get_or_add(s, hash)
-                file_scan_from_path.last_scan = TIME_ZERO
-        elif file_scan_from_hash:
-            log.warning(f'File at {path} already exists at {file_scan_from_hash} - skipping')
-            continue
+            hash = file_scan_from_path.file_hash.hash
+            if not file_scan_from_path.same_stat(path_stat):
+                # only calculate the hash if the file may have changed
+                new_hash = file_hash(path)
+                if new_hash != hash:
+                    log.warning(f'File at {path} appears to have changed since last read on '
+                                f'{file_scan_from_path.last_scan}')
+                    by_hash[hash].remove(file_scan_from_path)
+                    hash = new_hash
+                    file_scan_from_path.file_hash = FileHash.get_or_add(s, hash)
+                    file_scan_from_path.last_scan = TIME_ZERO
+                    by_hash[hash].append(file_scan_from_path)
+                file_scan_from_path.set_stat(path_stat)
         else:
-            file_scan_from_path = FileScan.add(s, path, owner, hash)
-            s.flush()  # want this to appear in queries below
+            hash = file_hash(path)
+            if by_hash[hash]:
+                log.warning(f'File at {path} already exists at {by_hash[hash][0]} - skipping')
+                continue
+            file_scan_from_path = FileScan.add(s, path, owner, hash, stat=path_stat)
+            by_path[path] = file_scan_from_path
+            by_hash[hash].append(file_scan_from_path)
 
         # only look at hash if we are going to process anyway
         if last_modified > file_scan_from_path.last_scan:
@@ -50,11 +61,8 @@ def modified_file_scans(s, paths, owner):
             log.debug(f'File at {path} was modified on {last_modified} '
                       f'which is after last read on {file_scan_from_path.last_scan}')
 
-            file_scan_from_hash = s.query(FileScan).\
-                join(FileHash).\
-                filter(FileHash.hash == hash,
-                       FileScan.owner == owner).\
-                order_by(desc(FileScan.last_scan)).limit(1).one()  # must exist as file_scan_from_path is a candidate
+            # must exist as file_scan_from_path is a candidate
+            file_scan_from_hash = max(by_hash[hash], key=lambda file_scan: file_scan.last_scan)
             if file_scan_from_hash.path != file_scan_from_path.path:
                 log.warning('Ignoring duplicate file (details in debug log)')
                 log.debug('%s' % file_scan_from_path.path)
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from glob import glob
+from json import dumps, loads, dump
+from logging import getLogger
+from os import getpid, makedirs, unlink
+from os.path import join
+from time import time, perf_counter, process_time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..commands.args import LOG_DIR
+from ..common.date import format_seconds
+
+log = getLogger(__name__)
+
+TRACE = 'trace'
+CPU, QUERIES, READ, WRITTEN = 'cpu', 'queries', 'read', 'written'
+PIPELINE, BATCH = 'pipeline', 'batch'
+INHERITED = (PIPELINE, BATCH)
+
+_TRACER = None
+_COUNTS = {QUERIES: 0, READ: 0, WRITTEN: 0}
+
+
+class Tracer:
+    '''
+    Records nested spans (wall and CPU time, plus queries and rows read and written while the span was
+    open) as Chrome trace events, appended to a file per process in the trace directory.
+    Spans inherit the pipeline and batch of the enclosing span.
+    '''
+
+    def __init__(self, dir):
+        self.__path = join(dir, f'{getpid()}.jsonl')
+        self.__stack = []
+        self.__events = []
+
+    @contextmanager
+    def span(self, name, category, **args):
+        for key in INHERITED:
+            if key not in args and self.__stack and key in self.__stack[-1]:
+                args[key] = self.__stack[-1][key]
+        self.__stack.append(args)
+        counts, ts, wall, cpu = dict(_COUNTS), time(), perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            args[CPU] = process_time() - cpu
+            for key in _COUNTS:
+                args[key] = _COUNTS[key] - counts[key]
+            self.__events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': getpid(), 'tid': 0,
+                                  'ts': int(ts * 1e6), 'dur': int((perf_counter() - wall) * 1e6),
+                                  'args': args})
+            self.__stack.pop()
+            if not self.__stack: self.flush()
+
+    def flush(self):
+        if self.__events:
+            with open(self.__path, 'a') as output:
+                for event in self.__events:
+                    output.write(dumps(event, default=str) + '\n')
+            self.__events = []
+
+
+def trace_dir(config):
+    return join(config.args._format_path(LOG_DIR), TRACE)
+
+
+def start_tracing(config, clear=False):
+    '''
+    Enable tracing for this process (only called with ch2 process --trace).  The main process clears any
+    previous run.
+    '''
+    global _TRACER
+    dir = trace_dir(config)
+    makedirs(dir, exist_ok=True)
+    if clear:
+        for path in glob(join(dir, '*.jsonl')):
+            unlink(path)
+    if not _TRACER:
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _TRACER = Tracer(dir)
+        log.debug(f'Tracing to {dir}')
+
+
+def tracing():
+    return _TRACER is not None
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _COUNTS[QUERIES] += 1
+    if cursor.rowcount and cursor.rowcount > 0:
+        write = context.isinsert or context.isupdate or context.isdelete or \
+                not statement.lstrip()[:6].upper() in ('SELECT', 'WITH')
+        _COUNTS[WRITTEN if write else READ] += cursor.rowcount
+
+
+def count(read=0, written=0):
+    '''
+    For rows that bypass the engine (eg COPY).
+    '''
+    _COUNTS[READ] += read
+    _COUNTS[WRITTEN] += written
+
+
+@contextmanager
+def span(name, category='pipeline', **args):
+    if _TRACER:
+        with _TRACER.span(name, category, **args):
+            yield
+    else:
+        yield
+
+
+def read_events(config):
+    events = []
+    for path in glob(join(trace_dir(config), '*.jsonl')):
+        with open(path) as input:
+            events.extend(loads(line) for line in input if line.strip())
+    return sorted(events, key=lambda event: event['ts'])
+
+
+def write_chrome(config, path):
+    events = read_events(config)
+    with open(path, 'w') as output:
+        dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, output)
+    log.info(f'Wrote {len(events)} events to {path}')
+
+
+def report(config):
+    '''
+    Totals by pipeline and span name, then by batch.
+    '''
+    events = read_events(config)
+    if not events:
+        log.warning(f'No trace data in {trace_dir(config)}')
+        return
+    print(f'\n{"pipeline":>25s} {"span":>12s} {"n":>6s} {"wall":>10s} {"cpu":>10s} '
+          f'{QUERIES:>8s} {READ:>9s} {WRITTEN:>9s}')
+    by_pipeline = _totals(events, lambda event: (event['args'].get(PIPELINE) or '', event['name']))
+    for (pipeline, name), totals in sorted(by_pipeline.items()):
+        print(f'{pipeline:>25s} {name:>12s} {_fmt(totals)}')
+    print(f'\n{"batch":>25s} {"pid":>12s} {"n":>6s} {"wall":>10s} {"cpu":>10s} '
+          f'{QUERIES:>8s} {READ:>9s} {WRITTEN:>9s}')
+    by_batch = _totals([event for event in events if event['name'] == BATCH],
+                       lambda event: (event['args'].get(BATCH) or '', event['pid']))
+    for (batch, pid), totals in sorted(by_batch.items()):
+        print(f'{batch:>25s} {pid:>12d} {_fmt(totals)}')
+    print()
+
+
+def _totals(events, key):
+    totals = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        total = totals[key(event)]
+        total['n'] += 1
+        total['wall'] += event['dur'] / 1e6
+        for name in (CPU, QUERIES, READ, WRITTEN):
+            total[name] += event['args'].get(name, 0)
+    return totals
+
+
+def _fmt(totals):
+    return f'{int(totals["n"]):6d} {format_seconds(totals["wall"]):>10s} {format_seconds(totals[CPU]):>10s} ' \
+           f'{int(totals[QUERIES]):8d} {int(totals[READ]):9d} {int(totals[WRITTEN]):9d}'
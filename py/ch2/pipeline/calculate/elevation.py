@@ -8,7 +8,6 @@ from sqlalchemy import text, select
 from .utils import ActivityJournalProcessCalculator, DataFrameCalculatorMixin
 from ..pipeline import LoaderMixin
 from ...common.geo import utm_srid
-from ...common.math import is_nan
 from ...data import Statistics
 from ...data.activity import add_delta_azimuth
 from ...data.elevation import smooth_elevation, add_gradient
@@ -79,11 +78,7 @@ class ElevationCalculator(LoaderMixin, DataFrameCalculatorMixin, ActivityJournal
             log.info(f'SD of difference between corrected altitude and SRTM1 is {sd:.1f}m')
 
     def _copy_results(self, s, ajournal, loader, df):
-        for time, row in df.iterrows():
-            if N.ELEVATION in row and not is_nan(row[N.ELEVATION]):
-                loader.add_data(N.ELEVATION, ajournal, row[N.ELEVATION], time)
-            if N.GRADE in row and not is_nan(row[N.GRADE]):
-                loader.add_data(N.GRADE, ajournal, row[N.GRADE], time)
+        loader.add_frame(df, {N.ELEVATION: N.ELEVATION, N.GRADE: N.GRADE}, ajournal)
         self.__create_postgis(s, ajournal, df)
 
     def __create_postgis(self, s, ajournal, df):
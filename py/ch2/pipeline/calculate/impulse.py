@@ -5,7 +5,6 @@ from logging import getLogger
 
 from .utils import ProcessCalculator, ActivityGroupProcessCalculator, DataFrameCalculatorMixin
 from ..pipeline import OwnerInMixin, LoaderMixin
-from ...common.math import is_nan
 from ...data import Statistics
 from ...data.impulse import hr_zone, impulse_10
 from ...names import N, T, SPACE
@@ -58,11 +57,7 @@ class ImpulseCalculator(LoaderMixin, OwnerInMixin, DataFrameCalculatorMixin,
 
     def _copy_results(self, s, ajournal, loader, stats):
         name_group = self.prefix + SPACE + self.impulse_constant.short_name  # drop activity group as present elsewhere
-        for time, row in stats.iterrows():
-            if N.HR_ZONE in row and not is_nan(row[N.HR_ZONE]):
-                loader.add_data(N.HR_ZONE, ajournal, row[N.HR_ZONE], time)
-            if N.HR_IMPULSE_10 in row and not is_nan(row[N.HR_IMPULSE_10]):
-                loader.add_data(name_group, ajournal, row[N.HR_IMPULSE_10], time)
+        loader.add_frame(stats, {N.HR_ZONE: N.HR_ZONE, N.HR_IMPULSE_10: name_group}, ajournal)
         # if there are no values, add a single 1 so we don't re-process
         if not loader:
             loader.add_data(N.HR_ZONE, ajournal, 1, ajournal.start)
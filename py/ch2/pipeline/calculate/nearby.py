@@ -1,9 +1,11 @@
 
 from collections import defaultdict, namedtuple
+from heapq import merge
 from itertools import groupby
 from logging import getLogger
 from random import uniform
 
+import numpy as np
 from sqlalchemy import inspect, select, alias, and_, distinct, func, not_
 from sqlalchemy.orm import aliased
 from sqlalchemy.sql.functions import count
@@ -17,7 +19,7 @@ from ...names import N
 from ...rtree import MatchType
 from ...rtree.spherical import SQRTree
 from ...sql import ActivityJournal, ActivityGroup, ActivitySimilarity, ActivityNearby, StatisticName, \
-    StatisticJournal, StatisticJournalFloat, Timestamp
+    StatisticJournal, StatisticJournalFloat, Timestamp, StatisticSeries
 
 log = getLogger(__name__)
 Nearby = namedtuple('Nearby', 'constraint, activity_group, border, start, finish, '
@@ -145,7 +147,27 @@ class SimilarityCalculator(RerunWhenNewActivitiesMixin, ProcessCalculator):
         else:
             stmt = stmt.where(sj_lat.c.source_id.in_(existing))
         stmt = stmt.order_by(sj_lat.c.source_id)  # needed for seen logic
-        yield from s.connection().execute(stmt)
+        series = self._aj_lon_lat_series(s, lat, lon, existing, new=new)
+        yield from merge(s.connection().execute(stmt), series, key=lambda aj_lon_lat: aj_lon_lat[0])
+
+    def _aj_lon_lat_series(self, s, lat, lon, existing, new=True):
+        # positions stored as arrays (see StatisticSeries), also ordered by source
+        from ..owners import ActivityReader
+        if not StatisticSeries.in_use(s): return
+        q = s.query(StatisticSeries). \
+            join(ActivityJournal, ActivityJournal.id == StatisticSeries.source_id). \
+            filter(StatisticSeries.owner == ActivityReader)
+        if new:
+            q = q.filter(not_(StatisticSeries.source_id.in_(existing)))
+        else:
+            q = q.filter(StatisticSeries.source_id.in_(existing))
+        for series in q.order_by(StatisticSeries.source_id).all():
+            arrays = series.decode()
+            if lat in arrays and lon in arrays:
+                (lat_times, lats, _), (lon_times, lons, _) = arrays[lat], arrays[lon]
+                _, i_lat, i_lon = np.intersect1d(lat_times, lon_times, return_indices=True)  # same time
+                for lon_value, lat_value in zip(lons[i_lon], lats[i_lat]):
+                    yield series.source_id, lon_value, lat_value
 
     def _save(self, s, new_ids, affected_ids, n_points, n_overlaps, delta):
         distances = dict((s.source.id, s.value)
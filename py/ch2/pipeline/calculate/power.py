@@ -4,7 +4,6 @@ from json import loads
 from logging import getLogger
 
 import numpy as np
-import pandas as pd
 
 from .utils import ActivityGroupProcessCalculator, DataFrameCalculatorMixin, ProcessCalculator
 from ..pipeline import LoaderMixin
@@ -89,10 +88,7 @@ class PowerCalculator(LoaderMixin, DataFrameCalculatorMixin, ActivityGroupProces
         df, ldf = dfs
         self.__add_total_energy(s, ajournal, loader, ldf)
         df = interpolate_to_index(df, ldf, *fields)
-        for time, row in df.iterrows():
-            for name in fields:
-                if name in row and not pd.isnull(row[name]):
-                    loader.add_data(name, ajournal, row[name], time)
+        loader.add_frame(df, {name: name for name in fields}, ajournal)
 
     def __add_total_energy(self, s, ajournal, loader, ldf):
         if present(ldf, N.POWER_ESTIMATE):
@@ -3,9 +3,10 @@ from collections import namedtuple
 from json import loads
 from logging import getLogger
 
+import pandas as pd
 import pytz
 from math import log10
-from sqlalchemy import distinct
+from sqlalchemy import distinct, desc, func
 from sqlalchemy.sql.functions import count
 
 from .utils import ProcessCalculator
@@ -15,10 +16,12 @@ from ...common.date import round_hour, to_time, now, format_timeq
 from ...common.math import is_nan
 from ...common.names import TIME_ZERO
 from ...data import Statistics, present
-from ...data.response import sum_to_hour, calc_response
+from ...data.frame import DEFAULT_CHUNKSIZE
+from ...data.response import sum_to_hour, calc_response, continue_response
 from ...names import Names as N, SPACE
 from ...sql import StatisticJournal, Composite, StatisticName, Source, Constant, CompositeComponent, \
     StatisticJournalType
+from ...sql.batch import delete_statistics
 from ...sql.tables.source import SourceType
 from ...sql.utils import add
 
@@ -31,15 +34,15 @@ SCALED = 'scaled'
 
 class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
     '''
-    this is hard to do correctly, incrementally.
-
-    for now, we do all or nothing.
-
     first, we check if the current solution is complete:
     * all sources used (no need to check for gaps - composite chaining should do that)
     * within 3 hours of the current time (if not, we regenerate, padding with zeroes)
 
-    if not complete, we regenerate the whole damn thing.
+    if not complete, we regenerate from the last (hourly) value that is unaffected by any new impulse.
+    the model is a linear decay, so the value at that time is all we need to continue (and the composite
+    chain is extended from the source of that value).
+
+    if there is no such value we regenerate the whole damn thing.
     '''
 
     def __init__(self, *args, response_constants=None, prefix=None, **kargs):
@@ -67,12 +70,40 @@ class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
             scalar()
         if n:
             log.warning(f'Deleting {n} Composite sources')
+            # read ids first, since the query depends on the statistics deleted below
+            composite_ids = [row[0] for row in composite_ids.distinct()]
+            delete_statistics(s, composite_ids)
             s.query(Source). \
                 filter(Source.id.in_(composite_ids)). \
                 delete(synchronize_session=False)
             s.commit()
             Composite.clean(s)
 
+    def _delete_after(self, s, time):
+        '''
+        Delete values after the given time, along with the composite sources created for them
+        (the composite for the value at the time is retained, so that the chain can be extended).
+        '''
+        names = s.query(StatisticName.id).filter(StatisticName.owner == self.owner_out)
+        kept = s.query(StatisticJournal.source_id). \
+            filter(StatisticJournal.statistic_name_id.in_(names),
+                   StatisticJournal.time == time)
+        later = s.query(distinct(StatisticJournal.source_id)). \
+            filter(StatisticJournal.statistic_name_id.in_(names),
+                   StatisticJournal.time > time)
+        composite_ids = [row[0] for row in s.query(Composite.id).
+                         filter(Composite.id.in_(later), ~Composite.id.in_(kept))]
+        log.debug(f'Deleting {len(composite_ids)} Composite sources after {time}')
+        delete_statistics(s, composite_ids)
+        s.query(Source). \
+            filter(Source.id.in_(composite_ids)). \
+            delete(synchronize_session=False)
+        s.query(StatisticJournal). \
+            filter(StatisticJournal.statistic_name_id.in_(names),
+                   StatisticJournal.time > time). \
+            delete(synchronize_session=False)
+        s.commit()
+
     def _missing(self, s):
         # clean out any gaps by unzipping the chained composites
         Composite.clean(s)
@@ -84,12 +115,58 @@ class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
         if missing_recent or missing_sources:
             if missing_recent: log.info('Incomplete coverage (so will re-calculate)')
             if missing_sources: log.info('Additional sources (so will re-calculate)')
-            self._delete(s)
-            start = round_hour(self.__start(s), up=False)
+            start = self.__restart(s, missing_sources)
+            if start:
+                log.info(f'Will extend responses from {start}')
+                self._delete_after(s, start)
+            else:
+                self._delete(s)
+                start = round_hour(self.__start(s), up=False)
             return [format_timeq(start)]
         else:
             return []
 
+    def __names(self):
+        return [self.prefix + SPACE + constant.short_name for constant in self.response_constants]
+
+    def __restart(self, s, missing_sources):
+        '''
+        The time of the last value (for all responses) that is unaffected by new impulses, or None.
+        '''
+        q = s.query(StatisticJournal.time). \
+            join(StatisticName, StatisticJournal.statistic_name_id == StatisticName.id). \
+            filter(StatisticName.name == self.__names()[0],
+                   StatisticName.owner == self.owner_out)
+        if missing_sources:
+            earliest = self.__earliest_unused(s)
+            if earliest is None:
+                return None  # sources are missing for some other reason
+            # impulses are summed into the following hour, so the value at this hour is unaffected
+            q = q.filter(StatisticJournal.time <= round_hour(earliest, up=False))
+        restart = q.order_by(StatisticJournal.time.desc()).limit(1).scalar()
+        if restart and len(self.__values_at(s, restart)) == len(self.response_constants):
+            return restart
+        else:
+            return None
+
+    def __earliest_unused(self, s):
+        used = s.query(CompositeComponent.input_source_id). \
+            join(Composite, Composite.id == CompositeComponent.output_source_id). \
+            join(StatisticJournal, StatisticJournal.source_id == Composite.id). \
+            join(StatisticName). \
+            filter(StatisticName.owner == self.owner_out)
+        return s.query(func.min(StatisticJournal.time)). \
+            join(StatisticName). \
+            filter(StatisticName.name == self.prefix + SPACE + N.HR_IMPULSE_10,
+                   ~StatisticJournal.source_id.in_(used)).scalar()
+
+    def __values_at(self, s, time):
+        return s.query(StatisticJournal). \
+            join(StatisticName, StatisticJournal.statistic_name_id == StatisticName.id). \
+            filter(StatisticName.name.in_(self.__names()),
+                   StatisticName.owner == self.owner_out,
+                   StatisticJournal.time == time).all()
+
     def __missing_recent(self, s, constant, now):
         log.debug('Searching for missing recent')
         finish = s.query(StatisticJournal.time). \
@@ -131,8 +208,12 @@ class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
             limit(1).one()[0]  # scalar can return None
 
     def _run_one(self, missed):
+        start = to_time(missed)
         with self._config.db.session_context() as s:
-            data = self.__read_data(s)
+            # if there are values at the start we continue from those
+            initial = {journal.statistic_name.name: journal for journal in self.__values_at(s, start)}
+            if len(initial) != len(self.response_constants): initial = None
+            data = self.__read_data(s, start if initial else None)
             if N.HR_IMPULSE_10 in data.columns and N.COVERAGE in data.columns:
                 # coverage is calculated by the loader and seems to reflect records that have location data but not
                 # HR data.  so i guess it makes sense to scale.
@@ -140,14 +221,28 @@ class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
                 # it seems like a relatively small effect in most cases.
                 data.loc[now()] = {N.HR_IMPULSE_10: 0.0, N._src(N.HR_IMPULSE_10): None, N.COVERAGE: 100}
                 data[SCALED] = data[N.HR_IMPULSE_10] * 100 / data[N.COVERAGE]
-                all_sources = list(self.__make_sources(s, data))
+                if initial:
+                    # earlier data were only needed for coverage
+                    data = data.loc[data.index >= start]
+                    # a zero impulse so that the hourly sums start at the initial value
+                    impulses = pd.concat([pd.DataFrame({SCALED: [0.0]}, index=[start]), data[[SCALED]]])
+                    prev = next(iter(initial.values())).source
+                    all_sources = list(self.__make_sources(s, data, prev=prev, start=start))
+                else:
+                    impulses = data
+                    all_sources = list(self.__make_sources(s, data))
                 for constant, response in zip(self.response_constants, self.responses):
                     name = self.prefix + SPACE + constant.short_name
                     log.info(f'Creating values for {response.title} ({name})')
-                    imp3600 = sum_to_hour(data, SCALED)
-                    params = (log10(response.tau_days * 24),
-                              log10(response.start) if response.start > 0 else 1)
-                    result = calc_response(imp3600, params) * response.scale
+                    imp3600 = sum_to_hour(impulses, SCALED)
+                    if initial:
+                        result = continue_response(imp3600, response.tau_days * 24,
+                                                   initial[name].value / response.scale) * response.scale
+                        result = result.iloc[1:]  # already have the initial value
+                    else:
+                        params = (log10(response.tau_days * 24),
+                                  log10(response.start) if response.start > 0 else 1)
+                        result = calc_response(imp3600, params) * response.scale
                     loader = self._get_loader(s, add_serial=False)
                     source, sources = None, list(all_sources)
                     for time, value in result.iteritems():
@@ -162,26 +257,47 @@ class ResponseCalculator(LoaderMixin, OwnerInMixin, ProcessCalculator):
                         loader.add_data(name, source, value, time)
                     loader.load()
 
-    def __read_data(self, s):
+    def __read_data(self, s, start=None):
         from ..owners import ImpulseCalculator
         name = self.prefix + SPACE + N.HR_IMPULSE_10
-        df = Statistics(s, with_sources=True).by_name(ImpulseCalculator, name).with_. \
+        if start:
+            start = self.__read_start(s, name, start)
+        df = Statistics(s, start=start, with_sources=True, chunksize=DEFAULT_CHUNKSIZE). \
+            by_name(ImpulseCalculator, name).with_. \
             rename({name: N.HR_IMPULSE_10, N._src(name): N._src(N.HR_IMPULSE_10)}).df
         name = N._cov(N.HEART_RATE)
-        df = Statistics(s).by_name(ActivityReader, name).with_. \
+        df = Statistics(s, start=start).by_name(ActivityReader, name).with_. \
             rename({name: N.COVERAGE}).into(df, tolerance='10s')
         if present(df, N.COVERAGE):
             df[N.COVERAGE].fillna(axis='index', method='ffill', inplace=True)
             df[N.COVERAGE].fillna(100, axis='index', inplace=True)
         return df
 
-    def __make_sources(self, s, data):
-        # this chains forwards from zero, adding a new composite for each new impulse source.
-        # in theory we could reconstruct only missing entries.
+    def __read_start(self, s, name, start):
+        # coverage is filled forwards from the start of each activity, so include the activity at start
+        source_id = s.query(StatisticJournal.source_id). \
+            join(StatisticName). \
+            filter(StatisticName.name == name,
+                   StatisticJournal.time <= start). \
+            order_by(desc(StatisticJournal.time)).limit(1).scalar()
+        if source_id:
+            first = s.query(func.min(StatisticJournal.time)). \
+                join(StatisticName). \
+                filter(StatisticName.name == name,
+                       StatisticJournal.source_id == source_id).scalar()
+            start = min(start, first)
+        return start - dt.timedelta(seconds=10)
+
+    def __make_sources(self, s, data, prev=None, start=None):
+        # this chains forwards from zero (or extends an existing chain from prev at start),
+        # adding a new composite for each new impulse source.
         log.info('Creating sources')
         name = N._src(N.HR_IMPULSE_10)
-        prev = add(s, Composite(n_components=0))
-        yield to_time(0.0), prev
+        if prev is None:
+            prev = add(s, Composite(n_components=0))
+            yield to_time(0.0), prev
+        else:
+            yield start, prev
         # find times where the source changes
         changes = data.loc[data[name].ne(data[name].shift())]
         for time, row in changes.iterrows():
@@ -1,15 +1,16 @@
 
+from collections import defaultdict
 from logging import getLogger
 from random import choice
 
-from sqlalchemy import func, inspect, and_, select
+from sqlalchemy import func, inspect, and_, select, asc, desc, case, literal, null
 
 from .utils import ProcessCalculator, IntervalCalculatorMixin
 from ..pipeline import LoaderMixin
 from ...common.date import local_date_to_time
 from ...data.frame import _tables
 from ...names import Summaries as S, simple_name
-from ...sql.tables.source import Interval, Source
+from ...sql.tables.source import Interval
 from ...sql.tables.statistic import StatisticJournal, StatisticName, StatisticMeasure, StatisticJournalInteger, \
     StatisticJournalFloat, TYPE_TO_JOURNAL_CLASS, STATISTIC_JOURNAL_CLASSES, STATISTIC_JOURNAL_TYPES
 
@@ -52,12 +53,15 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
     def _calculate_results(self, s, interval, data, loader):
         log.debug('Calculating summaries')
         start, finish = local_date_to_time(interval.start), local_date_to_time(interval.finish)
-        measures = []
+        values = self._calculate_values(s, data, start, finish, interval)
         for statistic_name in data:
             summaries = statistic_name.summaries
             for summary in summaries:
-                value, units = self._calculate_value(s, statistic_name, summary, S.MIN in summaries,
-                                                     start, finish, interval, measures)
+                if summary == S.MSR:
+                    self._calculate_measures(s, statistic_name, S.MIN in summaries, start, finish, interval)
+                    continue
+                value = values.get((statistic_name.id, summary), 0 if summary == S.CNT else None)
+                units = None if summary == S.CNT else statistic_name.units
                 if value is not None:
                     title = self.fmt_title(statistic_name.title, summary, self.schedule)
                     # we need to infer the type
@@ -71,46 +75,60 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
                     StatisticName.add_if_missing(s, title, new_type, units, None, self.owner_out,
                                                  self._describe(statistic_name, summary, interval))
                     loader.add_data(simple_name(title), interval, value, start)
-        # add and commit these here - what else can we do?
-        log.debug(f'Adding {len(measures)} measures')
-        for measure in measures:
-            s.add(measure)
+        # commit measures here - what else can we do?
         s.commit()
 
-    def _calculate_value(self, s, statistic_name, summary, order_asc, start_time, finish_time, interval, measures):
+    def _calculate_values(self, s, statistic_names, start_time, finish_time, interval):
+        '''
+        All summaries (except MSR) for all statistic names, with a single grouped query per journal type.
+        Returns a map from (statistic_name_id, summary) to value.
+        '''
 
         t = _tables()
-        sjx = inspect(STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]).local_table
-        units = statistic_name.units
         activity_group_id = interval.activity_group.id if interval.activity_group else None
-
-        if summary == S.MAX:
-            result = func.max(sjx.c.value)
-        elif summary == S.MIN:
-            result = func.min(sjx.c.value)
-        elif summary == S.SUM:
-            result = func.sum(sjx.c.value)
-        elif summary == S.CNT:
-            result = func.count(sjx.c.value)
-            units = None
-        elif summary == S.AVG:
-            result = func.avg(sjx.c.value)
-        elif summary == S.MSR:
-            self._calculate_measures(s, statistic_name, order_asc, start_time, finish_time, interval, measures)
-            return None, None
-        else:
-            raise Exception('Bad summary: %s' % summary)
-
-        stmt = select([result]). \
-            select_from(sjx).select_from(t.sj).select_from(t.src). \
-            where(and_(t.sj.c.id == sjx.c.id,
-                       t.sj.c.statistic_name_id == statistic_name.id,
-                       t.sj.c.time >= start_time,
-                       t.sj.c.time < finish_time,
-                       t.sj.c.source_id == t.src.c.id,
-                       t.src.c.activity_group_id == activity_group_id))
-
-        return next(s.connection().execute(stmt))[0], units
+        by_type = defaultdict(list)
+        for statistic_name in statistic_names:
+            by_type[statistic_name.statistic_journal_type].append(statistic_name)
+
+        values = {}
+        for journal_type, names in by_type.items():
+            sjx = inspect(STATISTIC_JOURNAL_CLASSES[journal_type]).local_table
+            summaries = sorted(set(summary for statistic_name in names for summary in statistic_name.summaries
+                                   if summary != S.MSR))
+            if not summaries: continue
+            results = []
+            for summary in summaries:
+                if summary == S.MAX:
+                    results.append(func.max(sjx.c.value))
+                elif summary == S.MIN:
+                    results.append(func.min(sjx.c.value))
+                elif summary == S.SUM:
+                    results.append(func.sum(sjx.c.value))
+                elif summary == S.CNT:
+                    results.append(func.count(sjx.c.value))
+                elif summary == S.AVG:
+                    results.append(func.avg(sjx.c.value))
+                else:
+                    raise Exception('Bad summary: %s' % summary)
+
+            stmt = select([t.sj.c.statistic_name_id] + results). \
+                select_from(sjx).select_from(t.sj).select_from(t.src). \
+                where(and_(t.sj.c.id == sjx.c.id,
+                           t.sj.c.statistic_name_id.in_([statistic_name.id for statistic_name in names]),
+                           t.sj.c.time >= start_time,
+                           t.sj.c.time < finish_time,
+                           t.sj.c.source_id == t.src.c.id,
+                           t.src.c.activity_group_id == activity_group_id)). \
+                group_by(t.sj.c.statistic_name_id)
+
+            requested = {statistic_name.id: statistic_name.summaries for statistic_name in names}
+            for row in s.connection().execute(stmt):
+                id = row[0]
+                for summary, value in zip(summaries, row[1:]):
+                    if summary in requested[id]:
+                        values[(id, summary)] = value
+
+        return values
 
     def _describe(self, statistic_name, summary, interval):
         adjective = {S.MAX: 'highest', S.MIN: 'lowest', S.SUM: 'total', S.CNT: 'number of', S.AVG: 'average'}[summary]
@@ -121,28 +139,40 @@ class SummaryCalculator(LoaderMixin, IntervalCalculatorMixin, ProcessCalculator)
             period = 'one ' + period
         return f'The {adjective} {statistic_name.title} over {period}.'
 
-    def _calculate_measures(self, s, statistic_name, order_asc, start_time, finish_time, interval, measures):
-        data = sorted([x for x in
-                       s.query(StatisticJournal).
-                      join(Source).
-                      filter(StatisticJournal.statistic_name == statistic_name,
-                             StatisticJournal.time >= start_time,
-                             StatisticJournal.time < finish_time,
-                             Source.activity_group == interval.activity_group).all()
-                       if x is not None and x.value is not None],
-                      key=lambda x: x.value, reverse=not order_asc)
-        n, local_measures = len(data), []
-        for rank, journal in enumerate(data, start=1):
-            if n > 1:
-                percentile = (n - rank) / (n - 1) * 100
-            else:
-                percentile = 100
-            measure = StatisticMeasure(statistic_journal=journal, source=interval, rank=rank, percentile=percentile)
-            local_measures.append(measure)
-            measures.append(measure)
+    def _calculate_measures(self, s, statistic_name, order_asc, start_time, finish_time, interval):
+        # ranks are calculated and inserted in the database.  row_number (rather than rank) gives distinct
+        # ranks 1..n, so that percentiles and quartiles are as they were when sorted in python.
+        t = _tables()
+        sjx = inspect(STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]).local_table
+        activity_group_id = interval.activity_group.id if interval.activity_group else None
+        journals = and_(t.sj.c.id == sjx.c.id,
+                        t.sj.c.statistic_name_id == statistic_name.id,
+                        t.sj.c.time >= start_time,
+                        t.sj.c.time < finish_time,
+                        t.sj.c.source_id == t.src.c.id,
+                        t.src.c.activity_group_id == activity_group_id,
+                        sjx.c.value != None)
+
+        n = s.connection().execute(select([func.count()]).
+                                   select_from(sjx).select_from(t.sj).select_from(t.src).
+                                   where(journals)).scalar()
+        if not n: return
+
+        order = asc(sjx.c.value) if order_asc else desc(sjx.c.value)
+        ranked = select([t.sj.c.id.label('id'), func.row_number().over(order_by=order).label('rank')]). \
+            select_from(sjx).select_from(t.sj).select_from(t.src). \
+            where(journals).alias('ranked')
+        rank = ranked.c.rank
+        percentile = (n - rank) * 100.0 / (n - 1) if n > 1 else literal(100.0)
         if n > 8:  # avoid overlap in fuzzing (and also, plot individual points in this case)
-            for q in range(5):
-                local_measures[fuzz(n, q)].quartile = q
+            quartile = case([(rank == fuzz(n, q) + 1, q) for q in range(5)], else_=null())
+        else:
+            quartile = null()
+
+        sm = inspect(StatisticMeasure).local_table
+        s.connection().execute(
+            sm.insert().from_select(['statistic_journal_id', 'source_id', 'rank', 'percentile', 'quartile'],
+                                    select([ranked.c.id, literal(interval.id), rank, percentile, quartile])))
         log.debug('Ranked %s' % statistic_name)
 
     @classmethod
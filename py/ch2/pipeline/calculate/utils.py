@@ -8,6 +8,7 @@ from ..pipeline import ProcessPipeline, OwnerInMixin
 from ...common.date import time_to_local_timeq, format_dateq
 from ...common.log import log_current_exception, log_query
 from ...lib import local_time_to_time, to_date
+from ...lib.trace import span
 from ...lib.schedule import Schedule
 from ...sql import Timestamp, ActivityJournal, ActivityGroup, Interval
 from ...sql.types import short_cls
@@ -72,12 +73,15 @@ class DataFrameCalculatorMixin:
             with Timestamp(owner=self.owner_out, source=source).on_success(s):
                 try:
                     # data may be structured (doesn't have to be simply a dataframe)
-                    data = self._read_dataframe(s, source)
-                    stats = self._calculate_stats(s, source, data)
+                    with span('read_data'):
+                        data = self._read_dataframe(s, source)
+                    with span('calculate'):
+                        stats = self._calculate_stats(s, source, data)
                     if stats is not None:
                         loader = self._get_loader(s, add_serial=self.__add_serial)
-                        self._copy_results(s, source, loader, stats)
-                        loader.load()
+                        with span('copy_results'):
+                            self._copy_results(s, source, loader, stats)
+                            loader.load()
                     else:
                         raise Exception('No stats')
                 except Exception as e:
@@ -138,10 +142,12 @@ class IntervalCalculatorMixin:
                                                permanent=self.permanent))
                     s.commit()
                     try:
-                        data = self._read_data(s, interval)
+                        with span('read_data'):
+                            data = self._read_data(s, interval)
                         loader = self._get_loader(s, add_serial=False, clear_timestamp=False)
-                        self._calculate_results(s, interval, data, loader)
-                        loader.load()
+                        with span('calculate'):
+                            self._calculate_results(s, interval, data, loader)
+                            loader.load()
                     except Exception as e:
                         log.error(f'No statistics for {missed} due to error ({e})')
                         log_current_exception()
@@ -1,47 +1,234 @@
 from abc import ABC
+from array import array
 from collections import defaultdict, namedtuple
 from logging import getLogger
 
-from ..common.date import min_time, max_time
+import numpy as np
+
+from ..common.date import to_time
 from ..common.math import is_nan
-from ..sql import StatisticName, Interval, Source
-from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES
+from ..lib.trace import span
+from ..sql import StatisticName, Interval, Source, StatisticJournal, StatisticSeries, ActivityJournal
+from ..sql.batch import sequence_ids, copy_rows
+from ..sql.tables.statistic import STATISTIC_JOURNAL_CLASSES, STATISTIC_JOURNAL_TYPES, StatisticJournalInteger, \
+    StatisticJournalFloat
 
 log = getLogger(__name__)
+NO_SERIAL = -1
+
+
+class Staged:
+    '''
+    The values loaded for a single statistic name, as parallel arrays (rather than an ORM instance per value).
+    Times are seconds since the epoch; sources are indices into the Loader's list of sources.  Integer values
+    are stored as integers (as floats they would lose precision above 2**53).
+    '''
+
+    __slots__ = ('statistic_name', 'journal_class', 'times', 'values', 'sources', 'serials')
+
+    def __init__(self, statistic_name):
+        self.statistic_name = statistic_name
+        self.journal_class = STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]
+        self.times = array('d')
+        if self.journal_class is StatisticJournalInteger:
+            self.values = array('q')
+        elif self.journal_class is StatisticJournalFloat:
+            self.values = array('d')
+        else:
+            self.values = []
+        self.sources = array('q')
+        self.serials = array('q')
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, time, value, source, serial):
+        if self.journal_class is StatisticJournalInteger:
+            value = int(round(value))
+        self.values.append(value)  # first, so that a bad value leaves the arrays consistent
+        self.times.append(time)
+        self.sources.append(source)
+        self.serials.append(NO_SERIAL if serial is None else serial)
+
+    def extend(self, times, values, source, serials):
+        # times, values and serials are numpy arrays
+        values = values.astype(float)
+        if self.journal_class is StatisticJournalInteger:
+            self.values.frombytes(np.round(values).astype(np.int64).tobytes())
+        elif isinstance(self.values, array):
+            self.values.frombytes(values.tobytes())
+        else:
+            self.values.extend(values.tolist())
+        self.times.frombytes(times.astype(float).tobytes())
+        self.sources.frombytes(np.full(len(times), source, dtype=np.int64).tobytes())
+        self.serials.frombytes(serials.astype(np.int64).tobytes())
+
+    def value(self, i):
+        return self.values[i]
+
+    def serial(self, i):
+        serial = self.serials[i]
+        return None if serial == NO_SERIAL else serial
+
+    def deduplicate(self, resolve):
+        if len(self) < 2: return
+        times = np.frombuffer(self.times, dtype=float)
+        order = np.argsort(times, kind='stable')
+        ordered = times[order]
+        repeated = np.flatnonzero(ordered[1:] == ordered[:-1]) + 1
+        if len(repeated):
+            keep = np.ones(len(times), dtype=bool)
+            for j, first in zip(repeated, np.searchsorted(ordered, ordered[repeated], side='left')):
+                current, previous = order[j], order[first]
+                time, value, previous_value = to_time(self.times[current]), self.value(current), self.value(previous)
+                if value == previous_value:
+                    log.warning(f'Discarding duplicate for {self.statistic_name.name} at {time} (value {value})')
+                else:
+                    resolve(self.statistic_name.name, time, value, previous_value)
+                keep[current] = False
+            self.times = array('d', times[keep])
+            self.sources = array('q', np.frombuffer(self.sources, dtype=np.int64)[keep])
+            self.serials = array('q', np.frombuffer(self.serials, dtype=np.int64)[keep])
+            if isinstance(self.values, array):
+                self.values = array(self.values.typecode, np.frombuffer(self.values, dtype=self.values.typecode)[keep])
+            else:
+                self.values = [value for value, k in zip(self.values, keep) if k]
 
 
 class Loader(ABC):
 
-    def __init__(self, s, owner, add_serial=True, clear_timestamp=True, batch=True):
+    def __init__(self, s, owner, add_serial=True, clear_timestamp=True, copy=None, series=False):
         self._s = s
         self._owner = owner
         self.__serial = 0 if add_serial else None
         self.__clear_timestamp = clear_timestamp
-        self.__batch = batch
+        # by default, use COPY whenever the database supports it
+        self.__copy = s.get_bind().dialect.name == 'postgresql' if copy is None else copy
+        # store activity time-series in statistic_series rather than statistic_journal
+        self.__series = series
+        self.__in_series = {}  # name -> boolean mask of values stored as series
 
-        self.__statistic_name_cache = dict()
-        self.__source_cache = dict()
-        self._staging = defaultdict(list)
-        self.__by_name_then_time = defaultdict(dict)
+        self.__staged = dict()  # name -> Staged
+        self.__sources = []
+        self.__source_indices = dict()
         self.__add_serial = add_serial
         self._start = None
         self._finish = None
         self.__last_time = None
-        self.__counts = defaultdict(lambda: 0)
+        self.__deduplicated = True
 
     def load(self):
+        with span('load'):
+            self.__load()
+
+    def __load(self):
         if self:
-            for type in self._staging:
-                log.debug(f'Adding {len(self._staging[type])} instances of {type}')
-                for instance in self._staging[type]:
+            self.__deduplicate()
+            self._s.flush()  # sources must have ids
+            self.__set_range()
+            if self.__series:
+                self._write_series()
+            if self.__copy:
+                self._copy()
+            else:
+                for instance in self.instances():
                     self._s.add(instance)
                 self._s.commit()
             self._postload()
         else:
             log.warning('No data to load')
 
+    def __rows(self, name, staged):
+        # indices of the values that go to statistic_journal
+        if name in self.__in_series:
+            return np.flatnonzero(~self.__in_series[name]).tolist()
+        else:
+            return range(len(staged))
+
+    def _write_series(self):
+        '''
+        Numeric values for activity journals are stored as arrays in statistic_series, unless there is
+        only a single value for that name (a scalar), which remains in statistic_journal so that it can
+        be used in SQL (summaries, search, etc).
+        '''
+        is_activity = np.array([isinstance(source, ActivityJournal) for source in self.__sources], dtype=bool)
+        arrays = defaultdict(dict)  # source index -> statistic name id -> (times, values, serials)
+        for name, staged in self.__staged.items():
+            if staged and isinstance(staged.values, array):
+                sources = np.frombuffer(staged.sources, dtype=np.int64)
+                counts = np.bincount(sources, minlength=len(self.__sources))
+                mask = is_activity[sources] & (counts[sources] > 1)
+                if mask.any():
+                    self.__in_series[name] = mask
+                    times = np.frombuffer(staged.times, dtype=float)
+                    values = np.frombuffer(staged.values, dtype=staged.values.typecode)
+                    serials = np.frombuffer(staged.serials, dtype=np.int64)
+                    for source in np.unique(sources[mask]):
+                        selected = mask & (sources == source)
+                        arrays[source][staged.statistic_name.id] = \
+                            (times[selected], values[selected], serials[selected])
+        for source, source_arrays in arrays.items():
+            series = StatisticSeries.add(self._s, self.__sources[source], self._owner, source_arrays)
+            log.debug(f'Stored {len(source_arrays)} statistics in {series}')
+            Interval.record_dirty_times(self._s, series.start, series.finish)
+        self._s.commit()
+
+    def _copy(self):
+        '''
+        Write the staged values directly to the parent and child tables with COPY.  No ORM instances are
+        created, so this also does what Source.before_flush would do for dirty intervals.
+        '''
+        rows = {name: self.__rows(name, staged) for name, staged in self.__staged.items()}
+        ids = iter(sequence_ids(self._s, StatisticJournal, sum(len(r) for r in rows.values())))
+        parents, children = [], defaultdict(list)
+        start, finish = None, None
+        for name, staged in self.__staged.items():
+            log.debug(f'Copying {len(rows[name])} values for {staged.statistic_name.name}')
+            type = STATISTIC_JOURNAL_TYPES[staged.journal_class]
+            for i in rows[name]:
+                id, time, source = next(ids), to_time(staged.times[i]), self.__sources[staged.sources[i]]
+                parents.append((id, type, staged.statistic_name.id, source.id, time, staged.serial(i)))
+                children[staged.journal_class].append((id, staged.value(i)))
+                if not isinstance(source, Interval):
+                    start = time if start is None else min(start, time)
+                    finish = time if finish is None else max(finish, time)
+        copy_rows(self._s, StatisticJournal, ('id', 'type', 'statistic_name_id', 'source_id', 'time', 'serial'),
+                  parents)
+        for journal_class, rows in children.items():
+            copy_rows(self._s, journal_class, ('id', 'value'), rows)
+        if start is not None:
+            Interval.record_dirty_times(self._s, start, finish)
+        self._s.commit()
+
+    def instances(self):
+        '''
+        ORM instances for the staged data (only created when needed).
+        '''
+        for name, staged in self.__staged.items():
+            for i in self.__rows(name, staged):
+                source = self.__sources[staged.sources[i]]
+                # set statistic_name and source (as well as ids) so that we can correctly test in
+                # Source for dirty intervals
+                yield staged.journal_class(statistic_name=staged.statistic_name,
+                                           statistic_name_id=staged.statistic_name.id,
+                                           source=source, source_id=source.id, value=staged.value(i),
+                                           time=to_time(staged.times[i]), serial=staged.serial(i))
+
     def __bool__(self):
-        return bool(self._staging)
+        return any(self.__staged.values())
+
+    def __deduplicate(self):
+        # duplicates (same name and time) are detected in bulk, rather than as values are added
+        if not self.__deduplicated:
+            for staged in self.__staged.values():
+                staged.deduplicate(self._resolve_duplicate)
+            self.__deduplicated = True
+
+    def __set_range(self):
+        times = [np.frombuffer(staged.times, dtype=float) for staged in self.__staged.values() if staged]
+        if times:
+            self._start = to_time(float(min(t.min() for t in times)))
+            self._finish = to_time(float(max(t.max() for t in times)))
 
     def _postload(self):
         # manually clean out intervals because we're doing a fast load
@@ -49,18 +236,25 @@ class Loader(ABC):
             Interval.record_dirty_times(self._s, self._start, self._finish)
             self._s.commit()
 
+    def __statistic_name(self, name):
+        if name not in self.__staged:
+            self.__staged[name] = Staged(StatisticName.from_name(self._s, name, self._owner))
+        return self.__staged[name]
+
+    def __source_index(self, source):
+        key = source if isinstance(source, Source) else int(source)
+        if key not in self.__source_indices:
+            self.__source_indices[key] = len(self.__sources)
+            self.__sources.append(source if isinstance(source, Source) else Source.from_id(self._s, source))
+        return self.__source_indices[key]
+
     def add_data(self, name, source, value, time):
-        if name in self.__statistic_name_cache:
-            statistic_name = self.__statistic_name_cache[name]
-        else:
-            statistic_name = StatisticName.from_name(self._s, name, self._owner)
-            self.__statistic_name_cache[name] = statistic_name
+        staged = self.__statistic_name(name)
 
         if is_nan(value):
-            raise Exception(f'Bad value for {statistic_name.name}: {value}')
-
-        journal_class = STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]
+            raise Exception(f'Bad value for {staged.statistic_name.name}: {value}')
 
+        time = (time if time.tzinfo else to_time(time)).timestamp()  # naive times are UTC (not local)
         if self.__add_serial:
             if self.__last_time is None:
                 self.__last_time = time
@@ -70,55 +264,60 @@ class Loader(ABC):
             elif time < self.__last_time:
                 raise Exception('Time travel - timestamp for statistic decreased')
 
-        if isinstance(source, Source):
-            if source.id not in self.__source_cache:
-                self.__source_cache[source.id] = source
-        else:
-            if source not in self.__source_cache:
-                self.__source_cache[source] = Source.from_id(self._s, source)
-            source = self.__source_cache[source]
-
-        self._start = min_time(self._start, time)
-        self._finish = max_time(self._finish, time)
-
-        # set statistic_name and source (as well as ids) so that we can correctly test in
-        # Source for dirty intervals
-        instance = journal_class(statistic_name=statistic_name, statistic_name_id=statistic_name.id,
-                                 source=source, source_id=source.id, value=value, time=time, serial=self.__serial)
-
-        if instance.time in self.__by_name_then_time[statistic_name.name]:
-            previous = self.__by_name_then_time[statistic_name.name][instance.time]
-            if instance.value == previous.value:
-                log.warning(f'Discarding duplicate for {statistic_name.name} at {instance.time} '
-                            f'(value {instance.value})')
-            else:
-                self._resolve_duplicate(statistic_name.name, instance, previous)
-            return
+        staged.append(time, value, self.__source_index(source), self.__serial)
+        self.__deduplicated = False
+
+    def add_frame(self, df, columns, source):
+        '''
+        Add the (non-nan) numeric values from a time-indexed DataFrame.  columns maps column names (which need
+        not be present) to statistic names.  This is equivalent to calling add_data for each value in time order.
+        '''
+        columns = {column: name for column, name in columns.items() if column in df.columns}
+        if df.empty or not columns: return
+        times = df.index.view(np.int64) / 1e9
+        values = {column: df[column].to_numpy(dtype=float) for column in columns}
+        present = {column: ~np.isnan(values[column]) for column in columns}
+        rows = np.flatnonzero(np.logical_or.reduce(list(present.values())))
+        if not len(rows): return
+        times = times[rows]
+
+        if self.__add_serial:
+            previous = times[0] if self.__last_time is None else self.__last_time
+            steps = np.diff(times, prepend=previous)
+            if np.any(steps < 0):
+                raise Exception('Time travel - timestamp for statistic decreased')
+            serials = self.__serial + np.cumsum(steps > 0)
+            self.__serial, self.__last_time = int(serials[-1]), float(times[-1])
         else:
-            self.__by_name_then_time[statistic_name.name][instance.time] = instance
+            serials = np.full(len(times), NO_SERIAL)
 
-        self._staging[journal_class].append(instance)
-        self.__counts[statistic_name.name] += 1
+        source = self.__source_index(source)
+        for column, name in columns.items():
+            mask = present[column][rows]
+            self.__statistic_name(name).extend(times[mask], values[column][rows][mask], source, serials[mask])
+        self.__deduplicated = False
 
-    def _resolve_duplicate(self, name, instance, prev):
-        raise Exception(f'Conflict at ({instance.time}) for {name} '
-                        f'(values {instance.value}/{prev.value})')
+    def _resolve_duplicate(self, name, time, value, previous):
+        raise Exception(f'Conflict at ({time}) for {name} '
+                        f'(values {value}/{previous})')
 
     def as_waypoints(self, names):
         Waypoint = make_waypoint(names.values())
         time_to_waypoint = defaultdict(lambda: Waypoint())
-        for type in self._staging:
-            for sjournal in self._staging[type]:
-                name = sjournal.statistic_name.name
-                if name in names:
-                    time_to_waypoint[sjournal.time] = \
-                        time_to_waypoint[sjournal.time]._replace(**{'time': sjournal.time,
-                                                                    names[name]: sjournal.value})
+        self.__deduplicate()
+        for name, staged in self.__staged.items():
+            if name in names:
+                for i in range(len(staged)):
+                    time = to_time(staged.times[i])
+                    time_to_waypoint[time] = time_to_waypoint[time]._replace(**{'time': time,
+                                                                                names[name]: staged.value(i)})
         return [time_to_waypoint[time] for time in sorted(time_to_waypoint.keys())]
 
     def coverage_percentages(self):
-        total = max(self.__counts.values())
-        for name, count in self.__counts.items():
+        self.__deduplicate()
+        counts = {staged.statistic_name.name: len(staged) for staged in self.__staged.values() if staged}
+        total = max(counts.values())
+        for name, count in counts.items():
             yield name, 100 * count / total
 
 
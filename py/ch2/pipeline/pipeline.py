@@ -5,11 +5,12 @@ from logging import getLogger
 from sqlalchemy.sql.functions import count
 
 from .loader import Loader
-from ..commands.args import LOG, WORKER, DEV, PROCESS, CPROFILE
+from ..commands.args import LOG, WORKER, DEV, PROCESS, CPROFILE, TRACE
 from ..common.args import mm
 from ..common.global_ import global_dev
 from ..common.names import BASE, UNDEF
 from ..common.names import VERBOSITY, URI
+from ..lib.trace import span, tracing
 from ..lib.utils import timing
 from ..lib.workers import command_root
 from ..sql import Pipeline, Interval, PipelineType, StatisticJournal, StatisticName
@@ -84,7 +85,7 @@ class ProcessPipeline(BasePipeline):
         super().__init__(**kargs)
 
     def startup(self):
-        with self._config.db.session_context(expire_on_commit=False) as s:
+        with span('startup', pipeline=str(self)), self._config.db.session_context(expire_on_commit=False) as s:
             log.debug(f'Starting up {self}')
             self._startup(s)
 
@@ -92,7 +93,7 @@ class ProcessPipeline(BasePipeline):
         pass
 
     def shutdown(self):
-        with self._config.db.session_context() as s:
+        with span('shutdown', pipeline=str(self)), self._config.db.session_context() as s:
             log.debug(f'Shutting down {self}')
             self._shutdown(s)
 
@@ -105,7 +106,7 @@ class ProcessPipeline(BasePipeline):
         the start time (local) of an activity.  It is always a string.  It should be quoted if it contains spaces
         or otherwise needs special handling by the shell.
         '''
-        with self._config.db.session_context(expire_on_commit=False) as s:
+        with span('missing', pipeline=str(self)), self._config.db.session_context(expire_on_commit=False) as s:
             missing = self._missing(s) or []  # allow None
         log.debug(f'{len(missing)} missing for {self}')
         return missing
@@ -115,14 +116,19 @@ class ProcessPipeline(BasePipeline):
         raise NotImplementedError('_missing(s)')
 
     def run(self):
-        self.startup()
-        if self.worker:
-            missing = self.__args
-        else:
-            missing = [missed.strip('"') for missed in self.missing()]
+        with span('run', pipeline=str(self)):
+            self.startup()
+            if self.worker:
+                missing = self.__args
+            else:
+                missing = [missed.strip('"') for missed in self.missing()]
+            self._run_missing(missing)
+            self.shutdown()
+
+    def _run_missing(self, missing):
         for missed in missing:
-            self._run_one(missed)
-        self.shutdown()
+            with span('item', item=missed):
+                self._run_one(missed)
 
     def _run_one(self, missed):
         # this should accept strings
@@ -135,8 +141,9 @@ class ProcessPipeline(BasePipeline):
             cprofile = ' ' + mm(CPROFILE)
             if self.cprofile[0]:
                 cprofile = ' ' + self.cprofile[0]
+        trace = ' ' + mm(TRACE) if tracing() else ''
         cmd = self.__ch2 + f'{cprofile} {mm(LOG)} {log_name} {mm(URI)} {self._config.args._format(URI)} ' \
-                           f'{PROCESS} {mm(WORKER)} {pipeline.id} {" ".join(missing)}'
+                           f'{PROCESS}{trace} {mm(WORKER)} {pipeline.id} {" ".join(missing)}'
         log.debug(fmt_cmd(cmd))
         return cmd
 
@@ -156,10 +163,19 @@ class ProcessPipeline(BasePipeline):
 
 
 class LoaderMixin:
+    '''
+    Provides a Loader for the process.
+
+    With series=True numeric activity statistics with more than one value (per-sample data) are stored as
+    arrays in StatisticSeries rather than as rows in statistic_journal.  This is not the default (and is not
+    used in the default profile) because code that reads statistic_journal directly with SQL does not see
+    those values (see StatisticSeries).  To enable it for a process, pass it via add_process, eg
+    add_process(s, ActivityReader, ..., series=True).
+    '''
 
-    def __init__(self, config, *args, batch=True, **kargs):
+    def __init__(self, config, *args, series=False, **kargs):
         super().__init__(config, *args, **kargs)
-        self.__batch = batch
+        self.__series = series
 
     def _get_loader(self, s, add_serial=None, cls=Loader, **kargs):
         if 'owner' not in kargs:
@@ -168,9 +184,8 @@ class LoaderMixin:
             raise Exception('Select serial use')
         else:
             kargs['add_serial'] = add_serial
-        if 'batch' not in kargs:
-            kargs['batch'] = self.__batch
-            self.__batch = False  # only set once or we get multiple callbacks
+        if 'series' not in kargs:
+            kargs['series'] = self.__series
         return cls(s, **kargs)
 
 
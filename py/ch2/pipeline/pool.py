@@ -0,0 +1,91 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from logging import getLogger, FileHandler, Formatter, DEBUG
+from multiprocessing import get_context, current_process
+from os import getpid
+from os.path import join
+
+from ..commands.args import LOG, LOG_DIR, VERBOSITY, DEV
+from ..common.global_ import set_global_dev
+from ..common.log import log_current_exception
+from ..lib.log import make_log_from_args
+from ..lib.trace import start_tracing, span, BATCH
+
+log = getLogger(__name__)
+
+# state in each worker process, set once by _startup
+_CONFIG = None
+_PIPELINES = {}
+
+
+class WorkerPool:
+    '''
+    A pool of long-lived worker processes that run batches of missing values for process pipelines.
+
+    The alternative (running `ch2 process --worker ...` as a new command for each batch) pays for
+    Python startup, imports, configuration and a database connection every time.  Here that is paid
+    once per worker.
+
+    Each worker registers itself in the Process table (with the batch log) while it runs a batch, so
+    that a crashed worker can still be cleaned up by a later `ch2 process`.
+    '''
+
+    def __init__(self, config, n_workers, trace=False):
+        log.info(f'Starting pool of {n_workers} workers')
+        # spawn, rather than fork, so that workers do not share the parent's database connections
+        self.__executor = ProcessPoolExecutor(max_workers=n_workers, mp_context=get_context('spawn'),
+                                              initializer=_startup, initargs=(config.args, trace))
+
+    def submit(self, pipeline, missing, log_name):
+        return self.__executor.submit(_run_batch, pipeline.id, list(missing), log_name)
+
+    def shutdown(self, abort=False):
+        log.debug(f'Shutting down pool (abort={abort})')
+        self.__executor.shutdown(wait=not abort, cancel_futures=abort)
+
+
+def _startup(args, trace):
+    from ..sql import Pipeline, PipelineType
+    from ..sql.config import Config
+    global _CONFIG
+    set_global_dev(args[DEV])
+    make_log_from_args(args._with(**{LOG: f'{current_process().name}.{LOG}', VERBOSITY: 0}))
+    _CONFIG = Config(args)
+    if trace: start_tracing(_CONFIG)
+    # loading the pipelines imports their classes (and so pandas etc) before the first batch
+    with _CONFIG.db.session_context(expire_on_commit=False) as s:
+        for pipeline in s.query(Pipeline).filter(Pipeline.type == PipelineType.PROCESS).all():
+            _PIPELINES[pipeline.id] = pipeline
+    log.info(f'Worker {getpid()} started with {len(_PIPELINES)} pipelines')
+
+
+@contextmanager
+def _batch_log(log_name):
+    path = join(_CONFIG.args._format_path(LOG_DIR), log_name)
+    handler = FileHandler(path)
+    handler.setLevel(DEBUG)
+    handler.setFormatter(Formatter('%(levelname)-7s %(asctime)s: %(message)s'))
+    ch2 = getLogger('ch2')
+    ch2.addHandler(handler)
+    try:
+        yield
+    finally:
+        ch2.removeHandler(handler)
+        handler.close()
+
+
+def _run_batch(id, missing, log_name):
+    from .process import instantiate_pipeline
+    pipeline, pid = _PIPELINES[id], getpid()
+    with _batch_log(log_name), span(BATCH, 'runner', pipeline=str(pipeline), batch=log_name):
+        log.info(f'Worker {pid} running {pipeline} for {len(missing)} missing values')
+        _CONFIG.register_process(pipeline.cls, pid, log_name, constraint=id)
+        try:
+            instantiate_pipeline(pipeline, _CONFIG, *[missed.strip('"') for missed in missing],
+                                 id=id, worker=True).run()
+        except Exception as e:
+            log_current_exception(traceback=True)
+            # the original may not pickle
+            raise Exception(f'{pipeline} failed: {e}') from None
+        finally:
+            _CONFIG.release_process(pipeline.cls, pid)
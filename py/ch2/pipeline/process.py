@@ -1,18 +1,32 @@
 from collections import defaultdict
+from concurrent.futures import wait, FIRST_COMPLETED
+from json import dumps, loads
 from logging import getLogger
+from math import ceil
 from multiprocessing import cpu_count
+from os import close
 from os.path import join, exists
+from selectors import DefaultSelector, EVENT_READ
 from time import sleep
 
 from psutil import NoSuchProcess
 
-from ..commands.args import LOG, LOG_DIR
+from .pool import WorkerPool
+from ..commands.args import LOG, LOG_DIR, PROCESS
 from ..common.date import now, format_seconds, time_to_local_time
-from ..sql import PipelineType, Interval, Pipeline
+from ..lib.trace import start_tracing, span, BATCH
+from ..sql import PipelineType, Interval, Pipeline, SystemConstant
 from ..sql.tables.pipeline import sort_pipelines
 
 log = getLogger(__name__)
 
+ITEM, TOTAL = 'item', 'total'
+
+try:
+    from os import pidfd_open
+except ImportError:  # linux only
+    pidfd_open = None
+
 
 def run_pipeline(config, type, *args, like=tuple(), worker=None, **extra_kargs):
     if type == PipelineType.PROCESS:
@@ -39,8 +53,14 @@ def instantiate_pipeline(pipeline, config, *args, **kargs):
 
 
 class ProcessRunner:
-
-    def __init__(self, config, pipelines, *args, worker=None, n_cpu=cpu_count(), load=1, **kargs):
+    '''
+    Runs pipelines locally (for a worker, or with a single CPU) or schedules batches of missing values
+    across workers.  By default the workers are a persistent pool (see WorkerPool); with pool=False (or
+    when profiling) each batch is a separate `ch2 process --worker ...` command.
+    '''
+
+    def __init__(self, config, pipelines, *args, worker=None, n_cpu=cpu_count(), load=1, pool=True, trace=False,
+                 **kargs):
         if worker and len(pipelines) > 1: raise Exception('Worker with multiple pipelines')
         if not pipelines: raise Exception('No pipelines')
         self.__config = config
@@ -48,6 +68,8 @@ class ProcessRunner:
         self.__worker = worker
         self.__n_cpu = n_cpu
         self.__load = load
+        self.__pool = pool and not kargs.get('cprofile')
+        self.__trace = trace
         self.__args = args
         self.__kargs = kargs
         self.__max_wait = 0
@@ -55,11 +77,21 @@ class ProcessRunner:
         self.__max_wait_proc = None
 
     def run(self):
+        if self.__trace:
+            start_tracing(self.__config, clear=not self.__worker)
         if self.__worker or self.__n_cpu == 1:
             for pipeline in self.__pipelines:
-                self.__run_local(pipeline)
+                with span(BATCH, 'runner', pipeline=str(pipeline), batch=self.__config.args[LOG]):
+                    self.__run_local(pipeline)
         else:
-            self.__run_commands(DependencyQueue(self.__config, self.__pipelines, self.__kargs))
+            with span(PROCESS, 'runner'):
+                queue = DependencyQueue(self.__config, self.__pipelines, self.__kargs,
+                                        n_workers=max(1, int(self.__n_cpu * self.__load)),
+                                        commands=not self.__pool)
+                if self.__pool:
+                    self.__run_pool(queue)
+                else:
+                    self.__run_commands(queue)
 
     def __run_local(self, pipeline):
         log.info(f'Running pipeline {pipeline} locally with {self.__kargs}')
@@ -72,7 +104,8 @@ class ProcessRunner:
         pipelines, popens = {}, []
         while True:
             try:
-                pipeline, cmd, log_index = queue.pop()
+                pipeline, missing, log_index = queue.pop()
+                cmd = queue.command_for_missing(pipeline, missing, log_index)
                 popen = self.__config.run_process(pipeline.cls, cmd, log_name(pipeline, log_index),
                                                   constraint=pipeline.id)
                 pipelines[popen] = (pipeline, log_index)
@@ -84,12 +117,70 @@ class ProcessRunner:
                     log.debug('Nothing new to add')
                     popens = self._run_til_next(pipelines, popens, queue)
                 else:
-                    log.debug('Done')
-                    queue.shutdown()
-                    log.info(f'Maximum wait {format_seconds(self.__max_wait)} for {self.__max_wait_proc} '
-                             f'with {self.__max_wait_procs} processes')
+                    self.__done(queue)
                     return
 
+    def __done(self, queue):
+        log.debug('Done')
+        queue.shutdown()
+        log.info(f'Maximum wait {format_seconds(self.__max_wait)} for {self.__max_wait_proc} '
+                 f'with {self.__max_wait_procs} processes')
+
+    def __record_wait(self, start, pipeline, n_procs):
+        duration = (now() - start).total_seconds()
+        log.debug(f'Waited {format_seconds(duration)}')
+        if duration > self.__max_wait:
+            self.__max_wait = duration
+            self.__max_wait_procs = n_procs
+            self.__max_wait_proc = str(pipeline)
+
+    def __run_pool(self, queue):
+        log.info('Scheduling worker pipelines on pool')
+        capacity = max(1, int(self.__n_cpu * self.__load))
+        pool, futures, ok = WorkerPool(self.__config, capacity, trace=self.__trace), {}, False
+        try:
+            while True:
+                try:
+                    pipeline, missing, log_index = queue.pop()
+                    future = pool.submit(pipeline, missing, log_name(pipeline, log_index))
+                    futures[future] = (pipeline, log_index)
+                    if len(futures) == capacity:
+                        self._wait_for_next(futures, queue)
+                except EmptyException:
+                    if futures:
+                        log.debug('Nothing new to add')
+                        self._wait_for_next(futures, queue)
+                    else:
+                        self.__done(queue)
+                        ok = True
+                        return
+        finally:
+            pool.shutdown(abort=not ok)
+            if not ok:
+                # kill any workers still running batches (they are registered as processes)
+                for pipeline in set(pipeline for pipeline, _ in futures.values()):
+                    self.__config.delete_all_processes(pipeline.cls, constraint=pipeline.id)
+
+    def _wait_for_next(self, futures, queue):
+        queue.log()
+        start = now()
+        log.debug('Waiting for a worker to complete')
+        with span('wait', 'runner'):
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+        for future in done:
+            pipeline, log_index = futures.pop(future)
+            self.__record_wait(start, pipeline, len(futures) + 1)
+            queue.complete(pipeline, log_index)
+            try:
+                future.result()
+            except Exception as e:
+                name = log_name(pipeline, log_index)
+                msg = f'Worker for {pipeline} failed ({e}) see {name} for more info'
+                log.warning(msg)
+                self._copy_log(name)
+                raise Exception(msg)
+            log.debug(f'Batch {log_index} for {pipeline} finished successfully')
+
     def _run_til_next(self, pipelines, popens, queue):
         queue.log()
         start = now()
@@ -97,16 +188,11 @@ class ProcessRunner:
         while True:
             for i, popen in enumerate(popens):
                 popen.poll()
-                process = self.__config.get_process(pipelines[popen][0].cls, popen.pid)
                 if popen.returncode is not None:
                     del popens[i]
-                    duration = (now() - start).total_seconds()
-                    log.debug(f'Waited {format_seconds(duration)}')
                     pipeline, log_index = pipelines.pop(popen)
-                    if duration > self.__max_wait:
-                        self.__max_wait = duration
-                        self.__max_wait_procs = len(pipelines) + 1
-                        self.__max_wait_proc = str(pipeline)
+                    process = self.__config.get_process(pipeline.cls, popen.pid)
+                    self.__record_wait(start, pipeline, len(pipelines) + 1)
                     self.__config.delete_process(pipeline.cls, popen.pid)
                     queue.complete(pipeline, log_index)
                     if popen.returncode:
@@ -119,7 +205,30 @@ class ProcessRunner:
                     else:
                         log.debug(f'Command "{fmt_cmd(popen.args)}" finished successfully')
                         return popens
+            with span('wait', 'runner'):
+                self.__wait_for_exit(popens)
+
+    def __wait_for_exit(self, popens):
+        # block until one of our commands exits.  a pidfd becomes readable on exit but does not reap
+        # (that is left to poll() above) and only watches the given pid (other children are untouched).
+        if not pidfd_open:
+            sleep(0.1)
+            return
+        fds = []
+        try:
+            with DefaultSelector() as selector:
+                for popen in popens:
+                    fds.append(pidfd_open(popen.pid))
+                    selector.register(fds[-1], EVENT_READ)
+                selector.select()
+        except ProcessLookupError:
+            pass  # already gone
+        except OSError as e:  # eg old kernel
+            log.debug(f'Cannot wait on pidfd ({e})')
             sleep(0.1)
+        finally:
+            for fd in fds:
+                close(fd)
 
     def _abort(self, pipelines, popens):
         for popen in popens:
@@ -150,10 +259,27 @@ class EmptyException(Exception): pass
 
 
 class DependencyQueue:
-
-    def __init__(self, config, pipelines, kargs, min_missing=1, max_missing=20, gamma=0.4):
+    '''
+    Batch sizes are chosen so that each batch takes about target_seconds, using the time per item for
+    each pipeline (measured in this run or, failing that, saved from previous runs).  Pipelines with
+    no history fall back to a heuristic based on the number of missing values.  When batches are run
+    as commands (rather than on a pool) they are also limited to max_missing values.
+
+    The saved costs are, for each pipeline, the (smoothed) time per item and the total time.
+
+    Work is scheduled by critical path: the next batch comes from the active pipeline with the most
+    estimated work remaining along its longest chain of dependent pipelines, and unblocked pipelines
+    are activated in the same order.  A schedule is predicted at the start (from saved costs) and
+    compared with what actually happened at shutdown.
+    '''
+
+    def __init__(self, config, pipelines, kargs, min_missing=1, max_missing=20, gamma=0.4,
+                 n_workers=1, target_seconds=60, smoothing=0.5, commands=False):
         self.__clean_pipelines(pipelines)
         self.__config = config
+        self.__pipelines = pipelines
+        self.__dependents = {pipeline: [other for other in pipelines if pipeline in other.blocked_by]
+                             for pipeline in pipelines}
         self.__blocked = [pipeline for pipeline in pipelines if pipeline.blocked_by]
         self.__unblocked = [pipeline for pipeline in pipelines if not pipeline.blocked_by]
         self.__complete = []
@@ -164,8 +290,15 @@ class DependencyQueue:
         self.__max_missing = max_missing
         self.__min_missing = min_missing
         self.__gamma = gamma
+        self.__n_workers = n_workers
+        self.__target_seconds = target_seconds
+        self.__smoothing = smoothing
+        self.__commands = commands
+        self.__costs = self.__read_costs()  # cost_key: {ITEM: seconds per item, TOTAL: seconds for all}
         self.__active_log_indices = defaultdict(lambda: set())
         self.__start = now()
+        self.__started, self.__finished = {}, {}  # pipeline: seconds from start
+        self.__predicted = self.__predict()
         # clear out any junk from previous errors?
         for pipeline in self.__unblocked:
             self.__config.delete_all_processes(pipeline.cls, constraint=pipeline.id)
@@ -189,6 +322,7 @@ class DependencyQueue:
         if self.__stats[pipeline]:
             log.info(f'{pipeline} complete ({self.__stats[pipeline].done})')
             self.__complete.append(pipeline)
+            self.__finished[pipeline] = self.__elapsed()
             instance, missing = self.__active.pop(pipeline)
             if missing: raise Exception(f'Complete pipeline {pipeline} still has missing values {missing}')
             self.__order = [p for p in self.__order if p != pipeline]
@@ -204,9 +338,12 @@ class DependencyQueue:
     def pop(self):
         # unblocking takes some time, so do it step by step as we need more
         # add the new pipeline to the head of active
+        ranks = self.__ranks()
+        self.__unblocked.sort(key=lambda pipeline: ranks[pipeline])
         while self.__unblocked:
             pipeline = self.__unblocked.pop()
-            log.debug(f'Making {pipeline} active')
+            log.debug(f'Making {pipeline} active (rank {format_seconds(ranks[pipeline])})')
+            self.__started[pipeline] = self.__elapsed()
             instance = instantiate_pipeline(pipeline, self.__config, **self.__kargs)
             instance.startup()
             missing = instance.missing()
@@ -215,30 +352,35 @@ class DependencyQueue:
                 log.debug(f'{pipeline}: {len(missing)} missing values')
                 self.__active[pipeline] = instance, missing
                 self.__order.insert(0, pipeline)
+                ranks = self.__ranks()  # now we know how much is missing
                 break
             else:
                 self.__active[pipeline] = instance, None
                 self.__order.insert(0, pipeline)
                 self.complete(pipeline)
                 log.debug(f'{pipeline}: no missing data')
-        for _ in range(len(self.__order)):  # at most, try each once
-            pipeline = self.__order.pop(0)
+        # most urgent first; sort is stable so equal ranks rotate as pipelines move to the end of order
+        for pipeline in sorted(self.__order, key=lambda pipeline: ranks[pipeline], reverse=True):
+            self.__order.remove(pipeline)
             instance, missing = self.__active[pipeline]
             if missing:
                 log_index = self.__unused_log_index(pipeline)
                 missing_args, missing = self.__split_missing(pipeline, missing)
-                cmd = instance.command_for_missing(pipeline, missing_args, log_name(pipeline, log_index))
                 self.__active[pipeline] = instance, missing
                 self.__order.append(pipeline)
                 log.debug(f'{pipeline}: starting batch of {len(missing_args)} missing values')
                 self.__stats[pipeline].start(log_index, len(missing_args))
-                return pipeline, cmd, log_index
+                return pipeline, missing_args, log_index
             else:
                 log.debug(f'{pipeline} exhausted')
                 self.__active[pipeline] = instance, None
                 self.__order.append(pipeline)
         raise EmptyException()
 
+    def command_for_missing(self, pipeline, missing, log_index):
+        instance, _ = self.__active[pipeline]
+        return instance.command_for_missing(pipeline, missing, log_name(pipeline, log_index))
+
     def __unused_log_index(self, pipeline):
         index = 0
         while index in self.__active_log_indices[pipeline]: index += 1
@@ -263,15 +405,106 @@ class DependencyQueue:
         log.info(f'Missing args: min {self.__min_missing}; max {self.__max_missing}; gamma {self.__gamma}')
 
     def __split_missing(self, pipeline, missing):
-        # this (min, min) is a bit weird but makes sense, i think
-        n = min(len(missing),
-                max(self.__min_missing,
-                    min(self.__max_missing, int(pow(self.__stats[pipeline].total, self.__gamma)))))
+        cost = self.__cost(pipeline)
+        if cost:
+            # enough for target_seconds, but not so many that the remaining work can't be shared
+            n = min(int(self.__target_seconds / cost), ceil(len(missing) / self.__n_workers))
+            log.debug(f'{pipeline}: {cost:.2f}s per item so batch of {n}')
+        else:
+            # this (min, min) is a bit weird but makes sense, i think
+            n = min(self.__max_missing, int(pow(self.__stats[pipeline].total, self.__gamma)))
+        if self.__commands:
+            # missing values are passed on the command line, which the shell receives as a single
+            # argument (limited to 128KiB)
+            n = min(self.__max_missing, n)
+        n = min(len(missing), max(self.__min_missing, n))
         return missing[:n], missing[n:]
 
+    def __cost(self, pipeline):
+        # seconds per item, preferring measurements from this run
+        return self.__stats[pipeline].per_item or self.__costs.get(cost_key(pipeline), {}).get(ITEM)
+
+    def __remaining(self, pipeline):
+        # estimated seconds of work still to do for a pipeline
+        if pipeline in self.__complete:
+            return 0
+        elif pipeline in self.__active:
+            _, missing = self.__active[pipeline]
+            if not missing: return 0
+            cost = self.__cost(pipeline)
+            if cost is None:
+                known = sorted(costs[ITEM] for costs in self.__costs.values() if costs.get(ITEM))
+                cost = known[len(known) // 2] if known else 1
+            return len(missing) * cost
+        else:
+            # before missing() is called we can only guess from the last run
+            return self.__costs.get(cost_key(pipeline), {}).get(TOTAL, self.__target_seconds)
+
+    def __ranks(self):
+        # remaining work along the longest chain starting at each pipeline
+        ranks = {}
+        for pipeline in self.__pipelines:
+            self.__rank(pipeline, ranks)
+        return ranks
+
+    def __rank(self, pipeline, ranks):
+        if pipeline not in ranks:
+            ranks[pipeline] = self.__remaining(pipeline) + \
+                              max((self.__rank(dependent, ranks) for dependent in self.__dependents[pipeline]),
+                                  default=0)
+        return ranks[pipeline]
+
+    def __predict(self):
+        # a simple (optimistic) schedule, with each pipeline's work spread over all workers
+        predicted = {}
+        for pipeline in self.__pipelines:
+            self.__predict_one(pipeline, predicted)
+        return predicted
+
+    def __predict_one(self, pipeline, predicted):
+        if pipeline not in predicted:
+            start = max((self.__predict_one(blocker, predicted)[2] for blocker in pipeline.blocked_by), default=0)
+            work = self.__remaining(pipeline)
+            predicted[pipeline] = (work, start, start + work / self.__n_workers)
+        return predicted[pipeline]
+
+    def __elapsed(self):
+        return (now() - self.__start).total_seconds()
+
+    def __log_schedule(self):
+        log.info('Schedule (predicted / actual): work; start; finish')
+        for pipeline in sorted(self.__pipelines, key=lambda pipeline: self.__predicted[pipeline][1]):
+            work, start, finish = self.__predicted[pipeline]
+            actual = self.__stats[pipeline].duration_individual if pipeline in self.__stats else None
+            log.info(f'{str(pipeline):>25s} {pipeline.id:<2d} '
+                     f'{fmt_seconds(work)} / {fmt_seconds(actual)}; '
+                     f'{fmt_seconds(start)} / {fmt_seconds(self.__started.get(pipeline))}; '
+                     f'{fmt_seconds(finish)} / {fmt_seconds(self.__finished.get(pipeline))}')
+        total = sum(work for work, _, _ in self.__predicted.values())
+        makespan = max(max(finish for _, _, finish in self.__predicted.values()), total / self.__n_workers)
+        log.info(f'Predicted makespan {format_seconds(makespan)} (at least); '
+                 f'actual {format_seconds(self.__elapsed())}')
+
+    def __read_costs(self):
+        costs = self.__config.get_constant(SystemConstant.PIPELINE_COSTS, none=True)
+        return loads(costs) if costs else {}
+
+    def __write_costs(self):
+        for pipeline, stats in self.__stats.items():
+            costs = self.__costs.setdefault(cost_key(pipeline), {})
+            for name, value in ((ITEM, stats.per_item), (TOTAL, stats.duration_individual)):
+                if value is not None:
+                    if name in costs:
+                        costs[name] = self.__smoothing * costs[name] + (1 - self.__smoothing) * value
+                    else:
+                        costs[name] = value
+        self.__config.set_constant(SystemConstant.PIPELINE_COSTS, dumps(self.__costs), force=True)
+
     def shutdown(self):
         self.log()
         self.__log_efficiency()
+        self.__log_schedule()
+        self.__write_costs()
         if self.__blocked:
             log.warning(f'{len(self.__blocked)} pipelines still blocked')
             for pipeline in self.__blocked:
@@ -307,6 +540,10 @@ class Stats:
         if self:
             self.duration_overall = (now() - self.__start_overall).total_seconds()
 
+    @property
+    def per_item(self):
+        return self.duration_individual / self.done if self.done else None
+
     def __bar(self, width):
         solid = int(width * self.done / self.total) if self.total else width
         blank = width - solid
@@ -332,6 +569,14 @@ class Stats:
         return self.done == self.total
 
 
+def fmt_seconds(seconds):
+    return '-' if seconds is None else format_seconds(seconds)
+
+
+def cost_key(pipeline):
+    return f'{pipeline}:{pipeline.id}'
+
+
 def log_name(pipeline, log_index):
     return f'{pipeline}.{log_index}.{LOG}'
 
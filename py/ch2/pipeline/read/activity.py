@@ -1,18 +1,24 @@
+from concurrent.futures import ProcessPoolExecutor
 from logging import getLogger
+from multiprocessing import get_context
 from os.path import splitext, basename
 
-from pygeotile.point import Point
+import numpy as np
+import pandas as pd
 
 from .utils import AbortImportButMarkScanned, ProcessFitReader
 from ..pipeline import LoaderMixin
-from ...commands.args import DEFAULT
+from ...commands.args import DEFAULT, BASE, CACHE, base_system_path
 from ...commands.upload import ACTIVITY
 from ...common.date import to_time
 from ...diary.model import TYPE, EDIT
-from ...fit.format.records import fix_degrees, merge_duplicates, no_bad_values
+from ...fit.cache import FitCache, DEFAULT_CACHE_MB
+from ...fit.format.read import columnar_records, TIMESTAMP
 from ...fit.profile.profile import read_fit
 from ...lib.io import split_fit_path
+from ...lib.trace import span
 from ...names import N, T, U, Sports, S
+from ...sql import FileScan, FileHash
 from ...sql.database import StatisticJournalText
 from ...sql.tables.activity import ActivityGroup, ActivityJournal, ActivityTimespan
 from ...sql.tables.statistic import StatisticJournalFloat, STATISTIC_JOURNAL_CLASSES, StatisticName, \
@@ -23,6 +29,17 @@ from ...srtm.bilinear import bilinear_elevation_from_constant
 
 log = getLogger(__name__)
 
+MERCATOR_RADIUS = 6378137  # as pygeotile (WGS84 equatorial radius)
+
+
+def decode_records(path, hash, field_names, other_names, cache):
+    # module-level so that it can run in a ProcessPoolExecutor
+    records = cache.read(hash, field_names, other_names) if cache and hash else None
+    if records is None:
+        records = ActivityReader.parse_records(read_fit(path), field_names)
+        if cache and hash: cache.write(hash, field_names, other_names, *records)
+    return records
+
 
 # duplicate data in
 # /home/andrew/archive/fit/batch/DI_CONNECT/DI-Connect-Fitness/UploadedFiles_0-_Part1/andrew@acooke.org_24715592701_tap-sync-18690-cc1dd93225119215a1ea87c584a974ce.fit
@@ -31,15 +48,23 @@ log = getLogger(__name__)
 class ActivityReader(LoaderMixin, ProcessFitReader):
 
     KIT = 'kit'
+    OTHER_NAMES = ('event', 'sport', 'session', 'device_info')
 
-    def __init__(self, *args, sport_to_activity=None, record_to_db=None, **kargs):
+    def __init__(self, *args, sport_to_activity=None, record_to_db=None, cache_mb=DEFAULT_CACHE_MB,
+                 decode_workers=1, **kargs):
         self.sport_to_activity = self._assert('sport_to_activity', sport_to_activity)
         self.record_to_db = [(field, title, units, STATISTIC_JOURNAL_CLASSES[type])
                              for field, (title, units, type)
                              in self._assert('record_to_db', record_to_db).items()]
         self.add_elevation = not any(title == T.ELEVATION for (field, title, units, type) in self.record_to_db)
         self.__ajournal = None  # save for coverage
+        # ProcessRunner already runs a worker per core, so only use more when the reader is run alone
+        self.decode_workers = decode_workers
+        self.__decoded = {}  # path -> future, while decoding ahead in _run_missing
         super().__init__(*args, sub_dir=ACTIVITY, **kargs)
+        # outside the versioned directory so that it survives database upgrades
+        self.__cache = FitCache(base_system_path(self._config.args[BASE], subdir=CACHE, version=None),
+                                max_mb=cache_mb) if cache_mb else None
 
     def _startup(self, s):
         self.__srtm1 = bilinear_elevation_from_constant(s)
@@ -72,41 +97,94 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
 
     @staticmethod
     def _read_device(records):
-        for record in records:
+        columns, others = records
+        for record in others:
             if record.name == 'device_info' and 'garmin_product' in record.data:
                 return record.value.garmin_product
         return None
 
     def _read_data(self, s, file_scan):
         log.info('Reading activity data from %s' % file_scan)
-        records = self.parse_records(read_fit(file_scan.path))
+        records = self._read_records(file_scan)
         kit = self._read_kit(file_scan.path)
         device = self._read_device(records)
         ajournal, activity_group, first_timestamp = self._create_activity(s, file_scan, kit, records)
         return ajournal, (ajournal, activity_group, first_timestamp, file_scan, kit, device, records)
 
+    def _run_missing(self, missing):
+        # decoding is cpu-bound and independent of the database, so files are decoded in separate processes
+        # ahead of the (serial) loading.  the number in flight is bounded to limit memory use.
+        if self.decode_workers < 2 or len(missing) < 2:
+            return super()._run_missing(missing)
+        with self._config.db.session_context() as s:
+            hashes = dict(s.query(FileScan.path, FileHash.hash).join(FileHash).
+                          filter(FileScan.path.in_(missing)).all())
+        field_names = self.__field_names()
+        paths = iter(missing)
+        # spawn, rather than fork, so that the decoders do not share this process's database connections
+        with ProcessPoolExecutor(max_workers=self.decode_workers, mp_context=get_context('spawn')) as executor:
+            try:
+                for missed in missing:
+                    while len(self.__decoded) < 2 * self.decode_workers:
+                        path = next(paths, None)
+                        if path is None: break
+                        self.__decoded[path] = executor.submit(decode_records, path, hashes.get(path, None),
+                                                               field_names, self.OTHER_NAMES, self.__cache)
+                    with span('item', item=missed):
+                        self._run_one(missed)
+                    self.__decoded.pop(missed, None)
+            finally:
+                for future in self.__decoded.values():
+                    future.cancel()
+                self.__decoded = {}
+
+    def __field_names(self):
+        return [field for field, _, _, _ in self.record_to_db]
+
+    def _read_records(self, file_scan):
+        future = self.__decoded.pop(file_scan.path, None)
+        if future:
+            return future.result()
+        else:
+            return decode_records(file_scan.path, file_scan.file_hash.hash, self.__field_names(),
+                                  self.OTHER_NAMES, self.__cache)
+
     @staticmethod
-    def parse_records(data):
+    def parse_records(data, field_names=tuple()):
+        # record messages are read as columns (the bulk of the file); the rest as (a few) DictRecords
         log.debug('Parsing records')
-        records = ActivityReader.read_fit_file(data, merge_duplicates, fix_degrees, no_bad_values)
+        types, messages, columns, others = columnar_records(data, field_names, other_names=ActivityReader.OTHER_NAMES)
         log.debug('Parsed')
-        return records
+        return columns, others
 
     @staticmethod
     def read_sport(path, records):
+        columns, others = records
         try:
-            return ActivityReader._first(path, records, 'sport').value.sport.lower()
+            return ActivityReader._first(path, others, 'sport').value.sport.lower()
         except AbortImportButMarkScanned:
             # alternative for some garmin devices (florian)
-            return ActivityReader._first(path, records, 'session').value.sport.lower()
+            return ActivityReader._first(path, others, 'session').value.sport.lower()
+
+    @staticmethod
+    def _timestamps(path, records):
+        columns, others = records
+        timestamps = [record.value.timestamp for record in others if record.name == 'event']
+        if len(columns[TIMESTAMP]):
+            timestamps += [to_time(columns[TIMESTAMP][0]), to_time(columns[TIMESTAMP][-1])]
+        if not timestamps:
+            msg = f'No event or record entry(s) in {path}'
+            log.debug(msg)
+            raise AbortImportButMarkScanned(msg)
+        return timestamps
 
     @staticmethod
     def read_first_timestamp(path, records):
-        return ActivityReader._first(path, records, 'event', 'record').value.timestamp
+        return min(ActivityReader._timestamps(path, records))
 
     @staticmethod
     def read_last_timestamp(path, records):
-        return ActivityReader._last(path, records, 'event', 'record').value.timestamp
+        return max(ActivityReader._timestamps(path, records))
 
     def _create_activity(self, s, file_scan, kit, records):
         first_timestamp = self.read_first_timestamp(file_scan.path, records)
@@ -189,7 +267,8 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
     def _load_data(self, s, loader, data):
 
         ajournal, activity_group, first_timestamp, file_scan, kit, device, records = data
-        timespan, warned, logged, last_timestamp = None, 0, 0, to_time(0.0)
+        columns, others = records
+        timespan = None
 
         log.debug(f'Loading {self.record_to_db}')
 
@@ -200,9 +279,9 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
             else:
                 return False
 
-        have_timespan = any(is_event(record, 'start') for record in records)
-        only_records = list(filter(lambda x: x.name == 'record', records))
-        final_timestamp = only_records[-1].timestamp
+        have_timespan = any(is_event(record, 'start') for record in others)
+        times = columns[TIMESTAMP]
+        final_timestamp = to_time(times[-1])
 
         if kit: loader.add_data(N.KIT, ajournal, kit, ajournal.start)
         if device: loader.add_data(N.DEVICE, ajournal, device, ajournal.start)
@@ -211,12 +290,13 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
         self.__ajournal = ajournal
 
         if not have_timespan:
-            first_timestamp = only_records[0].timestamp
+            first_timestamp = to_time(times[0])
             log.warning('Experimental handling of data without timespans')
             timespan = add(s, ActivityTimespan(activity_journal=ajournal, start=first_timestamp, finish=final_timestamp))
+            ajournal.finish = final_timestamp
 
-        for record in records:
-
+        # timespans depend only on events (record data are loaded whether inside a timespan or not)
+        for record in others:
             if have_timespan and is_event(record, 'start'):
                 if timespan:
                     log.warning('Ignoring start with no corresponding stop (possible lost data?)')
@@ -224,44 +304,6 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
                     timespan = add(s, ActivityTimespan(activity_journal=ajournal,
                                                        start=record.value.timestamp,
                                                        finish=record.value.timestamp))
-
-            elif record.name == 'record':
-                if record.value.timestamp > last_timestamp:
-                    lat, lon, timestamp = None, None, record.value.timestamp
-                    # elapsed time is not customizable because it needs extra processing
-                    loader.add_data(T.ELAPSED_TIME, ajournal,
-                                    (record.value.timestamp - first_timestamp).total_seconds(), timestamp)
-                    # customizable loader
-                    for field, title, units, type in self.record_to_db:
-                        value = record.data.get(field, None)
-                        if logged < 3:
-                            log.debug(f'{title} = {value}')
-                        if value is not None:
-                            value = value[0][0]
-                            if units == U.KM:  # internally everything uses M
-                                value /= 1000
-                            loader.add_data(title, ajournal, value, timestamp)
-                            if title == T.LATITUDE:
-                                lat = value
-                            elif title == T.LONGITUDE:
-                                lon = value
-                    logged += 1
-                    # values derived from lat/lon
-                    if lat is not None and lon is not None:
-                        x, y = Point.from_latitude_longitude(lat, lon).meters
-                        loader.add_data(N.SPHERICAL_MERCATOR_X, ajournal, x, timestamp)
-                        loader.add_data(N.SPHERICAL_MERCATOR_Y, ajournal, y, timestamp)
-                        if self.add_elevation:
-                            elevation = self.__srtm1.elevation(lat, lon)
-                            if elevation:
-                                loader.add_data(N.SRTM1_ELEVATION, ajournal, elevation, timestamp)
-                else:
-                    log.warning('Ignoring duplicate record data for %s at %s - some data may be missing' %
-                                (file_scan.path, record.value.timestamp))
-                last_timestamp = record.value.timestamp
-                if not have_timespan:
-                    ajournal.finish = record.value.timestamp
-
             elif have_timespan and is_event(record, 'stop_all', 'stop'):
                 if timespan:
                     timespan.finish = record.value.timestamp
@@ -274,6 +316,33 @@ class ActivityReader(LoaderMixin, ProcessFitReader):
             log.warning('Cleaning up dangling timespan')
             timespan.finish = final_timestamp
 
+        # rows are sorted, so a repeated timestamp is duplicate data
+        keep = np.diff(times, prepend=0.0) > 0
+        for time in times[~keep]:
+            log.warning('Ignoring duplicate record data for %s at %s - some data may be missing' %
+                        (file_scan.path, to_time(time)))
+        times = times[keep]
+        # customizable loader (elapsed time is not customizable because it needs extra processing)
+        df = pd.DataFrame({T.ELAPSED_TIME: times - first_timestamp.timestamp()},
+                          index=pd.to_datetime(times, unit='s', utc=True))
+        for field, title, units, type in self.record_to_db:
+            # internally everything uses M; integer values are converted when staged
+            df[title] = columns[field][keep] / 1000 if units == U.KM else columns[field][keep]
+        log.debug(f'First rows:\n{df.head(3)}')
+        # values derived from lat/lon
+        lat, lon = df.get(T.LATITUDE), df.get(T.LONGITUDE)
+        if lat is not None and lon is not None:
+            lat, lon = lat.to_numpy(), lon.to_numpy()
+            # as pygeotile's Point.meters (spherical mercator), but for all points at once
+            df[N.SPHERICAL_MERCATOR_X] = np.radians(lon) * MERCATOR_RADIUS
+            df[N.SPHERICAL_MERCATOR_Y] = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * MERCATOR_RADIUS
+            if self.add_elevation:
+                elevation = np.full(len(df), np.nan)
+                for i in np.flatnonzero(~(np.isnan(lat) | np.isnan(lon))):
+                    elevation[i] = self.__srtm1.elevation(lat[i], lon[i]) or np.nan
+                df[N.SRTM1_ELEVATION] = elevation
+        loader.add_frame(df, {column: column for column in df.columns}, ajournal)
+
     def _read(self, s, path):
         loader = super()._read(s, path)
         for title, percent in loader.coverage_percentages():
@@ -10,6 +10,7 @@ from ...common.log import log_current_exception
 from ...fit.format.read import filtered_records
 from ...lib import to_time
 from ...lib.io import modified_file_scans
+from ...lib.trace import span
 from ...sql import Timestamp, FileScan
 
 log = getLogger(__name__)
@@ -55,11 +56,14 @@ class ProcessFitReader(ProcessPipeline):
     def _read(self, s, file_scan):
         path = file_scan.path  # read this now so that on error we don't go back to database
         try:
-            source, data = self._read_data(s, file_scan)
+            with span('read_data'):
+                source, data = self._read_data(s, file_scan)
             with Timestamp(owner=self.owner_out, source=source).on_success(s):
                 loader = self._get_loader(s, add_serial=True)
-                self._load_data(s, loader, data)
-                loader.load()
+                # as in the calculators, the span for each phase includes loading its results
+                with span('load_data'):
+                    self._load_data(s, loader, data)
+                    loader.load()
             return loader  # returned so coverage can be accessed
         except Exception as e:
             log_current_exception(traceback=True)
@@ -1,14 +1,77 @@
+import datetime as dt
 from collections import defaultdict
+from io import StringIO
 from itertools import groupby
 from logging import getLogger
+from numbers import Integral
 from weakref import WeakSet
 
 from sqlalchemy import Sequence, select, text, inspect
 from sqlalchemy.event import listen
 
+from ..lib.trace import count
+
 log = getLogger(__name__)
 
 
+def sequence_ids(session, table, n, column='id'):
+    '''
+    Allocate n ids from the (serial) sequence for the given table in a single query.
+    '''
+    id_seq_name = f'{table.__tablename__}_{column}_seq'
+    schema = table.__table__.metadata.schema
+    sequence = Sequence(id_seq_name, schema=schema)
+    return [int(row[0]) for row in session.connection().execute(
+        select([sequence.next_value()]).select_from(text("generate_series(1, :num_values)")),
+        num_values=n)]
+
+
+def delete_statistics(session, source_ids):
+    '''
+    Delete all statistics for the given sources (a query or list of ids) with a single statement.
+    Call this before deleting the sources themselves, which would otherwise cascade to the statistics
+    separately for each source.
+    '''
+    from .tables.statistic import StatisticJournal
+    n = session.query(StatisticJournal). \
+        filter(StatisticJournal.source_id.in_(source_ids)). \
+        delete(synchronize_session=False)
+    log.debug(f'Deleted {n} statistics')
+    return n
+
+
+def copy_rows(session, table, columns, rows):
+    '''
+    Insert rows via COPY (postgres only), within the session's current transaction.
+    This bypasses the ORM entirely (no events, no identity map).
+    '''
+    data = StringIO()
+    for row in rows:
+        data.write(','.join(_csv_value(value) for value in row))
+        data.write('\n')
+    data.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f'copy {table.__tablename__} ({", ".join(columns)}) from stdin with (format csv)', data)
+        count(written=max(cursor.rowcount, 0))  # not seen by engine events
+    finally:
+        cursor.close()
+
+
+def _csv_value(value):
+    # an unquoted empty field is null, so strings are always quoted
+    if value is None:
+        return ''
+    elif isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    elif isinstance(value, dt.datetime):
+        return value.isoformat()
+    elif isinstance(value, Integral):
+        return str(int(value))
+    else:
+        return repr(float(value))  # repr for full precision (float() for numpy types)
+
+
 class BatchLoader:
 
     def __init__(self, enabled=True, max_msg_cnt=10):
@@ -60,18 +123,9 @@ class BatchLoader:
             self.warning(f'Composite primary key for {mapper}')
         return False
 
-    @staticmethod
-    def __ids(session, mapper, column, n):
-        id_seq_name = f'{mapper.entity.__tablename__}_{column}_seq'
-        schema = mapper.entity.__table__.metadata.schema
-        sequence = Sequence(id_seq_name, schema=schema)
-        return [int(row[0]) for row in session.connection().execute(
-            select([sequence.next_value()]).select_from(text("generate_series(1, :num_values)")),
-            num_values=n)]
-
     def __set_ids(self, session, mapper, column, missing):
         n = len(missing)
-        for id, instance in zip(self.__ids(session, mapper, column, n), missing):
+        for id, instance in zip(sequence_ids(session, mapper.entity, n, column=column), missing):
             setattr(instance, column, id)
         self.rows += 1
 
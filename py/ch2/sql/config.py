@@ -45,6 +45,14 @@ class Config(BaseConfig):
         with self.db.session_context() as s:
             return Process.run(s, owner, cmd, log_name, constraint=constraint)  # todo change order
 
+    def register_process(self, owner, pid, log_name, constraint=None):
+        with self.db.session_context() as s:
+            Process.register(s, owner, pid, log_name, constraint=constraint)
+
+    def release_process(self, owner, pid):
+        with self.db.session_context() as s:
+            Process.release(s, owner, pid)
+
     def delete_process(self, owner, pid, delta_seconds=3):
         with self.db.session_context() as s:
             Process.delete(s, owner, pid, delta_seconds=delta_seconds)
@@ -8,6 +8,7 @@ from .kit import KitGroup, KitItem, KitComponent, KitModel
 from .nearby import ActivitySimilarity, ActivityNearby
 from .pipeline import Pipeline, PipelineType
 from .sector import SectorGroup, Sector, SectorClimb, SectorJournal, SectorType
+from .series import StatisticSeries
 from .source import Source, Interval, NoStatistics, Composite, CompositeComponent
 from .statistic import StatisticName, StatisticJournalFloat, StatisticJournalText, StatisticJournalInteger, \
     StatisticJournalTimestamp, StatisticJournal, StatisticMeasure, StatisticJournalType
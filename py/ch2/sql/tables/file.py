@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Text, Integer, ForeignKey, Index, DateTime
+from sqlalchemy import Column, Text, Integer, ForeignKey, Index, DateTime, BigInteger, Float
 from sqlalchemy.orm import relationship, backref
 
 from ..support import Base
@@ -38,11 +38,24 @@ class FileScan(Base):
     file_hash_id = Column(Integer, ForeignKey('file_hash.id'), nullable=False)
     file_hash = relationship('FileHash', backref=backref('file_scan', cascade='all, delete-orphan',
                                                          passive_deletes=True, uselist=False))
+    # stat of the file when the hash was last calculated (if unchanged, the hash is assumed unchanged)
+    size = Column(BigInteger)
+    mtime = Column(Float)
+    inode = Column(BigInteger)
     Index('natural_primary_file_scan', path, owner)
 
     @classmethod
-    def add(cls, s, path, owner, hash):
-        return add(s, FileScan(path=path, owner=owner, last_scan=to_time(0.0), file_hash=FileHash.get_or_add(s, hash)))
+    def add(cls, s, path, owner, hash, stat=None):
+        file_scan = add(s, FileScan(path=path, owner=owner, last_scan=to_time(0.0),
+                                    file_hash=FileHash.get_or_add(s, hash)))
+        if stat: file_scan.set_stat(stat)
+        return file_scan
+
+    def set_stat(self, stat):
+        self.size, self.mtime, self.inode = stat.st_size, stat.st_mtime, stat.st_ino
+
+    def same_stat(self, stat):
+        return (self.size, self.mtime, self.inode) == (stat.st_size, stat.st_mtime, stat.st_ino)
 
     def __str__(self):
         return self.path
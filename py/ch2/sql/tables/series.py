@@ -0,0 +1,102 @@
+from io import BytesIO
+from logging import getLogger
+
+import numpy as np
+from sqlalchemy import Column, Integer, ForeignKey, UniqueConstraint, LargeBinary
+from sqlalchemy.orm import relationship
+
+from ..support import Base
+from ..types import ShortCls, UTC
+from ...common.date import to_time
+
+log = getLogger(__name__)
+
+TIMES, VALUES, SERIALS = 'times', 'values', 'serials'
+US = 1e6
+IN_USE = 'statistic_series_in_use'
+
+
+class StatisticSeries(Base):
+    '''
+    The per-sample numeric statistics for one source (typically an activity journal) from one owner,
+    stored as compressed numpy arrays rather than one statistic_journal row (plus child row) per value.
+
+    The arrays are keyed by statistic name id.  Times are integer microseconds since the epoch.
+
+    Only high-volume series are stored here (see the series option on Loader).  Scalars stay in
+    statistic_journal, where they are used by summaries and search.  Statistics (ch2.data.query) and
+    the nearby calculation read both transparently.
+
+    Code that reads statistic_journal directly with SQL does not see values stored here.  Currently
+    that is the statistics view (added with the profile), the route text in the sector servlet and the
+    climb, achievement and summary calculations, which all read scalars (or routes built from
+    Statistics), and the old (sqlite) coasting search, which is no longer used.
+    '''
+
+    __tablename__ = 'statistic_series'
+
+    id = Column(Integer, primary_key=True)
+    source_id = Column(Integer, ForeignKey('source.id', ondelete='cascade'), nullable=False)
+    source = relationship('Source')
+    owner = Column(ShortCls, nullable=False)  # index via unique
+    start = Column(UTC, nullable=False)
+    finish = Column(UTC, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    UniqueConstraint(source_id, owner)
+
+    @staticmethod
+    def encode(arrays):
+        '''
+        arrays is a map from statistic name id to (times, values, serials).
+        '''
+        buffer = BytesIO()
+        np.savez_compressed(buffer, **{f'{key}.{id}': array
+                                       for id, columns in arrays.items()
+                                       for key, array in zip((TIMES, VALUES, SERIALS), columns)})
+        return buffer.getvalue()
+
+    def decode(self):
+        with np.load(BytesIO(self.data)) as npz:
+            return {int(id): tuple(npz[f'{key}.{id}'] for key in (TIMES, VALUES, SERIALS))
+                    for id in set(name.split('.')[1] for name in npz.files)}
+
+    @classmethod
+    def add(cls, s, source, owner, arrays):
+        '''
+        Add (or replace, by statistic name) arrays of times (in seconds), values and serials for the
+        given source and owner.
+        '''
+        arrays = {id: (np.round(np.asarray(times, dtype=float) * US).astype(np.int64),
+                       np.asarray(values, dtype=float), np.asarray(serials, dtype=np.int64))
+                  for id, (times, values, serials) in arrays.items()}
+        series = s.query(StatisticSeries). \
+            filter(StatisticSeries.source_id == source.id,
+                   StatisticSeries.owner == owner).one_or_none()
+        if series:
+            previous = series.decode()
+            for id in arrays:
+                if id in previous: log.warning(f'Replacing series for statistic name {id} in {series}')
+            previous.update(arrays)
+            arrays = previous
+        else:
+            series = StatisticSeries(source_id=source.id, owner=owner)
+            s.add(series)
+        times = [times for times, _, _ in arrays.values() if len(times)]
+        series.start = to_time(min(t.min() for t in times) / US)
+        series.finish = to_time(max(t.max() for t in times) / US)
+        series.data = cls.encode(arrays)
+        s.info[IN_USE] = True
+        return series
+
+    @classmethod
+    def in_use(cls, s):
+        '''
+        Are any values stored as series?  Checked once per session, so that databases that never use
+        series do not pay for an additional query on every read.
+        '''
+        if IN_USE not in s.info:
+            s.info[IN_USE] = s.query(s.query(StatisticSeries.id).exists()).scalar()
+        return s.info[IN_USE]
+
+    def __str__(self):
+        return f'StatisticSeries {self.owner} / {self.source_id}'
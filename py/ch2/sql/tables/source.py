@@ -9,6 +9,7 @@ from sqlalchemy.event import listens_for
 from sqlalchemy.orm import Session, relationship
 from sqlalchemy.sql.functions import count
 
+from ..batch import delete_statistics
 from ..support import Base
 from ..triggers import add_child_ddl
 from ..types import OpenSched, ShortCls, short_cls
@@ -182,14 +183,24 @@ class Interval(Source):
         The time range over which statistics exist, ignoring constants at "time zero".
         This is the first to the last time for any statistics - it pays no attention to gaps.
         '''
+        from .series import StatisticSeries
         from .statistic import StatisticJournal, StatisticName
         # exclude 2 days from zero because here are some stats set at the date equivalent to zero time,
         # but because of date/time conversions and timezones these are not exactly as time zero
-        q = s.query(func.min(StatisticJournal.time), func.max(StatisticJournal.time)). \
+        q = s.query(StatisticJournal.time). \
             filter(StatisticJournal.time > TIME_ZERO + dt.timedelta(days=2))
+        q_series = s.query(func.min(StatisticSeries.start), func.max(StatisticSeries.finish))
         if exclude_owners:
-            q = q.join(StatisticName).filter(~StatisticName.owner.in_(exclude_owners))
-        start, finish = q.one()
+            # a sub-select on names (rather than a join) so that the time index can be used below
+            q = q.filter(~StatisticJournal.statistic_name_id.in_(
+                s.query(StatisticName.id).filter(StatisticName.owner.in_(exclude_owners))))
+            q_series = q_series.filter(~StatisticSeries.owner.in_(exclude_owners))
+        # first / last values via the index on time, rather than an aggregate over the whole table
+        start = q.order_by(StatisticJournal.time).limit(1).scalar()
+        finish = q.order_by(StatisticJournal.time.desc()).limit(1).scalar()
+        # activity data may also be stored as series
+        series_start, series_finish = q_series.one()
+        start, finish = min_time(start, series_start), max_time(finish, series_finish)
         if start and finish:
             return start, finish
         else:
@@ -198,7 +209,8 @@ class Interval(Source):
     @classmethod
     def missing_starts(cls, s, expected, schedule, interval_owner, exclude_owners=None):
         '''
-        Previous approach was way too complicated and not thread-safe.  Instead, just enumerate intervals and test.
+        Previous approach was way too complicated and not thread-safe.  Instead, just enumerate intervals and test
+        (with a single query that counts existing intervals for all frames).
         '''
         try:
             stats_start_time, stats_finish_time = cls._raw_statistics_time_range(s, exclude_owners=exclude_owners)
@@ -207,12 +219,14 @@ class Interval(Source):
             log.debug('Statistics (in general) exist %s - %s' % (start, finish))
             start = schedule.start_of_frame(start)
             finish = schedule.next_frame(finish)
+            existing = dict(s.query(Interval.start, count(Interval.id)).
+                            filter(Interval.start >= start,
+                                   Interval.start < finish,
+                                   Interval.schedule == schedule,
+                                   Interval.owner == interval_owner).
+                            group_by(Interval.start).all())
             while start < finish:
-                existing = s.query(Interval). \
-                    filter(Interval.start == start,
-                           Interval.schedule == schedule,
-                           Interval.owner == interval_owner).count()
-                if existing != expected:
+                if existing.get(start, 0) != expected:
                     yield start
                 start = schedule.next_frame(start)
         except NoStatistics:
@@ -246,6 +260,7 @@ class Interval(Source):
         count = q.count()
         if count:
             log.debug(f'Cleaning {count} dirty intervals {extra}')
+            delete_statistics(s, q)
             s.query(Source).filter(Source.id.in_(q)).delete(synchronize_session=False)
             s.commit()
         log.debug('Intervals clean')
@@ -309,6 +324,7 @@ class Composite(Source):
             log.debug(f'Executing {q_all_nodes}')
             s.flush()
             with timing('GC of composite sources'):
+                delete_statistics(s, q_all_nodes)
                 s.query(Source).filter(Source.id.in_(q_all_nodes)).delete(synchronize_session=False)
 
     @classmethod
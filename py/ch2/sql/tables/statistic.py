@@ -144,6 +144,8 @@ class StatisticJournal(Base):
 
     __tablename__ = 'statistic_journal'
 
+    # if partitioned (see partition_statistic_journal) the primary key in the database is (id, time)
+    # but id alone is still unique and identifies the entry
     id = Column(Integer, primary_key=True)
     type = Column(Integer, nullable=False, index=True)  # index needed for fast delete of subtypes
     statistic_name_id = Column(Integer, ForeignKey('statistic_name.id', ondelete='cascade'), nullable=False)
@@ -301,8 +303,11 @@ class StatisticJournal(Base):
 
     @classmethod
     def at_interval(cls, s, start, schedule, statistic_owner, statistic_name, interval_owner):
+        # the explicit time range is redundant, but allows postgres to prune partitions (if used)
         return s.query(StatisticJournal).join(StatisticName).join(Interval). \
                     filter(StatisticJournal.statistic_name_id == StatisticName.id,
+                           StatisticJournal.time >= local_date_to_time(start),
+                           StatisticJournal.time < local_date_to_time(schedule.next_frame(start)),
                            Interval.schedule == schedule,
                            Interval.start == start,
                            Interval.owner == interval_owner,
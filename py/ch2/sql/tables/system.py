@@ -56,6 +56,7 @@ class SystemConstant(Base):
     LAST_GARMIN = 'last-garmin'
     DB_VERSION = 'db-version'
     LOG_COLOR = 'log-color'
+    PIPELINE_COSTS = 'pipeline-costs'
 
 
 class Process(Base):
@@ -81,6 +82,23 @@ class Process(Base):
         s.commit()
         return popen
 
+    @classmethod
+    def register(cls, s, owner, pid, log_name, constraint=None):
+        # for an existing process (eg a pool worker).  start is the creation time of the process
+        # (not now) so that exists() still recognises it.
+        log.debug(f'Registering process {pid}')
+        s.query(Process).filter(Process.pid == pid).delete(synchronize_session=False)
+        s.add(Process(owner=owner, pid=pid, log=log_name, constraint=str_or_none(constraint),
+                      start=to_time(ps.Process(pid).create_time())))
+        s.commit()
+
+    @classmethod
+    def release(cls, s, owner, pid):
+        # unlike delete(), this leaves the process running
+        log.debug(f'Releasing record for process {pid}')
+        s.query(Process).filter(Process.owner == owner, Process.pid == pid).delete(synchronize_session=False)
+        s.commit()
+
     @classmethod
     def delete(cls, s, owner, pid, delta_seconds=3):
         # ignore constraint here because we have pid
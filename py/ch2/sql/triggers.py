@@ -6,30 +6,40 @@ def child_ddl(parent, child, identity):
     '''
     Remove the existing foreign key with constraint and add one without cascade.
     Then re-implement the cascade, but restricting to the correct child table (only).
-    Finally, add a warning to catch direct deletion of child tables
     (I did try a reverse cascade, but it causes problems with circular invocation).
 
     Assumes primary key is called 'id' in both tables, that the discriminator is called 'type',
     and that the existing foreign key constraint is called {child}_id_fkey.
 
-    Note 'before' for child cascades to avoid foreign key conflict.
+    The cascade is a statement level trigger using a transition table, so that deleting many parent
+    rows deletes the children with a single statement (rather than one per row).  Since this runs
+    after the parents are deleted, the foreign key is deferred until commit.
     '''
     return DDL(f'''
 alter table "{child}" drop constraint "{child}_id_fkey";
 alter table "{child}" add constraint "{child}_id_fkey"
-  foreign key (id) references "{parent}"(id);
-create function "{child}_cascade"() returns trigger as $$
+  foreign key (id) references "{parent}"(id) deferrable initially deferred;
+{child_cascade_sql(parent, child, identity)}''')
+
+
+def child_cascade_sql(parent, child, identity):
+    '''
+    The statement level cascade from parent to child (separate so that it can be re-created
+    if the parent table is replaced).
+    '''
+    return f'''
+create or replace function "{child}_cascade"() returns trigger as $$
   begin
-    delete from "{child}" where id = old.id;
-    return old;
+    delete from "{child}" using old_rows where "{child}".id = old_rows.id and old_rows.type = {identity};
+    return null;
   end
 $$ language plpgsql;
  create trigger "{child}_cascade_trg"
- before delete on "{parent}"
-    for each row
-   when (old.type = {identity})
+  after delete on "{parent}"
+    referencing old table as old_rows
+    for each statement
 execute procedure "{child}_cascade"();
-''')
+'''
 
 
 def add_child_ddl(parent_table):
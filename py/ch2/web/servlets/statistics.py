@@ -1,9 +1,11 @@
 from ch2.common.date import time_to_local_time
+from ch2.data.frame import DEFAULT_CHUNKSIZE
 from ch2.names import N
 from ch2.pipeline.calculate import SummaryCalculator, ElevationCalculator
 from ch2.pipeline.calculate.power import PowerCalculator
 from ch2.pipeline.read.activity import ActivityReader
-from ch2.sql import StatisticName, StatisticJournal, StatisticJournalType
+from ch2.sql import StatisticName, StatisticJournalType
+from ch2.sql.tables.statistic import STATISTIC_JOURNAL_CLASSES
 from ch2.sql.types import short_cls
 
 
@@ -25,11 +27,13 @@ class Statistics:
 
     def read_values(self, request, s, name):
         statistic_name = self._resolve_name(request, s, name)
-        values = s.query(StatisticJournal). \
-            filter(StatisticJournal.statistic_name == statistic_name). \
-            order_by(StatisticJournal.time)
-        return [{'date': time_to_local_time(value.time),
-                 'value': value.value} for value in values]
+        journal = STATISTIC_JOURNAL_CLASSES[statistic_name.statistic_journal_type]
+        # stream (time, value) pairs rather than loading every (polymorphic) journal entry
+        values = s.query(journal.time, journal.value). \
+            filter(journal.statistic_name_id == statistic_name.id). \
+            order_by(journal.time).yield_per(DEFAULT_CHUNKSIZE)
+        return [{'date': time_to_local_time(time),
+                 'value': value} for time, value in values]
 
     def _resolve_name(self, request, s, name):
         owner = request.args.get('owner', None)
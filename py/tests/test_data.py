@@ -1,7 +1,11 @@
 from json import loads
 
+import pandas as pd
+
 from ch2.commands.args import V, bootstrap_db
 from ch2.common.args import m
+from ch2.common.date import to_time
+from ch2.data.query import Statistics
 from ch2.lib.data import MutableAttr, reftuple
 from ch2.sql import StatisticJournalFloat, StatisticJournalText, Source
 from ch2.sql.tables.source import SourceType
@@ -37,3 +41,34 @@ class TestData(LogTestCase):
         from ch2.pipeline.calculate.power import PowerModel, BikeModel
         self.assertEqual(BikeModel.__module__, 'ch2.pipeline.calculate.power')
         self.assertEqual(PowerModel.__module__, 'ch2.pipeline.calculate.power')
+
+    def test_pivot(self):
+        from ch2.data.query import pivot
+        times = pd.to_datetime([1, 2, 3, 4], unit='s', utc=True)
+        a = pd.DataFrame({'a': [1, 2, 3]}, index=times[:3])
+        b = pd.DataFrame({'b': [1.5, 2.5]}, index=times[2:])
+        c = pd.DataFrame({'c': ['x', 'y', 'z', 'w']}, index=times)
+        expected = a.join(b, how='outer').join(c, how='outer')
+        pd.testing.assert_frame_equal(pivot([a, b, c]), expected, check_names=False, check_freq=False)
+
+    def test_missing_name(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with config.db.session_context() as s:
+            source = Source(type=SourceType.SOURCE)
+            s.add(source)
+            StatisticJournalFloat.add(s, 'weight', None, None, self, source, 13, '1980-01-01')
+            StatisticJournalFloat.add(s, 'height', None, None, self, source, 1.8, '2000-01-01')
+        with config.db.session_context() as s:
+            finish = to_time('1990-01-01')
+            # height has no values before finish and unknown does not exist
+            df = Statistics(s, finish=finish).by_name(self, 'weight', 'height', 'unknown').df
+            self.assertEqual(list(df.columns), ['weight', 'height'])
+            self.assertIsInstance(df.index, pd.DatetimeIndex)
+            self.assertEqual(df['weight'].tolist(), [13])
+            self.assertTrue(df['height'].isna().all())
+            df = Statistics(s, finish=finish).by_name(self, 'height').df
+            self.assertTrue(df.empty)
+            self.assertEqual(list(df.columns), ['height'])
+            self.assertIsInstance(df.index, pd.DatetimeIndex)
+            self.assertEqual(str(df.index.tz), 'UTC')
@@ -174,3 +174,129 @@ class TestFit(LogTestCase, OutputMixin):
 
         self.assertAlmostEqual(positions[0][0], -33.42, places=1)
         self.assertAlmostEqual(positions[0][1], -70.61, places=1)
+
+    def test_zero_copy(self):
+        from ch2.fit.format.read import parse_data
+
+        data = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
+        _nlog, types, messages = read_external_profile(self.profile_path)
+        state, tokens = parse_data(data, types, messages)
+        n = 0
+        for offset, token in tokens:
+            # tokens are views into the original data, not copies
+            self.assertIsInstance(token.data, memoryview)
+            self.assertEqual(bytes(token.data), data[offset:offset+len(token)])
+            n += 1
+        self.assertGreater(n, 1000)
+
+    def test_columnar(self):
+        from math import isnan
+        from ch2.fit.format.read import columnar_records, TIMESTAMP
+        from ch2.fit.format.records import merge_duplicates
+
+        data = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
+        names = ('position_lat', 'heart_rate', 'distance')
+        types, messages, columns, others = \
+            columnar_records(data, names, other_names=('event',), profile_path=self.profile_path)
+        types, messages, records = filtered_records(data, profile_path=self.profile_path)
+        records = [record.as_dict(merge_duplicates, fix_degrees, no_bad_values) for _, _, record in records]
+        expected = [record for record in records if record.name == 'record']
+        self.assertEqual(len(columns[TIMESTAMP]), len(expected))
+        for i, record in enumerate(expected):
+            self.assertEqual(columns[TIMESTAMP][i], record.timestamp.timestamp())
+            for name in names:
+                if name in record.data:
+                    self.assertEqual(columns[name][i], record.data[name][0][0])
+                else:
+                    self.assertTrue(isnan(columns[name][i]))
+        self.assertEqual([record.data for record in others],
+                         [record.data for record in records if record.name == 'event'])
+
+    def test_cache(self):
+        from os import stat, utime
+        from tempfile import TemporaryDirectory
+        from ch2.fit.cache import FitCache
+        from ch2.fit.format.read import columnar_records, TIMESTAMP
+
+        data = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
+        names, other_names = ('position_lat', 'heart_rate'), ('event', 'session')
+        types, messages, columns, others = \
+            columnar_records(data, names, other_names=other_names, profile_path=self.profile_path)
+        with TemporaryDirectory() as dir:
+            cache = FitCache(dir, profile_path=self.profile_path)
+            self.assertIsNone(cache.read('abc', names, other_names))
+            cache.write('abc', names, other_names, columns, others)
+            self.assertIsNone(cache.read('abc', names[1:], other_names))
+            cached_columns, cached_others = cache.read('abc', names, other_names)
+            self.assertEqual(list(cached_columns[TIMESTAMP]), list(columns[TIMESTAMP]))
+            self.assertEqual(list(cached_columns['heart_rate']), list(columns['heart_rate']))
+            self.assertEqual([record.data for record in cached_others], [record.data for record in others])
+            self.assertEqual(cached_others[0].value.timestamp, others[0].value.timestamp)
+            FitCache(dir, max_mb=0, profile_path=self.profile_path).write('def', names, other_names, columns, others)
+            self.assertIsNone(cache.read('abc', names, other_names))
+            # after the first scan, a running total triggers eviction once the cache is full
+            cache.write('abc', names, other_names, columns, others)
+            (path,) = glob(join(dir, '*.npz'))
+            utime(path, (0, 0))  # least recently used
+            size = stat(path).st_size
+            cache = FitCache(dir, max_mb=2.5 * size / 1024 ** 2, profile_path=self.profile_path)
+            cache.write('def', names, other_names, columns, others)
+            self.assertIsNotNone(cache.read('abc', names, other_names))
+            self.assertIsNotNone(cache.read('def', names, other_names))
+            utime(path, (0, 0))
+            cache.write('ghi', names, other_names, columns, others)
+            self.assertIsNone(cache.read('abc', names, other_names))
+            self.assertIsNotNone(cache.read('ghi', names, other_names))
+
+    def test_compiled_decoder(self):
+        from types import SimpleNamespace
+        from ch2.fit.format.read import parse_data
+        from ch2.fit.format.tokens import Decoder
+
+        # every compiled field must agree with the per-field parser
+        data = read_fit(join(self.test_dir, 'source/personal/2018-07-26-rec.fit'))
+        _nlog, types, messages = read_external_profile(self.profile_path)
+        state, tokens = parse_data(data, types, messages)
+        n = 0
+        for _, token in tokens:
+            definition = getattr(token, 'definition', None)  # data tokens only
+            if not definition or not definition.decoder: continue
+            decoded = definition
+            for field, compiled in zip(definition.fields, definition.decoder.decode(token.data)):
+                if compiled is None: continue
+                expected = next(definition.message._parse_field(
+                    field.field, token.data[field.start:field.finish], field.count, definition.endian,
+                    token.timestamp, {}, definition.message))
+                self.assertEqual(repr(compiled), repr(expected))  # repr so that nans compare
+                n += 1
+        self.assertGreater(n, 1000)
+        # a struct that does not match the data is not used
+        inconsistent = SimpleNamespace(endian=decoded.endian, fields=decoded.fields,
+                                       size=decoded.size + 1, identity=decoded.identity)
+        self.assertIsNotNone(Decoder.compile(decoded))
+        self.assertIsNone(Decoder.compile(inconsistent))
+
+    def test_compiled_scaled(self):
+        from struct import pack, Struct
+        from ch2.fit.format.tokens import CompiledField, Field
+        from ch2.fit.profile.fields import ScaledField
+        from ch2.fit.profile.types import AutoFloat, AutoInteger, LITTLE
+
+        # scaled arrays (with isolated bad values) and floats, which are not in the test file above
+        for leaf, format, values in ((AutoFloat(log, 'float32'), 'f', (1.5, None, 3.0)),
+                                     (AutoFloat(log, 'float32'), 'f', (None, None)),
+                                     (AutoFloat(log, 'float32'), 'f', (2.5,)),
+                                     (AutoInteger(log, 'uint16'), 'H', (10, None, 30)),
+                                     (AutoInteger(log, 'uint16'), 'H', (None, None, None)),
+                                     (AutoInteger(log, 'sint8'), 'b', (-3,))):
+            for scale, offset in ((1, 0), (10, 0), (5, 1)):
+                bad = leaf.bad_bytes(LITTLE)
+                data = b'\x00' + b''.join(bad if value is None else pack('<' + format, value)
+                                          for value in values)
+                scaled = ScaledField(log, 'example', 'm', scale, offset, 0)
+                field = Field(len(data) - 1, scaled, leaf)
+                field.start, field.finish = 1, len(data)
+                compiled = CompiledField(field, leaf, None, 0, LITTLE)
+                unpacked = Struct('<%d%s' % (len(values), format)).unpack_from(data, 1)
+                expected = next(scaled._parse_and_scale(leaf, data[1:], len(values), LITTLE, None))
+                self.assertEqual(repr(compiled.decode(data, unpacked, True, False)), repr(expected))
@@ -2,7 +2,7 @@ from os.path import join
 
 from ch2.commands.args import RECORDS
 from ch2.fit.fix import fix
-from ch2.fit.format.tokens import FileHeader
+from ch2.fit.format.tokens import FileHeader, Checksum, Crc
 from ch2.fit.profile.profile import read_fit
 from ch2.fit.summary import summarize
 from ch2.lib.tests import OutputMixin
@@ -15,6 +15,13 @@ class TestFixFit(LogTestCase, OutputMixin):
         self.test_dir = 'data/test'
         self.profile_path = 'data/sdk/Profile.xlsx'
 
+    def test_crc(self):
+        self.assertEqual(Checksum.crc(b'123456789'), 0xbb3d)  # standard check value for CRC-16/ARC
+        good = read_fit(join(self.test_dir, 'source/personal/2018-08-27-rec.fit'))
+        crc = Crc(good[:101])
+        self.assertEqual(crc.copy().update(good[101:-2]).checksum, Checksum(good[-2:]).checksum)
+        self.assertEqual(crc.checksum, Checksum.crc(good[:101]))
+
     def test_null(self):
         good = read_fit(join(self.test_dir, 'source/personal/2018-08-27-rec.fit'))
         same = fix(bytearray(good))
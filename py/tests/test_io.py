@@ -0,0 +1,83 @@
+import datetime as dt
+from os import stat, utime, replace
+from os.path import join
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import ch2.lib.io
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.common.date import to_time
+from ch2.common.io import file_hash
+from ch2.lib.io import modified_file_scans
+from ch2.sql.tables.file import FileScan
+from ch2.sql.tables.topic import DiaryTopicJournal
+from tests import LogTestCase, random_test_user
+
+OWNER = DiaryTopicJournal
+
+
+class TestFileScan(LogTestCase):
+
+    def scan(self, s, path):
+        # the modified scans, and whether the hash was calculated
+        with patch.object(ch2.lib.io, 'file_hash', wraps=file_hash) as hashed:
+            modified = modified_file_scans(s, [path], OWNER)
+        return [file_scan.path for file_scan in modified], hashed.called
+
+    def mark_read(self, s, path):
+        file_scan = s.query(FileScan).filter(FileScan.path == path).one()
+        file_scan.last_scan = to_time(stat(path).st_mtime) + dt.timedelta(seconds=1)
+        s.commit()
+        return file_scan
+
+    def write(self, path, data, mtime=None):
+        with open(path, 'w') as output:
+            output.write(data)
+        if mtime: utime(path, (mtime, mtime))
+
+    def test_stat(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with TemporaryDirectory() as dir, config.db.session_context() as s:
+            path, mtime = join(dir, 'a.fit'), 1600000000.0
+            self.write(path, 'hello', mtime)
+
+            # a new path is hashed, stored with its stat, and modified
+            self.assertEqual(self.scan(s, path), ([path], True))
+            file_scan = self.mark_read(s, path)
+            self.assertTrue(file_scan.same_stat(stat(path)))
+            hash = file_scan.file_hash.hash
+
+            # unchanged stat - no hash and not modified
+            self.assertEqual(self.scan(s, path), ([], False))
+
+            # a later mtime with the same content is hashed, but only the mtime changes
+            utime(path, (mtime + 60, mtime + 60))
+            self.assertEqual(self.scan(s, path), ([path], True))
+            self.assertEqual(file_scan.file_hash.hash, hash)
+            self.assertEqual(file_scan.mtime, mtime + 60)
+            self.mark_read(s, path)
+
+            # a different recorded size (or no stat, as for scans from before the stat was stored) is hashed
+            for size in (file_scan.size + 1, None):
+                file_scan.size = size
+                s.commit()
+                self.assertEqual(self.scan(s, path), ([], True))
+                self.assertEqual(file_scan.file_hash.hash, hash)
+                self.assertEqual(file_scan.size, stat(path).st_size)
+
+            # a new inode (file replaced, same content and mtime) is hashed, but not modified
+            inode, tmp = file_scan.inode, join(dir, 'tmp')
+            self.write(tmp, 'hello', mtime + 60)
+            replace(tmp, path)
+            self.assertNotEqual(stat(path).st_ino, inode)
+            self.assertEqual(self.scan(s, path), ([], True))
+            self.assertEqual(file_scan.file_hash.hash, hash)
+            self.assertEqual(file_scan.inode, stat(path).st_ino)
+
+            # new content with the same size and mtime (but a new inode) is a new hash and modified
+            self.write(tmp, 'world', mtime + 60)
+            replace(tmp, path)
+            self.assertEqual(self.scan(s, path), ([path], True))
+            self.assertNotEqual(file_scan.file_hash.hash, hash)
@@ -0,0 +1,141 @@
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.common.date import to_time
+from ch2.data import Statistics
+from ch2.pipeline.loader import Loader, Staged
+from ch2.sql import FileHash
+from ch2.sql.tables.activity import ActivityGroup, ActivityJournal
+from ch2.sql.tables.series import StatisticSeries
+from ch2.sql.tables.statistic import StatisticName, StatisticJournalType, StatisticJournalInteger, \
+    StatisticJournalFloat, StatisticJournalText, StatisticJournal
+from ch2.sql.tables.topic import DiaryTopicJournal
+from ch2.sql.utils import add
+from tests import LogTestCase, random_test_user
+
+INTEGER, FLOAT = 'integer', 'float'
+
+
+class TestStaged(LogTestCase):
+
+    def staged(self, type):
+        return Staged(StatisticName(name='test', statistic_journal_type=type))
+
+    def test_types(self):
+        integer = self.staged(StatisticJournalType.INTEGER)
+        self.assertEqual(integer.journal_class, StatisticJournalInteger)
+        integer.append(1.0, 2.6, 0, None)
+        self.assertEqual(integer.value(0), 3)
+        self.assertIsInstance(integer.value(0), int)
+        self.assertIsNone(integer.serial(0))
+        integer.append(2.0, 2**53 + 1, 0, None)  # not representable as a float
+        self.assertEqual(integer.value(1), 2**53 + 1)
+        real = self.staged(StatisticJournalType.FLOAT)
+        self.assertEqual(real.journal_class, StatisticJournalFloat)
+        real.append(1.0, 2.6, 0, 7)
+        self.assertEqual(real.value(0), 2.6)
+        self.assertEqual(real.serial(0), 7)
+        text = self.staged(StatisticJournalType.TEXT)
+        self.assertEqual(text.journal_class, StatisticJournalText)
+        text.append(1.0, 'hello', 0, None)
+        self.assertEqual(text.value(0), 'hello')
+
+    def test_extend(self):
+        integer = self.staged(StatisticJournalType.INTEGER)
+        integer.extend(np.array([1.0, 2.0]), np.array([1.4, 1.6]), 2, np.array([0, 1]))
+        self.assertEqual([integer.value(i) for i in range(len(integer))], [1, 2])
+        self.assertEqual(list(integer.sources), [2, 2])
+
+    def test_deduplicate(self):
+        real = self.staged(StatisticJournalType.FLOAT)
+        for time, value in ((3, 1.0), (1, 2.0), (3, 1.0), (2, 3.0), (1, 4.0)):
+            real.append(float(time), value, 0, None)
+        conflicts = []
+        real.deduplicate(lambda *args: conflicts.append(args))
+        # the exact duplicate is discarded silently; the conflict is passed to resolve (and the later value dropped)
+        self.assertEqual(conflicts, [('test', to_time(1.0), 4.0, 2.0)])
+        self.assertEqual(list(real.times), [3.0, 1.0, 2.0])
+        self.assertEqual(list(real.values), [1.0, 2.0, 3.0])
+        integer = self.staged(StatisticJournalType.INTEGER)
+        for time, value in ((1, 2**53 + 1), (1, 2**53 + 1), (2, 3)):
+            integer.append(float(time), value, 0, None)
+        integer.deduplicate(lambda *args: conflicts.append(args))
+        self.assertEqual(list(integer.values), [2**53 + 1, 3])
+
+
+class TestLoader(LogTestCase):
+
+    def values(self, loader):
+        return sorted((journal.statistic_name.name, journal.time, journal.value, type(journal.value), journal.serial)
+                      for journal in loader.instances())
+
+    def test_loader(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with config.db.session_context() as s:
+            source = add(s, DiaryTopicJournal(date='2020-01-01'))
+            StatisticName.add_if_missing(s, INTEGER, StatisticJournalType.INTEGER, None, None, DiaryTopicJournal)
+            StatisticName.add_if_missing(s, FLOAT, StatisticJournalType.FLOAT, None, None, DiaryTopicJournal)
+            s.flush()
+            start = to_time('2020-01-01 12:00:00')
+            df = pd.DataFrame({'a': [1.0, np.nan, 3.4, 4.0], 'b': [0.5, np.nan, np.nan, 2.5]},
+                              index=pd.DatetimeIndex([start + dt.timedelta(seconds=t) for t in (0, 1, 1, 3)]))
+
+            # add_frame is equivalent to add_data in time order
+            by_frame = Loader(s, DiaryTopicJournal, copy=False)
+            by_frame.add_frame(df, {'a': INTEGER, 'b': FLOAT, 'missing': 'other'}, source)
+            by_value = Loader(s, DiaryTopicJournal, copy=False)
+            for time, row in df.iterrows():
+                for column, name in (('a', INTEGER), ('b', FLOAT)):
+                    if not np.isnan(row[column]):
+                        by_value.add_data(name, source, row[column], time)
+            values = self.values(by_frame)
+            self.assertEqual(values, self.values(by_value))
+            self.assertEqual([value for name, _, value, _, _ in values if name == INTEGER], [1, 3, 4])
+            self.assertTrue(all(kind is int for name, _, _, kind, _ in values if name == INTEGER))
+            self.assertEqual([serial for name, _, _, _, serial in values if name == INTEGER], [0, 1, 2])
+            self.assertEqual(dict(by_frame.coverage_percentages()), {INTEGER: 100, FLOAT: 200 / 3})
+
+            # duplicates are dropped if equal, otherwise an error
+            loader = Loader(s, DiaryTopicJournal, copy=False)
+            loader.add_data(FLOAT, source, 1.0, start)
+            loader.add_data(FLOAT, source, 1.0, start.replace(tzinfo=None))  # naive times are UTC
+            self.assertEqual(len(list(loader.instances())), 2)  # not deduplicated until needed
+            self.assertEqual(dict(loader.coverage_percentages()), {FLOAT: 100})
+            self.assertEqual(len(list(loader.instances())), 1)
+            loader.add_data(FLOAT, source, 2.0, start)
+            with self.assertRaisesRegex(Exception, 'Conflict'):
+                loader.load()
+            s.rollback()
+
+    def test_series(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with config.db.session_context() as s:
+            start = to_time('2020-01-01 12:00:00')
+            times = [start + dt.timedelta(seconds=t) for t in (0, 1, 3)]
+            source = add(s, ActivityJournal(activity_group=add(s, ActivityGroup(name='test', sort=99)),
+                                            file_hash=FileHash.get_or_add(s, 'test'),
+                                            start=times[0], finish=times[-1]))
+            StatisticName.add_if_missing(s, INTEGER, StatisticJournalType.INTEGER, None, None, ActivityJournal)
+            StatisticName.add_if_missing(s, FLOAT, StatisticJournalType.FLOAT, None, None, ActivityJournal)
+            s.commit()
+            loader = Loader(s, ActivityJournal, series=True)
+            for time, value in zip(times, (1.5, 2.5, 3.5)):
+                loader.add_data(FLOAT, source, value, time)
+            loader.add_data(INTEGER, source, 42, times[0])  # a scalar, which stays in statistic_journal
+            loader.load()
+        with config.db.session_context() as s:
+            self.assertEqual(s.query(StatisticSeries).count(), 1)
+            names = [journal.statistic_name.name for journal in s.query(StatisticJournal).all()]
+            self.assertIn(INTEGER, names)
+            self.assertNotIn(FLOAT, names)
+            df = Statistics(s).by_name(ActivityJournal, FLOAT, INTEGER).df
+            self.assertEqual(list(df.index), times)
+            self.assertEqual(list(df[FLOAT]), [1.5, 2.5, 3.5])
+            self.assertEqual(df[INTEGER].iloc[0], 42)
+            self.assertTrue(df[INTEGER].iloc[1:].isna().all())
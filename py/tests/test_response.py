@@ -0,0 +1,73 @@
+import datetime as dt
+from math import log10
+
+import numpy as np
+import pandas as pd
+
+from ch2.common.date import to_time
+from ch2.data.response import sum_to_hour, calc_response, continue_response
+from ch2.names import N
+from ch2.pipeline.calculate.response import ResponseCalculator, SCALED
+from ch2.sql import Composite, CompositeComponent
+from tests import LogTestCase
+
+
+class Session:
+    # just enough for ResponseCalculator.__make_sources
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, instance):
+        self.added.append(instance)
+
+    def commit(self):
+        pass
+
+
+class TestResponse(LogTestCase):
+
+    def impulses(self):
+        # irregular impulses over a few days, some exactly on the hour
+        rng = np.random.default_rng(42)
+        start = to_time('2020-01-01 00:00:00')
+        seconds = np.sort(rng.choice(4 * 24 * 3600, size=300, replace=False))
+        times = [start + dt.timedelta(seconds=int(second)) for second in seconds]
+        times[10] = start + dt.timedelta(hours=30)
+        times = sorted(times)
+        return pd.DataFrame({SCALED: rng.uniform(0, 10, len(times))}, index=pd.DatetimeIndex(times))
+
+    def test_continue(self):
+        data, period = self.impulses(), 7 * 24
+        full = calc_response(sum_to_hour(data, SCALED), (log10(period), log10(20)))
+        hour = to_time('2020-01-02 06:00:00')  # has an impulse exactly on the hour
+        for restart in (full.index[5], hour, full.index[len(full) // 2], full.index[-3]):
+            # as in ResponseCalculator._run_one
+            later = data.loc[data.index >= restart]
+            impulses = pd.concat([pd.DataFrame({SCALED: [0.0]}, index=[restart]), later])
+            imp3600 = sum_to_hour(impulses, SCALED)
+            self.assertEqual(imp3600.index[0], restart)
+            partial = continue_response(imp3600, period, full[restart])
+            self.assertEqual(list(partial.index), list(full.loc[full.index >= restart].index))
+            np.testing.assert_allclose(partial.values, full.loc[full.index >= restart].values, rtol=1e-9)
+
+    def test_extend_chain(self):
+        start = to_time('2020-01-01 12:00:00')
+        name = N._src(N.HR_IMPULSE_10)
+        times = [start + dt.timedelta(minutes=m) for m in (5, 6, 70, 71, 200)]
+        data = pd.DataFrame({name: [11, 11, 12, 12, np.nan]}, index=pd.DatetimeIndex(times))
+        prev, s = Composite(n_components=2), Session()
+        sources = list(ResponseCalculator._ResponseCalculator__make_sources(None, s, data, prev=prev, start=start))
+        # the chain continues from prev (no new root)
+        self.assertEqual(sources[0], (start, prev))
+        self.assertEqual([time for time, _ in sources[1:]], [times[0], times[2], times[4]])
+        composites = [instance for instance in s.added if isinstance(instance, Composite)]
+        self.assertEqual([composite.n_components for composite in composites], [2, 2, 1])
+        links = [(component.input_source, component.output_source) for component in s.added
+                 if isinstance(component, CompositeComponent) and component.input_source is not None]
+        self.assertEqual(links, list(zip([prev] + composites[:-1], composites)))
+        # without prev a new chain is started
+        s = Session()
+        sources = list(ResponseCalculator._ResponseCalculator__make_sources(None, s, data))
+        self.assertEqual(sources[0][0], to_time(0.0))
+        self.assertEqual(s.added[0].n_components, 0)
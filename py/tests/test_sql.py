@@ -1,7 +1,17 @@
 from logging import getLogger
 
+from sqlalchemy.sql.functions import count
+
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.common.date import to_time
+from ch2.config.database import partition_statistic_journal, add_statistic_journal_partitions
 from ch2.names import SPACE, simple_name
-from tests import LogTestCase
+from ch2.sql.tables.statistic import StatisticJournal, StatisticJournalFloat, StatisticJournalType, \
+    StatisticMeasure, StatisticName
+from ch2.sql.tables.topic import DiaryTopicJournal
+from ch2.sql.utils import add
+from tests import LogTestCase, random_test_user
 
 log = getLogger(__name__)
 
@@ -13,3 +23,67 @@ class TestName(LogTestCase):
         self.assertEqual(simple_name('****'), SPACE)
         self.assertEqual(simple_name('123'), '-123')
         self.assertEqual(simple_name('Fitness 7d'), 'fitness-7d')
+
+
+class TestSeries(LogTestCase):
+
+    def test_encode(self):
+        import numpy as np
+        from ch2.sql import StatisticSeries
+        times, values, serials = np.array([1.5e9, 1.5e9 + 1]), np.array([1.0, 2.5]), np.array([0, 1])
+        series = StatisticSeries(data=StatisticSeries.encode({3: (times * 1e6, values, serials)}))
+        arrays = series.decode()
+        self.assertEqual(list(arrays.keys()), [3])
+        self.assertEqual(list(arrays[3][0]), list(times * 1e6))
+        self.assertEqual(list(arrays[3][1]), list(values))
+        self.assertEqual(list(arrays[3][2]), list(serials))
+
+
+class TestPartition(LogTestCase):
+
+    def test_cascade(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with config.db.session_context() as s:
+            partition_statistic_journal(s, first_year=2018, last_year=2020)
+        with config.db.session_context() as s:
+            source = add(s, DiaryTopicJournal(date='2019-06-01'))
+            name = StatisticName.add_if_missing(s, 'weight', StatisticJournalType.FLOAT, None, None,
+                                                DiaryTopicJournal)
+            for time in ('2019-06-01 12:00:00', '2030-01-01 00:00:00'):
+                journal = add(s, StatisticJournalFloat(statistic_name=name, source=source, value=64.5,
+                                                       time=to_time(time)))
+            add(s, StatisticMeasure(statistic_journal=journal, source=source, rank=1, percentile=100))
+        with config.db.session_context() as s:
+            self.assertEqual(s.execute('select count(*) from statistic_journal_2019').scalar(), 1)
+            self.assertEqual(s.execute('select count(*) from statistic_journal_default').scalar(), 1)
+            self.assertEqual(s.query(count(StatisticJournalFloat.id)).scalar(), 2)
+            self.assertEqual(s.query(count(StatisticMeasure.id)).scalar(), 1)
+            s.delete(s.query(DiaryTopicJournal).one())
+        with config.db.session_context() as s:
+            # the foreign keys from the typed tables and measures were replaced by triggers
+            self.assertEqual(s.query(count(StatisticJournal.id)).scalar(), 0)
+            self.assertEqual(s.query(count(StatisticJournalFloat.id)).scalar(), 0)
+            self.assertEqual(s.query(count(StatisticMeasure.id)).scalar(), 0)
+
+    def test_add_years(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        with config.db.session_context() as s:
+            partition_statistic_journal(s, first_year=2018, last_year=2019)
+        with config.db.session_context() as s:
+            source = add(s, DiaryTopicJournal(date='2019-06-01'))
+            name = StatisticName.add_if_missing(s, 'weight', StatisticJournalType.FLOAT, None, None,
+                                                DiaryTopicJournal)
+            for time in ('2019-06-01 12:00:00', '2021-06-01 12:00:00', '2030-01-01 00:00:00'):
+                add(s, StatisticJournalFloat(statistic_name=name, source=source, value=64.5, time=to_time(time)))
+        with config.db.session_context() as s:
+            self.assertEqual(s.execute('select count(*) from statistic_journal_default').scalar(), 2)
+            add_statistic_journal_partitions(s, last_year=2021)
+        with config.db.session_context() as s:
+            # the value in the new year was moved out of the default partition
+            self.assertEqual(s.execute('select count(*) from statistic_journal_2020').scalar(), 0)
+            self.assertEqual(s.execute('select count(*) from statistic_journal_2021').scalar(), 1)
+            self.assertEqual(s.execute('select count(*) from statistic_journal_default').scalar(), 1)
+            self.assertEqual(len(s.query(StatisticJournalFloat).all()), 3)
+            add_statistic_journal_partitions(s, last_year=2021)  # nothing to do
@@ -0,0 +1,123 @@
+import datetime as dt
+from random import seed
+
+from ch2.commands.args import V, bootstrap_db
+from ch2.common.args import m
+from ch2.common.date import local_date_to_time
+from ch2.names import Summaries as S, simple_name
+from ch2.pipeline.calculate.summary import SummaryCalculator, fuzz
+from ch2.sql import FileHash
+from ch2.sql.tables.activity import ActivityGroup, ActivityJournal
+from ch2.sql.tables.source import Interval
+from ch2.sql.tables.statistic import StatisticJournalFloat, StatisticMeasure, StatisticJournal, StatisticName
+from ch2.sql.tables.topic import DiaryTopicJournal
+from ch2.sql.utils import add
+from tests import LogTestCase, random_test_user
+
+START = dt.date(2020, 1, 1)
+
+
+def expected_measures(values, order_asc):
+    # the original implementation, which sorted and ranked in python
+    data = sorted(values, reverse=not order_asc)
+    n, measures = len(data), {}
+    for rank, value in enumerate(data, start=1):
+        percentile = (n - rank) / (n - 1) * 100 if n > 1 else 100
+        measures[value] = [rank, percentile, None]
+    if n > 8:
+        for q in range(5):
+            measures[data[fuzz(n, q)]][2] = q
+    return measures
+
+
+class TestSummary(LogTestCase):
+
+    def sources(self, s, n):
+        group = add(s, ActivityGroup(name='test', sort=99))
+        grouped = [add(s, ActivityJournal(activity_group=group, file_hash=FileHash.get_or_add(s, f'test-{i}'),
+                                          start=local_date_to_time(START) + dt.timedelta(hours=i),
+                                          finish=local_date_to_time(START) + dt.timedelta(hours=i, minutes=30)))
+                   for i in range(n)]
+        ungrouped = [add(s, DiaryTopicJournal(date=START + dt.timedelta(days=i))) for i in range(n)]
+        return group, grouped, ungrouped
+
+    def add_values(self, s, name, summary, sources, values):
+        for i, (source, value) in enumerate(zip(sources, values)):
+            StatisticJournalFloat.add(s, name, None, summary, DiaryTopicJournal, source, value,
+                                      local_date_to_time(START) + dt.timedelta(hours=i, minutes=10))
+
+    def interval(self, s, calculator, group):
+        return add(s, Interval(schedule=calculator.schedule, owner=calculator.owner_out, start=START,
+                               activity_group=group))
+
+    def test_measures(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        calculator = SummaryCalculator(config, schedule='y')
+        values = [7.5, 3.0, 11.0, 1.5, 9.0, 4.0, 2.5, 10.0, 6.0, 8.5, 0.5, 5.0]  # distinct, so ranks are unique
+        with config.db.session_context() as s:
+            group, grouped, ungrouped = self.sources(s, len(values))
+            for n in (1, 5, 8, len(values)):
+                for label, sources in (('grouped', grouped), ('ungrouped', ungrouped)):
+                    self.add_values(s, f'{label}_{n}', S.MSR, sources, values[:n])
+            s.commit()
+            start, finish = local_date_to_time(START), local_date_to_time(START + dt.timedelta(days=366))
+            for label, sources, activity_group in (('grouped', grouped, group), ('ungrouped', ungrouped, None)):
+                interval = self.interval(s, calculator, activity_group)
+                s.commit()
+                for n in (1, 5, 8, len(values)):
+                    statistic_name = StatisticName.from_name(s, f'{label}_{n}', DiaryTopicJournal)
+                    for order_asc in (True, False):
+                        seed(n)
+                        calculator._calculate_measures(s, statistic_name, order_asc, start, finish, interval)
+                        seed(n)
+                        expected = expected_measures(values[:n], order_asc)
+                        found = {measure.statistic_journal.value:
+                                     [measure.rank, measure.percentile, measure.quartile]
+                                 for measure in s.query(StatisticMeasure).join(StatisticJournal).
+                                     filter(StatisticJournal.statistic_name == statistic_name).all()}
+                        self.assertEqual(found.keys(), expected.keys())
+                        for value in expected:
+                            self.assertEqual(found[value][0], expected[value][0])
+                            self.assertAlmostEqual(found[value][1], expected[value][1])
+                            self.assertEqual(found[value][2], expected[value][2])
+                        s.query(StatisticMeasure).delete()
+                        s.commit()
+
+    def test_values(self):
+        user = random_test_user()
+        config = bootstrap_db(user, m(V), '5')
+        calculator = SummaryCalculator(config, schedule='y')
+        summary = S.join(S.MAX, S.MIN, S.SUM, S.CNT, S.AVG)
+        with config.db.session_context() as s:
+            group, grouped, ungrouped = self.sources(s, 3)
+            self.add_values(s, 'both', summary, grouped, [1.0, 2.0, 6.0])
+            self.add_values(s, 'both', summary, ungrouped, [10.0, 20.0])
+            self.add_values(s, 'ungrouped', summary, ungrouped, [5.0])
+            s.commit()
+            names = [StatisticName.from_name(s, name, DiaryTopicJournal) for name in ('both', 'ungrouped')]
+            start, finish = local_date_to_time(START), local_date_to_time(START + dt.timedelta(days=366))
+
+            # one grouped query per journal type, constrained by activity group
+            grouped_interval = self.interval(s, calculator, group)
+            s.commit()
+            values = calculator._calculate_values(s, names, start, finish, grouped_interval)
+            both = names[0].id
+            self.assertEqual(values, {(both, S.MAX): 6.0, (both, S.MIN): 1.0, (both, S.SUM): 9.0,
+                                      (both, S.CNT): 3, (both, S.AVG): 3.0})
+            interval = self.interval(s, calculator, None)
+            s.commit()
+            values = calculator._calculate_values(s, names, start, finish, interval)
+            self.assertEqual(values[(both, S.SUM)], 30.0)
+            self.assertEqual(values[(names[1].id, S.CNT)], 1)
+
+            # names with no data in the group have a count of zero (and no other summaries)
+            loader = calculator._get_loader(s, add_serial=False)
+            calculator._calculate_results(s, grouped_interval, names, loader)
+            results = {journal.statistic_name.name: journal.value for journal in loader.instances()}
+            title = simple_name(SummaryCalculator.fmt_title('ungrouped', S.CNT, calculator.schedule))
+            self.assertEqual(results[title], 0)
+            for summary in (S.MAX, S.MIN, S.SUM, S.AVG):
+                self.assertNotIn(simple_name(SummaryCalculator.fmt_title('ungrouped', summary, calculator.schedule)),
+                                 results)
+            self.assertEqual(results[simple_name(SummaryCalculator.fmt_title('both', S.CNT, calculator.schedule))], 3)
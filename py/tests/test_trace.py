@@ -0,0 +1,27 @@
+from json import loads
+from os import getpid
+from os.path import join
+from tempfile import TemporaryDirectory
+
+from tests import LogTestCase
+
+from ch2.lib.trace import Tracer, count, PIPELINE, WRITTEN
+
+
+class TestTrace(LogTestCase):
+
+    def test_nested(self):
+        with TemporaryDirectory() as dir:
+            tracer = Tracer(dir)
+            with tracer.span('run', 'pipeline', **{PIPELINE: 'Example'}):
+                with tracer.span('load', 'pipeline'):
+                    count(written=10)
+            with open(join(dir, f'{getpid()}.jsonl')) as input:
+                events = [loads(line) for line in input]
+        self.assertEqual([event['name'] for event in events], ['load', 'run'])
+        for event in events:
+            self.assertEqual(event['ph'], 'X')
+            self.assertEqual(event['args'][PIPELINE], 'Example')
+            self.assertEqual(event['args'][WRITTEN], 10)
+        load, run = events
+        self.assertLessEqual(run['ts'], load['ts'])